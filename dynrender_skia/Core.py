@@ -7,18 +7,24 @@
 """
 
 import asyncio
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 from dynamicadaptor.Message import RenderMessage
 
 from .DynAdditional import BiliAdditional
+from .DynCache import AssetCache, flush_sticker_atlases, get_sticker_atlas
 from .DynConfig import MakeStaticFile, SetDynStyle
+from .DynFetcher import ImageFetcher, fetch_deadline
 from .DynHeader import BiliHeader, Footer
 from .DynMajor import BiliMajor
+from .DynPlanner import AssetPlanner
 from .DynRepost import BiliRepost
 from .DynText import BiliText
 from .DynTools import merge_pictures
 
+if TYPE_CHECKING:
+    from typing_extensions import Self
+
 
 class DynRender:
     def __init__(
@@ -27,6 +33,8 @@ class DynRender:
         emoji_font_family: str = "Noto Color Emoji",
         font_style: str = "Normal",
         static_path: Optional[str] = None,
+        fetcher: Optional[ImageFetcher] = None,
+        text_backend: str = "engine",
     ) -> None:
         """create static file and set font family and font style
 
@@ -36,23 +44,54 @@ class DynRender:
             Defaults to "Noto Sans CJK SC".
             font_style (str, optional): font style like "Normal、Bold、Italic、BoldItalic". Defaults to "Normal".
             static_path (str, optional): static file path,must be absolute path. Defaults to None.
+            fetcher (ImageFetcher, optional): shared image fetcher holding the HTTP connection pool.
+            Defaults to a pooled fetcher with an asset cache under the static path, owned and closed by this instance.
+            text_backend (str, optional): "engine" for the built-in text layout, or "paragraph" to lay out plain text
+            with skia.textlayout where it can. Defaults to "engine".
         """
         self.static_path = MakeStaticFile(static_path).check_cache_file
-        self.style = SetDynStyle(font_family, emoji_font_family, font_style).set_style
+        self.style = SetDynStyle(font_family, emoji_font_family, font_style, text_backend).set_style
+        self._owns_fetcher = fetcher is None
+        self.fetcher = fetcher or ImageFetcher(cache=AssetCache(self.static_path))
+
+    async def __aenter__(self) -> "Self":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """write pending sticker atlas changes and close the connection pool of the fetcher if it was created by this
+        instance"""
+        await flush_sticker_atlases(self.static_path, self.fetcher.executor)
+        if self._owns_fetcher:
+            await self.fetcher.aclose()
 
-    async def run(self, message: RenderMessage):
-        tasks = [BiliHeader(self.static_path, self.style).run(message.header)]
-        if message.text is not None:
-            tasks.append(BiliText(self.static_path, self.style).run(message.text))
-        if message.major is not None:
-            tasks.append(BiliMajor(self.static_path, self.style).run(message.major))
+    async def run(self, message: RenderMessage, timeout: Optional[float] = None):
+        """render a dynamic message into a single image
+
+        Args:
+            message (RenderMessage): the message to render.
+            timeout (float, optional): seconds every image fetch of this render may take in total, propagated to the
+            fetches of every section. Images still missing at the deadline are drawn as placeholders and their
+            downloads are cancelled. Defaults to None, waiting for every image.
+        """
+        with fetch_deadline(timeout):
+            icon_size = int(self.style.font.font_size.text * 1.5)
+            atlas = await get_sticker_atlas(self.static_path, icon_size, self.fetcher.executor)
+            await self.fetcher.prefetch(AssetPlanner(self.style, atlas).plan(message))
+            tasks = [BiliHeader(self.static_path, self.style, self.fetcher).run(message.header)]
+            if message.text is not None:
+                tasks.append(BiliText(self.static_path, self.style, self.fetcher).run(message.text))
+            if message.major is not None:
+                tasks.append(BiliMajor(self.static_path, self.style, self.fetcher).run(message.major))
 
-        if message.forward is not None:
-            tasks.append(BiliRepost(self.static_path, self.style).run(message.forward))
+            if message.forward is not None:
+                tasks.append(BiliRepost(self.static_path, self.style, self.fetcher).run(message.forward))
 
-        if message.additional is not None:
-            tasks.append(BiliAdditional(self.static_path, self.style).run(message.additional))
+            if message.additional is not None:
+                tasks.append(BiliAdditional(self.static_path, self.style, self.fetcher).run(message.additional))
 
-        tasks.append(Footer(self.static_path, self.style).run())
-        result = await asyncio.gather(*tasks)
+            tasks.append(Footer(self.static_path, self.style).run())
+            result = await asyncio.gather(*tasks)
         return await merge_pictures(result)
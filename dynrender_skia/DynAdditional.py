@@ -1,4 +1,3 @@
-import re
 from abc import ABC, abstractmethod
 from os import path
 from typing import Optional
@@ -9,22 +8,28 @@ from dynamicadaptor.AddonCard import Additional
 from loguru import logger
 
 from .DynConfig import PolyStyle
-from .DynTools import DrawText, get_pictures, paste
+from .DynFetcher import ImageFetcher
+from .DynFont import font_registry
+from .DynLayout import match_font
+from .DynPlanner import goods_cover_url
+from .DynTools import DrawText, paste, round_corner_image, run_in_executor
 
 
 class AbstractAdditional(ABC):
-    def __init__(self, src_path: str, style: PolyStyle, additional: Additional) -> None:
+    def __init__(
+        self, src_path: str, style: PolyStyle, additional: Additional, fetcher: Optional[ImageFetcher] = None
+    ) -> None:
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
         self.style = style
         self.additional = additional
         self.src_path = src_path
         self.canvas = None
-        self.text_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.drawer = DrawText(self.style)
+        self.text_font = font_registry.make_font(
+            self.style.font.font_family, self.style.font.font_style, self.style.font.font_size.text
         )
-        self.emoji_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.emoji_font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.emoji_font = font_registry.make_font(
+            self.style.font.emoji_font_family, self.style.font.font_style, self.style.font.font_size.text
         )
 
     @abstractmethod
@@ -34,14 +39,11 @@ class AbstractAdditional(ABC):
     async def make_badge(self, badge: str, font_size: int, pos: tuple, img_size: tuple, text_pos: tuple):
         text_font = self.text_font
         if text_font.textToGlyphs(text=badge[0])[0] == 0:  # type: ignore
-            if typeface := skia.FontMgr().matchFamilyStyleCharacter(
-                self.style.font.font_family,
-                self.style.font.font_style,
-                ["zh", "en"],
-                ord(badge[0]),
-            ):
-                text_font = skia.Font(typeface, self.style.font.font_size.text)
-        text_font.setSize(font_size)
+            text_font = (
+                match_font(self.style.font.font_family, self.style.font.font_style, badge[0], font_size) or text_font
+            )
+        if text_font is self.text_font:
+            text_font.setSize(font_size)
         surface = skia.Surface(*img_size)
         canvas = surface.getCanvas()
         canvas.clear(skia.Color(*self.style.color.font_color.name_big_vip))
@@ -56,20 +58,7 @@ class AbstractAdditional(ABC):
         await paste(self.canvas, tag_img, pos)
 
     async def make_round_cornor(self, img, corner: int):
-        surface = skia.Surface(img.width(), img.height())
-        mask = surface.getCanvas()
-        paint = skia.Paint(
-            Style=skia.Paint.kFill_Style,
-            Color=skia.Color(255, 255, 255, 255),
-            AntiAlias=True,
-        )
-        rect = skia.Rect.MakeXYWH(0, 0, img.width(), img.height())
-        mask.drawRoundRect(rect, corner, corner, paint)
-        image_array = np.bitwise_and(
-            img.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-            mask.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-        )
-        return skia.Image.fromarray(image_array, colorType=skia.ColorType.kRGBA_8888_ColorType)
+        return await run_in_executor(round_corner_image, img, corner, executor=self.fetcher.executor)
 
     async def draw_shadow(self, canvas, pos: tuple, corner: int, bg_color):
         x, y, width, height = pos
@@ -86,25 +75,26 @@ class AbstractAdditional(ABC):
 
 
 class BiliAdditional:
-    def __init__(self, static_path: str, style: PolyStyle) -> None:
+    def __init__(self, static_path: str, style: PolyStyle, fetcher: Optional[ImageFetcher] = None) -> None:
         self.src_path = path.join(static_path, "Src")
         self.style = style
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
 
     async def run(self, additional: Additional, repost: bool = False) -> Optional[np.ndarray]:
         additional_type = additional.type
         try:
             if additional_type == "ADDITIONAL_TYPE_RESERVE":
-                return await DynAddReserve(self.src_path, self.style, additional).run(repost)
+                return await DynAddReserve(self.src_path, self.style, additional, self.fetcher).run(repost)
             elif additional_type == "ADDITIONAL_TYPE_UPOWER_LOTTERY":
-                return await DynAddUpOwerLottery(self.src_path, self.style, additional).run(repost)
+                return await DynAddUpOwerLottery(self.src_path, self.style, additional, self.fetcher).run(repost)
             elif additional_type == "ADDITIONAL_TYPE_GOODS":
-                return await DynAddGoods(self.src_path, self.style, additional).run(repost)
+                return await DynAddGoods(self.src_path, self.style, additional, self.fetcher).run(repost)
             elif additional_type == "ADDITIONAL_TYPE_UGC":
-                return await DynAddUgc(self.src_path, self.style, additional).run(repost)
+                return await DynAddUgc(self.src_path, self.style, additional, self.fetcher).run(repost)
             elif additional_type == "ADDITIONAL_TYPE_VOTE":
-                return await DynAddVote(self.src_path, self.style, additional).run(repost)
+                return await DynAddVote(self.src_path, self.style, additional, self.fetcher).run(repost)
             elif additional_type == "ADDITIONAL_TYPE_COMMON":
-                return await DynAddCommon(self.src_path, self.style, additional).run(repost)
+                return await DynAddCommon(self.src_path, self.style, additional, self.fetcher).run(repost)
             else:
                 logger.warning(f"{additional_type} IS NOT SUPPORT NOW")
                 return None
@@ -129,9 +119,8 @@ class DynAddReserve(AbstractAdditional):
             return None
 
     async def make_desc(self):
-        draw = DrawText(self.style)
         if self.additional.reserve.desc3 is not None:
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.reserve.title,
                 self.style.font.font_size.time,
@@ -139,7 +128,7 @@ class DynAddReserve(AbstractAdditional):
                 self.style.color.font_color.text,
             )
             desc_1 = f"{self.additional.reserve.desc1.text}  {self.additional.reserve.desc2.text}"
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 desc_1,
                 self.style.font.font_size.title,
@@ -147,7 +136,7 @@ class DynAddReserve(AbstractAdditional):
                 self.style.color.font_color.sub_title,
             )
 
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.reserve.desc3.text,
                 self.style.font.font_size.title,
@@ -158,7 +147,7 @@ class DynAddReserve(AbstractAdditional):
             lottery_img = skia.Image.open(path.join(self.src_path, "lottery.png")).resize(40, 40)
             await paste(self.canvas, lottery_img, (65, 138))
         else:
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.reserve.title,
                 self.style.font.font_size.time,
@@ -167,7 +156,7 @@ class DynAddReserve(AbstractAdditional):
             )
 
             desc_1 = f"{self.additional.reserve.desc1.text}  {self.additional.reserve.desc2.text}"
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 desc_1,
                 self.style.font.font_size.title,
@@ -192,8 +181,7 @@ class DynAddUpOwerLottery(AbstractAdditional):
             return None
 
     async def make_desc(self):
-        draw = DrawText(self.style)
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.additional.upower_lottery.title,
             self.style.font.font_size.time,
@@ -201,7 +189,7 @@ class DynAddUpOwerLottery(AbstractAdditional):
             self.style.color.font_color.text,
         )
 
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.additional.upower_lottery.desc.text,
             self.style.font.font_size.title,
@@ -222,7 +210,7 @@ class DynAddGoods(AbstractAdditional):
             await self.draw_shadow(self.canvas, (35, 50, 1010, 240), 15, background_color)
             await self.make_cover()
             await self.make_title_desc()
-            await DrawText(self.style).draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.goods.head_text,
                 self.style.font.font_size.sub_title,
@@ -235,19 +223,18 @@ class DynAddGoods(AbstractAdditional):
             return None
 
     async def make_cover(self):
-        url_list = []
-        for i in self.additional.goods.items:
-            url = re.sub(r"@(\d+)h_(\d+)w\S+", "", i.cover)
-            url_list.append(f"{url}@160w_160h_1c.webp")
-        covers = await get_pictures(url_list, (190, 190))
+        url_list = [goods_cover_url(i.cover) for i in self.additional.goods.items]
+        covers = await self.fetcher.get_pictures(url_list, (190, 190), asset="goods")
         if len(covers) > 1:
             for i, j in enumerate(covers):
                 x = 45 + i * 200
                 if x > 1000:
                     break
-                await paste(self.canvas, await self.make_round_cornor(j, 10), (x, 75))
+                if j is not None:
+                    await paste(self.canvas, await self.make_round_cornor(j, 10), (x, 75))
         else:
-            await paste(self.canvas, await self.make_round_cornor(covers[0], 10), (60, 75))
+            if covers[0] is not None:
+                await paste(self.canvas, await self.make_round_cornor(covers[0], 10), (60, 75))
             await self.make_badge(
                 "去看看",
                 self.style.font.font_size.time,
@@ -259,8 +246,7 @@ class DynAddGoods(AbstractAdditional):
     async def make_title_desc(self):
         if len(self.additional.goods.items) > 1:
             return
-        draw = DrawText(self.style)
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.additional.goods.items[0].name,
             self.style.font.font_size.title,
@@ -269,7 +255,7 @@ class DynAddGoods(AbstractAdditional):
         )
 
         price = f"{self.additional.goods.items[0].price}起"
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             price,
             self.style.font.font_size.title,
@@ -297,19 +283,19 @@ class DynAddUgc(AbstractAdditional):
             return None
 
     async def make_cover(self):
-        cover = await get_pictures(f"{self.additional.ugc.cover}@340w_195h_1c.webp")
-        await paste(self.canvas, await self.make_round_cornor(cover, 10), (60, 45))
+        cover = await self.fetcher.get_pictures(f"{self.additional.ugc.cover}@340w_195h_1c.webp", asset="cover")
+        if cover is not None:
+            await paste(self.canvas, await self.make_round_cornor(cover, 10), (60, 45))
 
     async def make_title_desc(self):
-        draw = DrawText(self.style)
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.additional.ugc.title,
             self.style.font.font_size.title,
             (430, 90, 990, 140, int(self.style.font.font_size.time * 1.3)),
             self.style.color.font_color.text,
         )
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.additional.ugc.desc_second,
             self.style.font.font_size.title,
@@ -361,8 +347,7 @@ class DynAddVote(AbstractAdditional):
         await paste(self.canvas, await self.make_round_cornor(cover, 10), (60, 45))
 
     async def make_title_desc(self):
-        draw = DrawText(self.style)
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.additional.vote.desc,
             self.style.font.font_size.text,
@@ -374,7 +359,7 @@ class DynAddVote(AbstractAdditional):
         else:
             join_num = f"{self.additional.vote.join_num}人参与"
 
-        await draw.draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             join_num,
             self.style.font.font_size.time,
@@ -392,7 +377,7 @@ class DynAddCommon(AbstractAdditional):
         try:
             await self.draw_shadow(self.canvas, (35, 80, 1010, 245), 15, background_color)
 
-            await DrawText(self.style).draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.common.head_text,
                 self.style.font.font_size.title,
@@ -417,11 +402,12 @@ class DynAddCommon(AbstractAdditional):
     async def make_cover(self):
         if self.additional.common.sub_type in {"decoration", "game"}:
             cover_url = f"{self.additional.common.cover}@190w_190h_1c.webp"
-            cover = await get_pictures(cover_url, (190, 190))
+            cover = await self.fetcher.get_pictures(cover_url, (190, 190), asset="cover")
         else:
             cover_url = f"{self.additional.common.cover}@145w_195h_1c.webp"
-            cover = await get_pictures(cover_url, (145, 195))
-        await paste(self.canvas, await self.make_round_cornor(cover, 15), (60, 110))
+            cover = await self.fetcher.get_pictures(cover_url, (145, 195), asset="cover")
+        if cover is not None:
+            await paste(self.canvas, await self.make_round_cornor(cover, 15), (60, 110))
 
     async def make_title(self):
         if self.additional.common.desc2:
@@ -432,7 +418,7 @@ class DynAddCommon(AbstractAdditional):
             x = 280
         else:
             x = 250
-        await DrawText(self.style).draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.additional.common.title,
             self.style.font.font_size.text,
@@ -441,13 +427,12 @@ class DynAddCommon(AbstractAdditional):
         )
 
     async def make_desc(self):
-        draw = DrawText(self.style)
         if self.additional.common.sub_type in {"decoration", "game"}:
             x = 280
         else:
             x = 250
         if self.additional.common.desc2:
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.common.desc1,
                 self.style.font.font_size.title,
@@ -455,7 +440,7 @@ class DynAddCommon(AbstractAdditional):
                 self.style.color.font_color.sub_title,
             )
 
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.common.desc2,
                 self.style.font.font_size.title,
@@ -463,7 +448,7 @@ class DynAddCommon(AbstractAdditional):
                 self.style.color.font_color.sub_title,
             )
         else:
-            await draw.draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 self.additional.common.desc1,
                 self.style.font.font_size.title,
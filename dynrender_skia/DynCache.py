@@ -0,0 +1,576 @@
+"""
+@File    :   DynCache.py
+@Time    :   2024/07/03 21:40:05
+@Author  :   BalconyJH
+@Version :   1.0
+@Desc    :   Content-addressed image caches used by the fetch layer and the sticker atlas
+"""
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import Executor
+from functools import partial
+from os import makedirs, path, remove, replace, scandir, utime
+from time import monotonic, time
+from typing import Optional
+
+import skia
+from loguru import logger
+
+DEFAULT_TTL: dict[str, Optional[float]] = {
+    "face": 43200,
+    "pendant": 43200,
+    "emoji": 30 * 86400,
+    "cover": 7 * 86400,
+    "draw": 7 * 86400,
+    "goods": 86400,
+    "default": 86400,
+}
+
+DEFAULT_NEGATIVE_TTL: dict[str, float] = {
+    "not_found": 3600,
+    "client_error": 600,
+    "too_large": 86400,
+    "decode_error": 3600,
+    "server_error": 30,
+    "transport_error": 10,
+}
+
+
+class AssetCache:
+    """
+    Content-addressed on-disk image cache with per-asset-class TTLs, a total byte quota and LRU eviction.
+
+    Entries are keyed by the URL plus the requested size and stored as `<static_path>/Cache/Assets/<asset>/<sha256>`.
+    The asset class (face, pendant, emoji, cover, ...) selects the TTL, which is checked against the file mtime.
+    Recency is tracked through the file atime, which is set explicitly on every hit so the LRU order survives
+    restarts even on filesystems mounted with `noatime`.
+
+    HTTP validators (ETag, Last-Modified) of an entry are kept in a `<sha256>.meta` sidecar. An expired entry with
+    validators is kept on disk, so the fetch layer can revalidate it with a conditional request and `refresh` it on
+    304 Not Modified instead of downloading it again.
+
+    Args:
+        static_path (str): The static directory the cache lives under.
+        ttl (Optional[dict[str, Optional[float]]]): TTL in seconds per asset class, merged over `DEFAULT_TTL`.
+            A TTL of None never expires.
+        max_bytes (int): Total byte quota of the cache. Least recently used entries are evicted above it.
+    """
+
+    def __init__(
+        self,
+        static_path: str,
+        ttl: Optional[dict[str, Optional[float]]] = None,
+        max_bytes: int = 256 * 1024 * 1024,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.cache_path = path.join(static_path, "Cache", "Assets")
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.max_bytes = max_bytes
+        self.executor = executor
+        self.total_bytes = 0
+        self._entries: Optional[OrderedDict[str, int]] = None
+        self._scan: Optional[asyncio.Future] = None
+
+    @staticmethod
+    def make_key(url: str, size: Optional[tuple[int, int]] = None) -> str:
+        """
+        Build the content address of an entry from its URL and requested size.
+        """
+        raw = url if size is None else f"{url}#{size[0]}x{size[1]}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_path(self, url: str, size: Optional[tuple[int, int]], asset: str) -> str:
+        return path.join(self.cache_path, asset, self.make_key(url, size))
+
+    def get_ttl(self, asset: str) -> Optional[float]:
+        return self.ttl.get(asset, self.ttl["default"])
+
+    async def run_io(self, func, *args):
+        """
+        Run blocking file system work in `executor`, keeping disk latency off the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+
+    async def get_entries(self) -> OrderedDict[str, int]:
+        """
+        LRU index of cached files mapped to their size, oldest first. Built from a directory scan on first use.
+        """
+        if self._entries is None:
+            if self._scan is None:
+                self._scan = asyncio.ensure_future(self.run_io(self.scan))
+            entries = await self._scan
+            if self._entries is None:
+                self._entries = entries
+                self.total_bytes = sum(entries.values())
+        return self._entries
+
+    def scan(self) -> OrderedDict[str, int]:
+        found = []
+        if path.exists(self.cache_path):
+            for asset_dir in scandir(self.cache_path):
+                if not asset_dir.is_dir():
+                    continue
+                for entry in scandir(asset_dir.path):
+                    if entry.is_file() and not entry.name.endswith((".tmp", ".meta")):
+                        stat = entry.stat()
+                        found.append((stat.st_atime, entry.path, stat.st_size))
+        found.sort()
+        return OrderedDict((file_path, file_size) for _, file_path, file_size in found)
+
+    async def get(self, url: str, size: Optional[tuple[int, int]] = None, asset: str = "default") -> Optional[bytes]:
+        """
+        Read a cached entry, returning None when it is missing or older than the TTL of its asset class.
+        """
+        file_path = self.get_path(url, size, asset)
+        entries = await self.get_entries()
+        if file_path not in entries:
+            return None
+        data, kept = await self.run_io(self.read, file_path, self.get_ttl(asset))
+        if not kept:
+            self.forget(file_path)
+        elif data is not None:
+            entries.move_to_end(file_path)
+        return data
+
+    def read(self, file_path: str, ttl: Optional[float]) -> tuple[Optional[bytes], bool]:
+        """
+        Read an entry if it is within `ttl` and mark it as recently used.
+
+        Returns:
+            tuple[Optional[bytes], bool]: The data, or None if the entry is expired or unreadable, and whether the
+            entry is still on disk. Expired entries are only kept if they have validators to revalidate them with.
+        """
+        try:
+            mtime = path.getmtime(file_path)
+            if ttl is not None and time() - mtime > ttl:
+                if path.exists(f"{file_path}.meta"):
+                    return None, True
+                self.remove_files(file_path)
+                return None, False
+            with open(file_path, "rb") as f:
+                data = f.read()
+            utime(file_path, (time(), mtime))
+        except OSError:
+            self.remove_files(file_path)
+            return None, False
+        return data, True
+
+    async def get_stale(
+        self, url: str, size: Optional[tuple[int, int]] = None, asset: str = "default"
+    ) -> Optional[tuple[bytes, dict[str, str]]]:
+        """
+        Read an entry regardless of its TTL together with its HTTP validators, returning None when it is missing or
+        has no validators to revalidate it with.
+        """
+        file_path = self.get_path(url, size, asset)
+        if file_path not in await self.get_entries():
+            return None
+        return await self.run_io(self.read_stale, file_path)
+
+    @staticmethod
+    def read_stale(file_path: str) -> Optional[tuple[bytes, dict[str, str]]]:
+        try:
+            with open(f"{file_path}.meta", encoding="utf-8") as f:
+                validators = json.load(f)
+            with open(file_path, "rb") as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        return (data, validators) if validators else None
+
+    async def refresh(self, url: str, size: Optional[tuple[int, int]] = None, asset: str = "default") -> None:
+        """
+        Restart the TTL of an entry that was revalidated with a 304 Not Modified response.
+        """
+        file_path = self.get_path(url, size, asset)
+        entries = await self.get_entries()
+        try:
+            await self.run_io(utime, file_path)
+        except OSError:
+            await self.discard(file_path)
+            return
+        if file_path in entries:
+            entries.move_to_end(file_path)
+
+    async def put(
+        self,
+        url: str,
+        size: Optional[tuple[int, int]],
+        asset: str,
+        data: bytes,
+        validators: Optional[dict[str, str]] = None,
+    ) -> None:
+        """
+        Store an entry and evict least recently used entries while the quota is exceeded.
+
+        The data is written to a temporary file first and moved into place, so readers never see a partial entry.
+        The HTTP validators of the response, if any, are stored next to it for later revalidation.
+        """
+        file_path = self.get_path(url, size, asset)
+        entries = await self.get_entries()
+        if not await self.run_io(self.write, file_path, data, validators):
+            return
+        self.total_bytes -= entries.pop(file_path, 0)
+        entries[file_path] = len(data)
+        self.total_bytes += len(data)
+        await self.evict()
+
+    @staticmethod
+    def write(file_path: str, data: bytes, validators: Optional[dict[str, str]]) -> bool:
+        tmp_path = f"{file_path}.{id(data)}.tmp"
+        try:
+            makedirs(path.dirname(file_path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            replace(tmp_path, file_path)
+            if validators:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(validators, f)
+                replace(tmp_path, f"{file_path}.meta")
+            elif path.exists(f"{file_path}.meta"):
+                remove(f"{file_path}.meta")
+        except OSError as e:
+            logger.warning(f"Failed to write cache file {file_path}: {e}")
+            return False
+        return True
+
+    def forget(self, file_path: str) -> None:
+        """
+        Drop an entry from the index, leaving its files alone.
+        """
+        if self._entries is not None:
+            self.total_bytes -= self._entries.pop(file_path, 0)
+
+    @staticmethod
+    def remove_files(*file_paths: str) -> None:
+        for file_path in file_paths:
+            for name in (file_path, f"{file_path}.meta"):
+                try:
+                    remove(name)
+                except OSError:
+                    pass
+
+    async def discard(self, file_path: str) -> None:
+        self.forget(file_path)
+        await self.run_io(self.remove_files, file_path)
+
+    async def evict(self) -> None:
+        """
+        Remove least recently used entries until the cache fits into its byte quota.
+        """
+        entries = await self.get_entries()
+        evicted = []
+        while self.total_bytes > self.max_bytes and entries:
+            file_path = next(iter(entries))
+            self.forget(file_path)
+            evicted.append(file_path)
+        if evicted:
+            await self.run_io(self.remove_files, *evicted)
+
+
+class ImageMemoryCache:
+    """
+    Byte-bounded LRU of decoded and already resized `skia.Image` objects, keyed by URL and target size.
+
+    `skia.Image` is immutable, so one decoded image can be shared by every render in the process. The footprint of
+    an entry is estimated from its pixel dimensions at 4 bytes per pixel.
+
+    Args:
+        max_bytes (int): Total decoded pixel bytes kept in memory before least recently used images are dropped.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images: OrderedDict[tuple[str, Optional[tuple[int, int]]], tuple[skia.Image, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    @staticmethod
+    def image_bytes(img: skia.Image) -> int:
+        return img.width() * img.height() * 4
+
+    def get(self, url: str, size: Optional[tuple[int, int]] = None) -> Optional[skia.Image]:
+        key = (url, size)
+        if (entry := self._images.get(key)) is None:
+            self.misses += 1
+            return None
+        self._images.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, url: str, size: Optional[tuple[int, int]], img: skia.Image) -> None:
+        key = (url, size)
+        nbytes = self.image_bytes(img)
+        if nbytes > self.max_bytes:
+            return
+        if (old := self._images.pop(key, None)) is not None:
+            self.total_bytes -= old[1]
+        self._images[key] = (img, nbytes)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes:
+            _, (_, dropped) = self._images.popitem(last=False)
+            self.total_bytes -= dropped
+
+    def clear(self) -> None:
+        self._images.clear()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Hit and miss counters together with the current number of entries and their decoded size.
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._images), "bytes": self.total_bytes}
+
+
+image_memory_cache = ImageMemoryCache()
+
+
+class NegativeCache:
+    """
+    Short-lived memory of image URLs that failed, keyed by URL and remembered per error class.
+
+    A dead link on an old dynamic otherwise costs a full round of transport retries on every render of the dynamic
+    and of each of its reposts. While an entry is active the fetch layer answers None at once, which sends the
+    renderer straight to its placeholder path.
+
+    Args:
+        ttl (Optional[dict[str, float]]): Seconds a failure is remembered per error class, merged over
+            `DEFAULT_NEGATIVE_TTL`. Error classes without a TTL are not remembered.
+        max_entries (int): Maximum number of remembered URLs, the oldest are dropped first.
+    """
+
+    def __init__(self, ttl: Optional[dict[str, float]] = None, max_entries: int = 4096) -> None:
+        self.ttl = {**DEFAULT_NEGATIVE_TTL, **(ttl or {})}
+        self.max_entries = max_entries
+        self._failures: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._failures)
+
+    def get(self, url: str) -> Optional[str]:
+        """
+        Return the error class of a remembered failure of `url`, or None if there is no active one.
+        """
+        if (entry := self._failures.get(url)) is None:
+            return None
+        if monotonic() >= entry[1]:
+            del self._failures[url]
+            return None
+        return entry[0]
+
+    def put(self, url: str, error: str) -> None:
+        if (ttl := self.ttl.get(error)) is None or ttl <= 0:
+            return
+        self._failures.pop(url, None)
+        self._failures[url] = (error, monotonic() + ttl)
+        while len(self._failures) > self.max_entries:
+            self._failures.popitem(last=False)
+
+    def discard(self, url: str) -> None:
+        self._failures.pop(url, None)
+
+    def clear(self) -> None:
+        self._failures.clear()
+
+
+negative_cache = NegativeCache()
+
+
+class StickerAtlas:
+    """
+    Bilibili stickers packed into one texture, each resized once into a square cell, with a key (the icon URL) to
+    cell index.
+
+    Renders blit stickers straight from the atlas instead of decoding and resizing them per render. Stickers missing
+    from the atlas are added as they are fetched, the texture growing by doubling its rows up to `max_rows`. A full
+    atlas reuses the cell of its least recently used sticker. The atlas is persisted as `<file_path>.png` with a
+    `<file_path>.json` index, so a restarted process loads every known sticker with a single decode. Writes are
+    debounced by `schedule_persist`, so a burst of renders adding stickers encodes the texture once.
+
+    Args:
+        cell (int): Side length every sticker is resized to.
+        file_path (Optional[str]): Path the atlas is persisted to and loaded from, without extension. Not persisted
+            if None.
+        columns (int): Cells per texture row.
+        max_rows (int): Maximum number of texture rows, capping the atlas at `max_rows * columns` stickers.
+    """
+
+    def __init__(self, cell: int, file_path: Optional[str] = None, columns: int = 16, max_rows: int = 64) -> None:
+        self.cell = cell
+        self.file_path = file_path
+        self.columns = columns
+        self.max_rows = max_rows
+        self.keys: OrderedDict[str, int] = OrderedDict()
+        self.dirty = False
+        self._surface: Optional[skia.Surface] = None
+        self._image: Optional[skia.Image] = None
+        self._persist_task: Optional[asyncio.Task] = None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def rows(self) -> int:
+        return 0 if self._surface is None else self._surface.height() // self.cell
+
+    @property
+    def capacity(self) -> int:
+        return self.rows * self.columns
+
+    @property
+    def image(self) -> Optional[skia.Image]:
+        """
+        Immutable snapshot of the texture, still valid after later additions.
+        """
+        if self._image is None and self._surface is not None:
+            self._image = self._surface.makeImageSnapshot()
+        return self._image
+
+    def cell_rect(self, index: int) -> skia.Rect:
+        row, column = divmod(index, self.columns)
+        return skia.Rect.MakeXYWH(column * self.cell, row * self.cell, self.cell, self.cell)
+
+    def rect(self, key: str) -> Optional[skia.Rect]:
+        """
+        The cell of a sticker in the current `image`, marking the sticker as recently used.
+        """
+        if (index := self.keys.get(key)) is None:
+            return None
+        self.keys.move_to_end(key)
+        return self.cell_rect(index)
+
+    def grow(self, rows: int) -> None:
+        surface = skia.Surface(self.columns * self.cell, rows * self.cell)
+        canvas = surface.getCanvas()
+        canvas.clear(skia.ColorTRANSPARENT)
+        if (image := self.image) is not None:
+            canvas.drawImage(image, 0, 0)
+        self._surface = surface
+        self._image = None
+
+    def add(self, key: str, img: skia.Image) -> None:
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return
+        if len(self.keys) < self.capacity:
+            index = len(self.keys)
+        elif self.rows < self.max_rows:
+            index = len(self.keys)
+            self.grow(min(self.max_rows, max(1, self.rows * 2)))
+        else:
+            _, index = self.keys.popitem(last=False)
+        self.keys[key] = index
+        canvas = self._surface.getCanvas()  # type: ignore
+        canvas.save()
+        canvas.clipRect(self.cell_rect(index))
+        canvas.clear(skia.ColorTRANSPARENT)
+        canvas.drawImageRect(img, self.cell_rect(index))
+        canvas.restore()
+        self._image = None
+        self.dirty = True
+
+    def load(self) -> None:
+        """
+        Load the persisted atlas, keeping the atlas empty if it is missing, unreadable or of another cell size.
+        """
+        if self.file_path is None or not path.exists(f"{self.file_path}.json"):
+            return
+        try:
+            with open(f"{self.file_path}.json", encoding="utf-8") as f:
+                index = json.load(f)
+            if index["cell"] != self.cell or index["columns"] != self.columns:
+                return
+            image = skia.Image.open(f"{self.file_path}.png")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to load sticker atlas {self.file_path}: {e}")
+            return
+        self._image = image
+        self.grow(min(image.height() // self.cell, self.max_rows))
+        self.keys = OrderedDict((key, i) for i, key in enumerate(index["keys"][: self.capacity]))
+
+    def write(self, image: skia.Image, keys: list[str]) -> bool:
+        if self.file_path is None:
+            return False
+        try:
+            makedirs(path.dirname(self.file_path), exist_ok=True)
+            image.save(f"{self.file_path}.png.tmp", skia.EncodedImageFormat.kPNG)
+            with open(f"{self.file_path}.json.tmp", "w", encoding="utf-8") as f:
+                json.dump({"cell": self.cell, "columns": self.columns, "keys": keys}, f)
+            replace(f"{self.file_path}.png.tmp", f"{self.file_path}.png")
+            replace(f"{self.file_path}.json.tmp", f"{self.file_path}.json")
+        except OSError as e:
+            logger.warning(f"Failed to write sticker atlas {self.file_path}: {e}")
+            return False
+        return True
+
+    async def persist(self, executor: Optional[Executor] = None) -> None:
+        """
+        Write the atlas in the background if stickers were added since it was loaded or last written. The atlas stays
+        dirty if the write fails, so the next persist retries it.
+        """
+        if not self.dirty or (image := self.image) is None:
+            return
+        # Cleared up front so stickers added while the write runs mark the atlas dirty again
+        self.dirty = False
+        keys = sorted(self.keys, key=self.keys.__getitem__)
+        if not await asyncio.get_running_loop().run_in_executor(executor, partial(self.write, image, keys)):
+            self.dirty = True
+
+    def schedule_persist(self, executor: Optional[Executor] = None, delay: float = 30.0) -> None:
+        """
+        Persist the atlas `delay` seconds from now, unless a write is already scheduled. Stickers added meanwhile
+        are written with it.
+        """
+        if self.file_path is None or (self._persist_task is not None and not self._persist_task.done()):
+            return
+        self._persist_task = asyncio.get_running_loop().create_task(self._persist_after(executor, delay))
+
+    async def _persist_after(self, executor: Optional[Executor], delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.persist(executor)
+
+    async def flush(self, executor: Optional[Executor] = None) -> None:
+        """
+        Write a scheduled persist right away.
+        """
+        if self._persist_task is not None and not self._persist_task.done():
+            self._persist_task.cancel()
+        self._persist_task = None
+        await self.persist(executor)
+
+
+sticker_atlases: dict[tuple[str, int], StickerAtlas] = {}
+
+
+async def get_sticker_atlas(static_path: str, cell: int, executor: Optional[Executor] = None) -> StickerAtlas:
+    """
+    The process-wide sticker atlas of a static directory and cell size, loaded from disk in `executor` on first use.
+    """
+    key = (static_path, cell)
+    if key not in sticker_atlases:
+        atlas = StickerAtlas(cell, path.join(static_path, "Cache", "Atlas", f"emoji_{cell}"))
+        await asyncio.get_running_loop().run_in_executor(executor, atlas.load)
+        sticker_atlases.setdefault(key, atlas)
+    return sticker_atlases[key]
+
+
+async def flush_sticker_atlases(static_path: str, executor: Optional[Executor] = None) -> None:
+    """
+    Write the pending changes of every sticker atlas of a static directory.
+    """
+    for (atlas_path, _), atlas in list(sticker_atlases.items()):
+        if atlas_path == static_path:
+            await atlas.flush(executor)
@@ -7,7 +7,9 @@
 """
 
 import json
-from os import getcwd, makedirs, path
+from concurrent.futures import Future
+from os import getcwd, makedirs, path, replace
+from threading import Thread
 from typing import Optional
 from zipfile import ZipFile
 
@@ -22,8 +24,11 @@ except ImportError as e:
         "Ubuntu: apt install libgl1-mesa-glx \n\n ArchLinux: pacman -S libgl \n\n Centos: yum install mesa-libGL -y "
         "\n\n---------------------------------------"
     )
+from .DynFont import CoverageIndex, font_fallback
 from .DynStyle import PolyStyle
 
+font_cache_tasks: dict[str, "Future[Optional[CoverageIndex]]"] = {}
+
 
 class MakeStaticFile:
     def __init__(self, data_path: Optional[str] = None) -> None:
@@ -66,25 +71,67 @@ class MakeStaticFile:
                 )
                 logger.info("static目录创建成功")
         font_cache_path = path.join(static_path, "font_family.json")
-        if not path.exists(font_cache_path):
-            logger.info("创建系统安装的所有字体的名称列表文件")
-            font_list = list(skia.FontMgr())
-            with open(font_cache_path, "w") as f:
-                f.write(json.dumps(font_list, ensure_ascii=False))
-            logger.info("字体列表文件创建完成")
-            logger.info(f"文件存储于：{font_cache_path}")
-        else:
-            new_font_list = list(skia.FontMgr())
-            with open(font_cache_path, "w+") as f:
-                if file_content := f.read():
-                    old_font_list = json.loads(file_content)
-                    if new_font_list != old_font_list:
-                        f.write(json.dumps(new_font_list, ensure_ascii=False))
-                else:
-                    f.write(json.dumps(new_font_list, ensure_ascii=False))
+        # 字符覆盖索引在后台线程中读取或重建, 完成前字体回退仍使用系统字体匹配
+        if font_cache_path not in font_cache_tasks:
+            font_cache_tasks[font_cache_path] = self.start_font_cache_task(font_cache_path)
+        self.font_cache_task = font_cache_tasks[font_cache_path]
 
         return static_path
 
+    @classmethod
+    def start_font_cache_task(cls, font_cache_path: str) -> "Future[Optional[CoverageIndex]]":
+        """在守护线程中读取或重建字符覆盖索引, 进程退出时不等待重建完成, 索引文件先写入临时文件再替换, 不会留下半个文件"""
+        future: "Future[Optional[CoverageIndex]]" = Future()
+
+        def run() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(cls.load_font_cache(font_cache_path))
+            except BaseException as e:
+                future.set_exception(e)
+
+        Thread(target=run, name="font-coverage", daemon=True).start()
+        return future
+
+    @classmethod
+    def load_font_cache(cls, font_cache_path: str) -> Optional[CoverageIndex]:
+        """读取字体列表文件中的字符覆盖索引, 已安装字体有变化时重建, 然后交给字体回退使用"""
+        try:
+            font_mgr = skia.FontMgr()
+            font_list = list(font_mgr)
+            font_cache = cls.read_font_cache(font_cache_path)
+            if font_cache is None or font_cache["families"] != font_list:
+                logger.info("创建系统安装的所有字体的名称列表与字符覆盖索引文件")
+                font_cache = {"families": font_list, "coverage": CoverageIndex.build(font_mgr).to_json()}
+                with open(f"{font_cache_path}.tmp", "w") as f:
+                    f.write(json.dumps(font_cache, ensure_ascii=False))
+                replace(f"{font_cache_path}.tmp", font_cache_path)
+                logger.info("字体列表文件创建完成")
+                logger.info(f"文件存储于：{font_cache_path}")
+            coverage = CoverageIndex.from_json(font_cache["coverage"])
+        except Exception as e:
+            logger.exception(f"字符覆盖索引加载失败: {e}")
+            return None
+        font_fallback.load_coverage(coverage)
+        return coverage
+
+    @staticmethod
+    def read_font_cache(font_cache_path: str) -> Optional[dict]:
+        """读取字体列表文件, 不存在或是不含覆盖索引的旧格式时返回None"""
+        if not path.exists(font_cache_path):
+            return None
+        with open(font_cache_path) as f:
+            try:
+                font_cache = json.load(f)
+            except json.JSONDecodeError:
+                return None
+        if not isinstance(font_cache, dict) or not {"families", "coverage"} <= font_cache.keys():
+            return None
+        if not isinstance(font_cache["coverage"], dict) or "preferred" not in font_cache["coverage"]:
+            return None
+        return font_cache
+
     def unzip_file(self, arg0, arg1, src_path, target_path):
         logger.info(arg0)
         logger.info(arg1)
@@ -93,10 +140,11 @@ class MakeStaticFile:
 
 
 class SetDynStyle:
-    def __init__(self, font_family: str, emoji_font_family: str, font_style: str) -> None:
+    def __init__(self, font_family: str, emoji_font_family: str, font_style: str, text_backend: str = "engine") -> None:
         self.font_family = font_family
         self.font_style = font_style
         self.emoji_font_family = emoji_font_family
+        self.text_backend = text_backend
 
     @property
     def set_style(self) -> PolyStyle:
@@ -121,6 +169,7 @@ class SetDynStyle:
                 "font_family": self.font_family,
                 "emoji_font_family": self.emoji_font_family,
                 "font_style": self.get_font_style(),
+                "text_backend": self.text_backend,
                 "font_size": {
                     "name": 45,
                     "text": 40,
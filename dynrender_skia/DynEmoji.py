@@ -0,0 +1,141 @@
+"""
+@File    :   DynEmoji.py
+@Time    :   2024/07/10 10:24:36
+@Author  :   BalconyJH
+@Version :   1.0
+@Desc    :   Emoji segmentation with a vectorized pre-check and a per-string cache, and rasterized emoji glyphs
+"""
+
+import math
+from collections import OrderedDict
+from functools import cache, lru_cache
+from typing import Optional, Union
+
+import emoji
+import numpy as np
+import skia
+
+KEYCAP = "⃣"
+
+
+@cache
+def emoji_start_codepoints() -> np.ndarray:
+    """
+    Sorted non-ASCII code points that an emoji sequence can start with.
+
+    Keycap sequences are the only ones starting with an ASCII character and are recognised by their combining keycap
+    instead.
+    """
+    return np.array(sorted({ord(e[0]) for e in emoji.EMOJI_DATA if ord(e[0]) > 0x7F}), dtype=np.uint32)
+
+
+def may_contain_emoji(text: str) -> bool:
+    """
+    Tell whether the text could contain an emoji, without running the matcher.
+
+    Args:
+        text (str): The text to check.
+
+    Returns:
+        bool: False if no code point of the text can start an emoji sequence.
+    """
+    if text.isascii():
+        return False
+    if KEYCAP in text:
+        return True
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    codepoints = codepoints[codepoints > 0x7F]
+    starts = emoji_start_codepoints()
+    index = np.searchsorted(starts, codepoints).clip(max=len(starts) - 1)
+    return bool((starts[index] == codepoints).any())
+
+
+@lru_cache(maxsize=4096)
+def get_emoji_text(text: str) -> dict[int, list[Union[int, str]]]:
+    """
+    Get the positions of emojis in the text and their corresponding Unicode characters.
+
+    The result is shared between calls with the same text and must not be modified.
+
+    Args:
+        text (str): The text in which to search for emojis.
+
+    Usage:
+    ```python
+    emoji_info = get_emoji_text("Hello, 🌍!")
+    print(emoji_info)
+    # Output: {7: [8, '🌍']}
+    ```
+
+    Returns:
+        dict[int, list[Union[int, str]]]: A dictionary with the starting position of each emoji in the text as the key,
+        and a list containing the end position of the emoji and the emoji character as the value.
+    """
+    if not may_contain_emoji(text):
+        return {}
+    return {i["match_start"]: [i["match_end"], i["emoji"]] for i in emoji.emoji_list(text)}
+
+
+class EmojiGlyphCache:
+    """
+    Bounded LRU of emoji sequences rendered once into images, keyed by (sequence, typeface, size, color).
+
+    Color bitmap fonts are among the most expensive glyphs to shape and rasterize, while the same few emoji show up
+    in nearly every post. A cached image is blitted at the offset of its bounds relative to the text origin. The
+    color is part of the key because fonts without color glyphs draw emoji in the paint color.
+
+    Args:
+        max_entries (int): Number of rendered sequences kept before least recently used ones are dropped.
+    """
+
+    def __init__(self, max_entries: int = 512) -> None:
+        self.max_entries = max_entries
+        self._images: OrderedDict[tuple[str, int, float, int], Optional[tuple[skia.Image, int, int]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    @staticmethod
+    def render(sequence: str, font: skia.Font, color: int) -> Optional[tuple[skia.Image, int, int]]:
+        blob = skia.TextBlob.MakeFromShapedText(sequence, font)
+        if blob is None:
+            return None
+        bounds = blob.bounds()
+        left, top = math.floor(bounds.left()), math.floor(bounds.top())
+        width, height = math.ceil(bounds.right()) - left, math.ceil(bounds.bottom()) - top
+        if width <= 0 or height <= 0:
+            return None
+        surface = skia.Surface(width, height)
+        canvas = surface.getCanvas()
+        canvas.clear(skia.ColorTRANSPARENT)
+        canvas.drawTextBlob(blob, -left, -top, skia.Paint(AntiAlias=True, Color=color))
+        return surface.makeImageSnapshot(), left, top
+
+    def get(self, sequence: str, font: skia.Font, color: int) -> Optional[tuple[skia.Image, int, int]]:
+        """
+        Get the rendered image of an emoji sequence.
+
+        Args:
+            sequence (str): The emoji sequence.
+            font (skia.Font): The font to shape it with.
+            color (int): The paint color.
+
+        Returns:
+            Optional[tuple[skia.Image, int, int]]: The image and the offset of its top left corner from the text
+            origin, or None if the sequence draws nothing.
+        """
+        key = (sequence, font.getTypeface().uniqueID(), font.getSize(), color)
+        if key in self._images:
+            self._images.move_to_end(key)
+            return self._images[key]
+        glyph = self.render(sequence, font, color)
+        self._images[key] = glyph
+        while len(self._images) > self.max_entries:
+            self._images.popitem(last=False)
+        return glyph
+
+    def clear(self) -> None:
+        self._images.clear()
+
+
+emoji_glyph_cache = EmojiGlyphCache()
@@ -0,0 +1,555 @@
+"""
+@File    :   DynFetcher.py
+@Time    :   2024/07/02 10:12:31
+@Author  :   BalconyJH
+@Version :   1.0
+@Desc    :   Shared image fetch layer used by every section renderer
+"""
+
+import asyncio
+import re
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+from typing import TYPE_CHECKING, Optional, Union
+from weakref import WeakKeyDictionary
+
+import httpx
+import skia
+from loguru import logger
+
+from .DynCache import AssetCache, ImageMemoryCache, NegativeCache, image_memory_cache
+from .DynCache import negative_cache as shared_negative_cache
+from .DynPlanner import AssetRequest
+from .DynTools import decode_img, download_img, run_in_executor
+from .exception import ImageTooLargeError
+
+if TYPE_CHECKING:
+    from typing_extensions import Self
+
+render_deadline: ContextVar[Optional[float]] = ContextVar("render_deadline", default=None)
+
+
+@contextmanager
+def fetch_deadline(timeout: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    Set the loop time by which every fetch started in this context, including tasks created from it, has to finish.
+
+    Fetches still running at the deadline return None, so the renderers draw their placeholders. A nested deadline
+    never extends an outer one.
+
+    Args:
+        timeout (Optional[float]): Seconds from now. If None, the current deadline (if any) is kept.
+
+    Yields:
+        Optional[float]: The deadline in loop time.
+    """
+    deadline = render_deadline.get()
+    if timeout is not None:
+        new_deadline = asyncio.get_running_loop().time() + timeout
+        deadline = new_deadline if deadline is None else min(deadline, new_deadline)
+    token = render_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        render_deadline.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one CDN host.
+
+    After `failure_threshold` consecutive failures the breaker opens and every request to the host fails fast to the
+    placeholder path. Once `recovery_time` seconds have passed it lets a single probe request through (half open);
+    the probe closes the breaker on success and opens it again on failure.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the breaker.
+        recovery_time (float): Seconds the breaker stays open before a probe request is allowed.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if monotonic() - self.opened_at >= self.recovery_time:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> bool:
+        """
+        Count a failure, returning True when it opens the breaker.
+        """
+        self.failures += 1
+        was_probing, self.probing = self.probing, False
+        if was_probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            self.opened_at = monotonic()
+            return True
+        return False
+
+
+class ImageFetcher:
+    """
+    Image fetch layer backed by one long-lived, pooled `httpx.AsyncClient`.
+
+    `DynRender` owns one fetcher and passes it down to every section renderer, so all images of a render (and of
+    consecutive renders) reuse the same keep-alive connections to the Bilibili CDN hosts instead of paying a new
+    TCP/TLS handshake per `get_pictures` call.
+
+    Usage:
+    ```python
+    async with ImageFetcher(max_connections=50) as fetcher:
+        face = await fetcher.get_pictures(url, (240, 240))
+    ```
+
+    Args:
+        max_connections (int): Maximum number of concurrent connections in the pool.
+        max_keepalive_connections (int): Maximum number of idle connections kept alive in the pool.
+        keepalive_expiry (float): Seconds an idle connection is kept before it is closed.
+        timeout (float): Timeout in seconds applied to connect, read, write and pool acquisition.
+        retries (int): Number of transport level retries on connection errors.
+        pooled (bool): If False, every call opens and closes its own client like the legacy `get_pictures` does.
+            Used by renderers constructed without a fetcher.
+        cache (Optional[AssetCache]): On-disk asset cache consulted before and filled after every download.
+        memory_cache (Optional[ImageMemoryCache]): LRU of decoded images checked before the disk cache. Defaults to
+            the process-wide `image_memory_cache`.
+        max_per_host (int): Maximum number of concurrent downloads from one host.
+        failure_threshold (int): Consecutive failures of a host that open its circuit breaker.
+        recovery_time (float): Seconds an open circuit breaker fails fast before it probes the host again.
+        executor (Optional[Executor]): Executor running image decode, resize, encode and the mask compositing of the
+            renderers. Defaults to the default executor of the running loop.
+        max_bytes (Optional[int]): Maximum size of an encoded image. Larger downloads are aborted while streaming.
+        max_pixels (Optional[int]): Maximum width * height of an image, checked against the sniffed image header
+            before the body is fully downloaded. Oversized Bilibili CDN images are retried once as a smaller
+            `@<width>w.webp` variant, anything else falls back to the placeholder.
+        negative_cache (Optional[NegativeCache]): Memory of failed URLs that are answered with None without a request
+            until their error class TTL has passed. Defaults to the process-wide `negative_cache`.
+        hedge (bool): If True, a download that has not finished after the hedge delay is duplicated, on another
+            `i<n>.hdslb.com` edge for Bilibili CDN urls, and the first successful response wins.
+        hedge_percentile (float): Percentile of the recent download latencies used as hedge delay.
+        hedge_delay (float): Hedge delay in seconds used until enough latencies have been observed.
+        hedge_budget (float): Maximum share of downloads that may be hedged, capping the extra requests.
+    """
+
+    #: WEBP quality of resized images written to the disk cache. Bodies that were not resized are cached as received.
+    cache_quality = 90
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 5.0,
+        retries: int = 5,
+        pooled: bool = True,
+        cache: Optional[AssetCache] = None,
+        memory_cache: Optional[ImageMemoryCache] = None,
+        max_per_host: int = 8,
+        failure_threshold: int = 5,
+        recovery_time: float = 30.0,
+        executor: Optional[Executor] = None,
+        max_bytes: Optional[int] = 20 * 1024 * 1024,
+        max_pixels: Optional[int] = 40_000_000,
+        negative_cache: Optional[NegativeCache] = None,
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_delay: float = 0.5,
+        hedge_budget: float = 0.1,
+    ) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout)
+        self.retries = retries
+        self.pooled = pooled
+        self.cache = cache
+        self.memory_cache = memory_cache if memory_cache is not None else image_memory_cache
+        self.max_per_host = max_per_host
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.negative_cache = negative_cache if negative_cache is not None else shared_negative_cache
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedge_budget = hedge_budget
+        self.hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+        self.latencies: deque[float] = deque(maxlen=256)
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.active: dict[str, int] = {}
+        self._semaphores: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]] = (
+            WeakKeyDictionary()
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: dict[tuple[str, Optional[tuple[int, int]]], asyncio.Task] = {}
+        self._waiters: dict[tuple[str, Optional[tuple[int, int]]], int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def __aenter__(self) -> "Self":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    def make_client(self) -> httpx.AsyncClient:
+        """
+        Build a new `httpx.AsyncClient` with the configured pool limits, timeout and retry policy.
+        """
+        transport = httpx.AsyncHTTPTransport(retries=self.retries, limits=self.limits)
+        return httpx.AsyncClient(transport=transport, timeout=self.timeout)
+
+    async def get_client(self) -> httpx.AsyncClient:
+        """
+        Return the shared client, creating it on first use.
+
+        Connections of an `httpx.AsyncClient` are bound to the event loop they were opened on, so the client is
+        rebuilt when the fetcher is used from a different loop (for example across several `asyncio.run` calls).
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = self.make_client()
+            self._loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        """
+        Close the shared client and release every pooled connection.
+        """
+        if self._client is not None and not self._client.is_closed:
+            if self._loop is asyncio.get_running_loop():
+                await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    async def get_pictures(
+        self, url: Union[str, list[str]], size: Optional[tuple[int, int]] = None, asset: str = "default"
+    ) -> Union[Optional[skia.Image], list[Optional[skia.Image]]]:
+        """
+        Fetch images from a single URL or a list of URLs through the shared client, optionally resizing them.
+
+        Args:
+            url (Union[str, list[str]]): A single URL or a list of URLs from which to fetch images.
+            size (Optional[tuple[int, int]]): Width and height to which the images should be resized. A height of 0
+                scales the images to the width, keeping their aspect ratio.
+            asset (str): Asset class of the images (face, pendant, emoji, cover, draw, goods), which selects the
+                TTL of the on-disk cache entries.
+
+        Returns:
+            Union[Optional[skia.Image], list[Optional[skia.Image]]]: A single image for a single URL, or a list of
+            images in the same order as the URLs. Failed requests yield None.
+        """
+        if not self.pooled:
+            async with self.make_client() as client:
+                return await self._gather(client, url, size, asset)
+        return await self._gather(await self.get_client(), url, size, asset)
+
+    async def prefetch(self, requests: list[AssetRequest]) -> None:
+        """
+        Fetch a whole asset plan in one concurrent batch so the renderers that request the same images afterwards
+        are served from the caches.
+
+        Args:
+            requests (list[AssetRequest]): The plan built by `AssetPlanner.plan`.
+        """
+        if not requests:
+            return
+        if not self.pooled:
+            async with self.make_client() as client:
+                await asyncio.gather(*[self.fetch(client, *i) for i in requests])
+        else:
+            client = await self.get_client()
+            await asyncio.gather(*[self.fetch(client, *i) for i in requests])
+
+    async def _gather(
+        self, client: httpx.AsyncClient, url: Union[str, list[str]], size: Optional[tuple[int, int]], asset: str
+    ):
+        if isinstance(url, list):
+            return await asyncio.gather(*[self.fetch(client, i, size, asset) for i in url])
+        return await self.fetch(client, url, size, asset)
+
+    async def fetch(
+        self, client: httpx.AsyncClient, url: str, size: Optional[tuple[int, int]], asset: str
+    ) -> Optional[skia.Image]:
+        """
+        Fetch a single image, looking it up in the in-memory and on-disk caches first and filling both after a
+        download.
+
+        Concurrent requests for the same URL and size are coalesced: the first caller starts the load and every other
+        caller awaits the same task, so an image is downloaded, decoded and written to the disk cache only once.
+        Waiters are shielded from each other, cancelling one of them does not cancel the shared load while others
+        still wait for it.
+        URLs that failed recently are answered with None from the negative cache without any request.
+
+        Inside `fetch_deadline` a waiter gives up at the deadline and returns None. When the last waiter of a load
+        gives up or is cancelled, the load is cancelled too, which also closes its connection.
+        """
+        if (img := self.memory_cache.get(url, size)) is not None:
+            return img
+        if (error := self.negative_cache.get(url)) is not None:
+            logger.debug(f"Skip {url}, failed recently with {error}")
+            return None
+        key = (url, size)
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._load(client, url, size, asset))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._release(key, done))
+        deadline = render_deadline.get()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            if deadline is None:
+                return await asyncio.shield(task)
+            return await asyncio.wait_for(asyncio.shield(task), max(deadline - asyncio.get_running_loop().time(), 0))
+        except asyncio.TimeoutError:
+            logger.warning(f"Render deadline reached before {url} was loaded, use placeholder")
+            return None
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                if not task.done():
+                    task.cancel()
+
+    def _release(self, key: tuple[str, Optional[tuple[int, int]]], task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def _load(
+        self, client: httpx.AsyncClient, url: str, size: Optional[tuple[int, int]], asset: str
+    ) -> Optional[skia.Image]:
+        stale = None
+        if self.cache is not None:
+            if (data := await self.cache.get(url, size, asset)) is not None:
+                if (img := await run_in_executor(decode_img, data, executor=self.executor)) is not None:
+                    self.memory_cache.put(url, size, img)
+                    return img
+            stale = await self.cache.get_stale(url, size, asset)
+        img, body, validators = await self._download(client, url, size, stale)
+        if img is None:
+            return None
+        self.memory_cache.put(url, size, img)
+        if self.cache is not None:
+            if validators is None:
+                await self.cache.refresh(url, size, asset)
+            else:
+                if body is None:
+                    encoded = await run_in_executor(
+                        img.encodeToData, skia.EncodedImageFormat.kWEBP, self.cache_quality, executor=self.executor
+                    )
+                    body = None if encoded is None else bytes(encoded)
+                if body is not None:
+                    await self.cache.put(url, size, asset, body, validators)
+        return img
+
+    def get_semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return semaphores[host]
+
+    def get_breaker(self, host: str) -> CircuitBreaker:
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(self.failure_threshold, self.recovery_time)
+        return self.breakers[host]
+
+    @property
+    def host_states(self) -> dict[str, dict[str, Union[str, int]]]:
+        """
+        Circuit breaker state, consecutive failures and active downloads of every host seen so far.
+        """
+        return {
+            host: {"state": breaker.state, "failures": breaker.failures, "active": self.active.get(host, 0)}
+            for host, breaker in self.breakers.items()
+        }
+
+    async def _download(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        size: Optional[tuple[int, int]],
+        stale: Optional[tuple[bytes, dict[str, str]]] = None,
+    ) -> tuple[Optional[skia.Image], Optional[bytes], Optional[dict[str, str]]]:
+        """
+        Download and decode one image while holding a slot of its host, feeding the result into the host breaker.
+
+        Network errors, 429 and 5xx responses count as host failures. Other status codes, oversized images and
+        undecodable bodies are failures of the single URL and leave the breaker alone.
+
+        If a `stale` cache entry and its validators are given the request is conditional. On 304 Not Modified the
+        cached bytes, which are already resized, are decoded instead of a new body.
+
+        Returns:
+            tuple[Optional[skia.Image], Optional[bytes], Optional[dict[str, str]]]: The image, or None on failure, the
+            response body if it can be cached as is, which is when no resize was asked for, and the validators of the
+            response. The validators are None when the stale entry was confirmed and only needs a refresh.
+        """
+        try:
+            host = httpx.URL(url).host
+        except (httpx.InvalidURL, TypeError) as e:
+            logger.warning(f"Invalid image url {url!r}: {e}")
+            return None, None, None
+        breaker = self.get_breaker(host)
+        if not breaker.allow():
+            logger.debug(f"Circuit of {host} is {breaker.state}, skip {url}")
+            return None, None, None
+        async with self.get_semaphore(host):
+            self.active[host] = self.active.get(host, 0) + 1
+            try:
+                content, validators = await self._request(client, url, stale[1] if stale is not None else None)
+            except ImageTooLargeError as e:
+                breaker.record_success()
+                logger.warning(f"Skip oversized image {url}: {e.message}")
+                if (variant := self.smaller_variant(url, size)) is None:
+                    self.negative_cache.put(url, "too_large")
+                    return None, None, None
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if status == 429 or status >= 500:
+                    self._record_failure(host, breaker)
+                    self.negative_cache.put(url, "server_error")
+                else:
+                    breaker.record_success()
+                    self.negative_cache.put(url, "not_found" if status in {404, 410} else "client_error")
+                logger.warning(f"Request {url} failed with status {status}")
+                return None, None, None
+            except httpx.TransportError as e:
+                self._record_failure(host, breaker)
+                self.negative_cache.put(url, "transport_error")
+                logger.warning(f"Request {url} failed: {e!r}")
+                return None, None, None
+            except asyncio.CancelledError:
+                breaker.probing = False
+                raise
+            except Exception as e:
+                breaker.probing = False
+                logger.exception(f"Unexpected error: {e}")
+                return None, None, None
+            else:
+                variant = None
+            finally:
+                self.active[host] -= 1
+        if variant is not None:
+            img, variant_body, validators = await self._download(client, variant, size)
+            if img is None:
+                self.negative_cache.put(url, "too_large")
+            return img, variant_body, validators
+        breaker.record_success()
+        if content is None and stale is not None:
+            if (img := await run_in_executor(decode_img, stale[0], executor=self.executor)) is not None:
+                return img, None, None
+            return await self._download(client, url, size)
+        if content is None or (img := await run_in_executor(decode_img, content, size, executor=self.executor)) is None:
+            logger.error(f"Image decode error of {url}")
+            self.negative_cache.put(url, "decode_error")
+            return None, None, None
+        return img, content if size is None else None, validators
+
+    def get_hedge_delay(self) -> float:
+        """
+        The configured percentile of the recent download latencies, or `hedge_delay` until 20 have been observed.
+        """
+        if len(self.latencies) < 20:
+            return self.hedge_delay
+        latencies = sorted(self.latencies)
+        return latencies[int(self.hedge_percentile * (len(latencies) - 1))]
+
+    async def _request(
+        self, client: httpx.AsyncClient, url: str, validators: Optional[dict[str, str]]
+    ) -> tuple[Optional[bytes], dict[str, str]]:
+        """
+        Run `download_img`, hedged with a duplicate request if hedging is enabled, the primary request is slower
+        than the hedge delay and the hedge budget is not used up.
+
+        The first successful response wins and the other request is cancelled. If both fail, the error of the primary
+        request is raised.
+        """
+        started = monotonic()
+        primary = asyncio.ensure_future(
+            download_img(client, url, self.max_bytes, self.max_pixels, validators=validators)
+        )
+        tasks = [primary]
+        try:
+            if self.hedge:
+                self.hedge_stats["requests"] += 1
+                done, _ = await asyncio.wait(tasks, timeout=self.get_hedge_delay())
+                within_budget = self.hedge_stats["hedged"] < self.hedge_budget * self.hedge_stats["requests"]
+                if not done and within_budget:
+                    self.hedge_stats["hedged"] += 1
+                    hedge_url = self.hedge_url(url)
+                    logger.debug(f"Hedge slow request {url} with {hedge_url}")
+                    tasks.append(
+                        asyncio.ensure_future(
+                            download_img(client, hedge_url, self.max_bytes, self.max_pixels, validators=validators)
+                        )
+                    )
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_stats["hedge_wins"] += 1
+                        self.latencies.append(monotonic() - started)
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    @staticmethod
+    def hedge_url(url: str) -> str:
+        """
+        Move a Bilibili CDN url to the next `i0`/`i1`/`i2.hdslb.com` edge, other urls are hedged unchanged.
+        """
+        return re.sub(
+            r"^(https?://i)([0-2])(\.hdslb\.com/)",
+            lambda m: f"{m.group(1)}{(int(m.group(2)) + 1) % 3}{m.group(3)}",
+            url,
+        )
+
+    @staticmethod
+    def smaller_variant(url: str, size: Optional[tuple[int, int]]) -> Optional[str]:
+        """
+        Build the url of a server side downscaled variant of an original upload on the Bilibili image CDN, or None
+        if the url already selects a variant or is not served by the CDN.
+        """
+        host = httpx.URL(url).host
+        if "@" in url.rsplit("/", 1)[-1] or not (host == "hdslb.com" or host.endswith(".hdslb.com")):
+            return None
+        return f"{url}@{size[0] if size is not None else 1008}w.webp"
+
+    @staticmethod
+    def _record_failure(host: str, breaker: CircuitBreaker) -> None:
+        if breaker.record_failure():
+            logger.warning(f"Circuit of {host} opened after {breaker.failures} failures, throttled or unavailable")
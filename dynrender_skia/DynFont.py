@@ -0,0 +1,296 @@
+"""
+@File    :   DynFont.py
+@Time    :   2024/07/09 14:06:52
+@Author  :   BalconyJH
+@Version :   1.0
+@Desc    :   Shared font lookups used by every text drawing routine
+"""
+
+from bisect import bisect_right
+from typing import ClassVar, Optional
+
+import numpy as np
+import skia
+
+CoverageFace = tuple[str, tuple[int, int, int]]
+
+
+def style_key(font_style: skia.FontStyle) -> tuple[int, int, int]:
+    """
+    Hashable key of a `skia.FontStyle`.
+    """
+    return font_style.weight(), font_style.width(), int(font_style.slant())
+
+
+class CoverageIndex:
+    """
+    Code point coverage of every installed typeface, as sorted ranges per (family, style), together with the family
+    the system font matcher prefers wherever several families cover the same code points.
+
+    Building it reads the cmap of each face once, which is what `skia.FontMgr.matchFamilyStyleCharacter` does on
+    every call, so the index is built when the installed font set changes and persisted in between. A lookup tries
+    the faces of the requested family first, then the family the matcher picked for the code point with the same
+    `["zh", "en"]` language hint `FontFallback` passes it, then the remaining families in installed order. Within a
+    family the faces of the requested style come first.
+
+    Args:
+        faces (dict[CoverageFace, list[tuple[int, int]]]): Half open code point ranges covered by each face.
+        preferred (Optional[list[tuple[int, int, str]]]): Sorted, half open code point ranges covered by more than one
+            family, with the family the system matcher picks for them.
+    """
+
+    #: Code points indexed, the BMP and the supplementary planes with emoji and CJK extensions, without surrogates.
+    DOMAIN = np.concatenate([np.arange(0x20, 0xD800), np.arange(0xE000, 0x30000)]).astype(np.uint32)
+    #: Languages passed to the system matcher when picking the preferred family of a range.
+    LANGUAGES: ClassVar[list[str]] = ["zh", "en"]
+
+    def __init__(
+        self,
+        faces: dict[CoverageFace, list[tuple[int, int]]],
+        preferred: Optional[list[tuple[int, int, str]]] = None,
+    ) -> None:
+        self.faces = faces
+        self.preferred = preferred or []
+        self._bounds = {
+            face: ([start for start, _ in ranges], [end for _, end in ranges]) for face, ranges in faces.items()
+        }
+        self._preferred_starts = [start for start, _, _ in self.preferred]
+        self._order: dict[tuple[CoverageFace, Optional[str]], list[CoverageFace]] = {}
+
+    @classmethod
+    def build(cls, font_mgr: skia.FontMgr) -> "CoverageIndex":
+        """
+        Read the coverage of every installed face and ask `font_mgr` once for every distinct set of families that
+        cover the same code points which of them it prefers.
+        """
+        text = cls.DOMAIN.tobytes().decode("utf-32-le")
+        faces: dict[CoverageFace, list[tuple[int, int]]] = {}
+        families = list(font_mgr)
+        if not families:
+            return cls(faces)
+        signatures = np.zeros((len(cls.DOMAIN), (len(families) + 7) // 8), dtype=np.uint8)
+        for index, family in enumerate(families):
+            style_set = font_mgr.matchFamily(family)
+            family_covered = np.zeros(len(cls.DOMAIN), dtype=bool)
+            for style_index in range(style_set.count()):
+                font_style, _ = style_set.getStyle(style_index)
+                covered = np.asarray(skia.Font(style_set.createTypeface(style_index)).textToGlyphs(text)) != 0
+                faces[(family, style_key(font_style))] = cls.to_ranges(covered)
+                family_covered |= covered
+            signatures[:, index // 8] |= family_covered.astype(np.uint8) << (7 - index % 8)
+        changes = np.flatnonzero((signatures[1:] != signatures[:-1]).any(axis=1)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.append(changes, len(cls.DOMAIN))
+        # The pick of code points covered by at most one family does not matter, so ranges of the same pick are merged
+        # across them. None marks a set of families the matcher picked none of.
+        picks: dict[bytes, Optional[str]] = {}
+        preferred: list[tuple[int, int, str]] = []
+        merge = False
+        for start, end in zip(starts, ends):
+            signature = signatures[start].tobytes()
+            if signature not in picks:
+                covering = [families[i] for i in np.flatnonzero(np.unpackbits(signatures[start])[: len(families)])]
+                picks[signature] = ""
+                if len(covering) > 1:
+                    typeface = font_mgr.matchFamilyStyleCharacter(
+                        "", skia.FontStyle.Normal(), cls.LANGUAGES, int(cls.DOMAIN[start])
+                    )
+                    found = typeface is not None and typeface.getFamilyName() in covering
+                    picks[signature] = typeface.getFamilyName() if found else None
+            if (family := picks[signature]) == "":
+                continue
+            if family is None:
+                merge = False
+                continue
+            first, last = int(cls.DOMAIN[start]), int(cls.DOMAIN[end - 1]) + 1
+            if merge and preferred[-1][2] == family:
+                preferred[-1] = (preferred[-1][0], last, family)
+            else:
+                preferred.append((first, last, family))
+            merge = True
+        return cls(faces, preferred)
+
+    @classmethod
+    def to_ranges(cls, covered: np.ndarray) -> list[tuple[int, int]]:
+        """
+        Half open code point ranges of the `DOMAIN` entries marked in `covered`.
+        """
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], covered, [0])).astype(np.int8)))
+        codepoints = np.append(cls.DOMAIN, cls.DOMAIN[-1] + 1)[edges].reshape(-1, 2)
+        return [(int(start), int(end)) for start, end in codepoints]
+
+    @classmethod
+    def from_json(cls, data: dict) -> "CoverageIndex":
+        return cls(
+            {(face["family"], tuple(face["style"])): [tuple(r) for r in face["ranges"]] for face in data["faces"]},
+            [tuple(r) for r in data["preferred"]],
+        )
+
+    def to_json(self) -> dict:
+        return {
+            "faces": [
+                {"family": family, "style": list(style), "ranges": [list(r) for r in ranges]}
+                for (family, style), ranges in self.faces.items()
+            ],
+            "preferred": [list(r) for r in self.preferred],
+        }
+
+    def covers(self, codepoint: int) -> bool:
+        """
+        Tell whether the code point is in the indexed domain, so a miss means that no installed face has it.
+        """
+        return 0x20 <= codepoint < 0x30000 and not 0xD800 <= codepoint < 0xE000
+
+    def preferred_family(self, codepoint: int) -> Optional[str]:
+        index = bisect_right(self._preferred_starts, codepoint) - 1
+        if index >= 0 and codepoint < self.preferred[index][1]:
+            return self.preferred[index][2]
+        return None
+
+    def candidates(self, face: CoverageFace, preferred: Optional[str]) -> list[CoverageFace]:
+        key = (face, preferred)
+        if key not in self._order:
+            family, style = face
+            self._order[key] = sorted(
+                self.faces, key=lambda other: (other[0] != family, other[0] != preferred, other[1] != style)
+            )
+        return self._order[key]
+
+    def find(self, font_family: str, font_style: skia.FontStyle, codepoint: int) -> Optional[CoverageFace]:
+        """
+        Find the installed face to draw a code point with.
+
+        Returns:
+            Optional[CoverageFace]: The family and style of the face, or None if no installed face covers the code
+            point.
+        """
+        for face in self.candidates((font_family, style_key(font_style)), self.preferred_family(codepoint)):
+            starts, ends = self._bounds[face]
+            index = bisect_right(starts, codepoint) - 1
+            if index >= 0 and codepoint < ends[index]:
+                return face
+        return None
+
+
+class FontFallback:
+    """
+    Memoized font fallback resolution.
+
+    `skia.FontMgr.matchFamilyStyleCharacter` is a system font search. It is run once per (family, style, code point)
+    against one shared font manager, and the resulting typeface, or the fact that there is none, is remembered. Once a
+    `CoverageIndex` is loaded, code points in its domain are resolved from the index instead.
+    Fonts handed out are cached per (typeface, size) and shared, so callers must not change their size.
+    """
+
+    def __init__(self) -> None:
+        self._font_mgr: Optional[skia.FontMgr] = None
+        self._typefaces: dict[tuple[str, tuple[int, int, int], int], Optional[skia.Typeface]] = {}
+        self._fonts: dict[tuple[int, float], skia.Font] = {}
+        self._faces: dict[CoverageFace, Optional[skia.Typeface]] = {}
+        self.coverage: Optional[CoverageIndex] = None
+
+    @property
+    def font_mgr(self) -> skia.FontMgr:
+        if self._font_mgr is None:
+            self._font_mgr = skia.FontMgr()
+        return self._font_mgr
+
+    def load_coverage(self, coverage: CoverageIndex) -> None:
+        """
+        Resolve fallback typefaces not looked up yet from `coverage`.
+        """
+        self.coverage = coverage
+
+    def get_face(self, face: CoverageFace) -> Optional[skia.Typeface]:
+        if face not in self._faces:
+            family, (weight, width, slant) = face
+            self._faces[face] = self.font_mgr.matchFamilyStyle(
+                family, skia.FontStyle(weight, width, skia.FontStyle.Slant(slant))
+            )
+        return self._faces[face]
+
+    def match_typeface(self, font_family: str, font_style: skia.FontStyle, character: str) -> Optional[skia.Typeface]:
+        """
+        Find an installed typeface of the family and style that has a glyph for the first code point of `character`.
+        """
+        key = (font_family, style_key(font_style), ord(character[0]))
+        if key in self._typefaces:
+            return self._typefaces[key]
+        if self.coverage is not None and self.coverage.covers(key[2]):
+            face = self.coverage.find(font_family, font_style, key[2])
+            self._typefaces[key] = None if face is None else self.get_face(face)
+        else:
+            self._typefaces[key] = self.font_mgr.matchFamilyStyleCharacter(
+                font_family, font_style, CoverageIndex.LANGUAGES, key[2]
+            )
+        return self._typefaces[key]
+
+    def get_font(self, typeface: skia.Typeface, font_size: float) -> skia.Font:
+        """
+        Return the shared font of a typeface at the given size.
+        """
+        key = (typeface.uniqueID(), font_size)
+        if key not in self._fonts:
+            self._fonts[key] = skia.Font(typeface, font_size)
+        return self._fonts[key]
+
+    def match_font(
+        self, font_family: str, font_style: skia.FontStyle, character: str, font_size: float
+    ) -> Optional[skia.Font]:
+        """
+        Find a fallback font for `character`.
+
+        Returns:
+            Optional[skia.Font]: The shared font of `font_size` with the matched typeface, or None if no installed font
+            matches.
+        """
+        if (typeface := self.match_typeface(font_family, font_style, character)) is None:
+            return None
+        return self.get_font(typeface, font_size)
+
+    def clear(self) -> None:
+        self._typefaces.clear()
+        self._fonts.clear()
+        self._faces.clear()
+
+
+class FontRegistry:
+    """
+    Process-wide registry of typefaces resolved once per (family, style).
+
+    `get_font` hands out one shared `skia.Font` per (family, style, size) for read-only use. Renderers that change
+    the size of their font later take their own instance from `make_font`, which still reuses the cached typeface.
+    """
+
+    def __init__(self) -> None:
+        self._typefaces: dict[tuple[str, tuple[int, int, int]], skia.Typeface] = {}
+        self._fonts: dict[tuple[str, tuple[int, int, int], float], skia.Font] = {}
+
+    def get_typeface(self, font_family: str, font_style: skia.FontStyle) -> skia.Typeface:
+        key = (font_family, style_key(font_style))
+        if key not in self._typefaces:
+            self._typefaces[key] = skia.Typeface.MakeFromName(font_family, font_style)
+        return self._typefaces[key]
+
+    def get_font(self, font_family: str, font_style: skia.FontStyle, font_size: float) -> skia.Font:
+        """
+        Return the shared font of a family and style at the given size. Its size must not be changed.
+        """
+        key = (font_family, style_key(font_style), font_size)
+        if key not in self._fonts:
+            self._fonts[key] = skia.Font(self.get_typeface(font_family, font_style), font_size)
+        return self._fonts[key]
+
+    def make_font(self, font_family: str, font_style: skia.FontStyle, font_size: float) -> skia.Font:
+        """
+        Return a new font owned by the caller, backed by the cached typeface.
+        """
+        return skia.Font(self.get_typeface(font_family, font_style), font_size)
+
+    def clear(self) -> None:
+        self._typefaces.clear()
+        self._fonts.clear()
+
+
+font_fallback = FontFallback()
+font_registry = FontRegistry()
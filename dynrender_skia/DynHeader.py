@@ -7,19 +7,19 @@ import numpy as np
 import skia
 from dynamicadaptor.Header import Head
 from .DynConfig import logger
+from .DynFetcher import ImageFetcher
 from .DynStyle import PolyStyle
-from .DynTools import get_pictures, paste
-from .DynTools import DrawText
+from .DynTools import DrawText, circle_image, paste, run_in_executor
 
 
 class BiliHeader:
     """渲染动态的头部"""
 
-    def __init__(self, static_path: str, style: PolyStyle) -> None:
-        self.face_path = path.join(static_path, "Cache", "Face")
-        self.pendant_path = path.join(static_path, "Cache", "Pendant")
+    def __init__(self, static_path: str, style: PolyStyle, fetcher: Optional[ImageFetcher] = None) -> None:
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
         self.src_path = path.join(static_path, "Src")
         self.style = style
+        self.drawer = DrawText(style)
         self.canvas = None
         self.message = None
 
@@ -36,7 +36,7 @@ class BiliHeader:
                 self.get_face_and_pendant(True),
                 self.get_face_and_pendant(),
             )
-            await self.past_face()
+            await self.past_face(result[3])
             await self.paste_pendant(result[4])
             await self.paste_vip()
             return self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
@@ -70,63 +70,20 @@ class BiliHeader:
             img = skia.Image.open(img_path).resize(45, 45)
             await self.paste(img, (120, 330))
 
-    async def past_face(self):
-        face = await self.get_face_and_pendant(True)
+    async def past_face(self, face):
         if face:
             face = await self.circle_face(face, 120)
             await self.paste(face, (45, 245))
 
     async def get_face_and_pendant(self, img_type: bool = False):
         if img_type:
-            img_name = f"{self.message.mid}.webp"
-            img_url = f"{self.message.face}@240w_240h_1c_1s.webp"
-            img_path = path.join(self.face_path, img_name)
-        elif self.message.pendant and self.message.pendant.image:
-            img_name = f"{self.message.pendant.pid}.png"
-            img_url = f"{self.message.pendant.image}@360w_360h.webp"
-            img_path = path.join(self.pendant_path, img_name)
-        else:
-            return None
-        if path.exists(img_path):
-            if time() - int(path.getmtime(img_path)) <= 43200:
-                return skia.Image.open(img_path)
-        img = await get_pictures(img_url)
-        if img is not None:
-            img.save(img_path)
-            return img
+            return await self.fetcher.get_pictures(f"{self.message.face}@240w_240h_1c_1s.webp", asset="face")
+        if self.message.pendant and self.message.pendant.image:
+            return await self.fetcher.get_pictures(f"{self.message.pendant.image}@360w_360h.webp", asset="pendant")
         return None
 
-    @staticmethod
-    async def circle_face(img: skia.Image, size: int) -> object:
-        surface = skia.Surface(img.dimensions().width(), img.dimensions().height())
-        mask = surface.getCanvas()
-        paint = skia.Paint(
-            Style=skia.Paint.kFill_Style,
-            Color=skia.Color(255, 255, 255, 255),
-            AntiAlias=True,
-        )
-        radius = int(img.dimensions().width() / 2)
-        mask.drawCircle(radius, radius, radius, paint)
-
-        paint = skia.Paint(
-            Style=skia.Paint.kStroke_Style,
-            StrokeWidth=5,
-            Color=skia.Color(251, 114, 153, 255),
-            AntiAlias=True,
-        )
-
-        image_array = np.bitwise_and(
-            img.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-            mask.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-        )
-        canvas = skia.Canvas(image_array, colorType=skia.ColorType.kRGBA_8888_ColorType)
-        canvas.drawCircle(radius, radius, radius - 2, paint)
-        return skia.Image.fromarray(
-            array=canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-            colorType=skia.ColorType.kRGBA_8888_ColorType,
-        ).resize(
-            size, size
-        )  # type: ignore
+    async def circle_face(self, img: skia.Image, size: int) -> skia.Image:
+        return await run_in_executor(circle_image, img, size, executor=self.fetcher.executor)
 
     async def draw_pub_time(self):
         if self.message.pub_ts:
@@ -136,7 +93,7 @@ class BiliHeader:
         else:
             pub_time = " "
 
-        await DrawText(self.style).draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             pub_time,
             self.style.font.font_size.time,
@@ -166,7 +123,7 @@ class BiliHeader:
         else:
             color = self.style.color.font_color.text
 
-        await DrawText(self.style).draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             self.message.name,
             self.style.font.font_size.name,
@@ -183,8 +140,10 @@ class BiliHeader:
 
 
 class RepostHeader:
-    def __init__(self, static_path: str, style: PolyStyle) -> None:
+    def __init__(self, static_path: str, style: PolyStyle, fetcher: Optional[ImageFetcher] = None) -> None:
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
         self.style = style
+        self.drawer = DrawText(style)
         self.static_path = static_path
 
     async def run(self, message: Head) -> Optional[np.ndarray]:
@@ -210,10 +169,10 @@ class RepostHeader:
             img = await self.get_face(mid, url)
             if img is not None:
                 face = await self.circle_face(img, 80)
-            await paste(self.canvas, face, (40, 10))
+                await paste(self.canvas, face, (40, 10))
 
     async def draw_name(self, name, pos: int):
-        await DrawText(self.style).draw_text(
+        await self.drawer.draw_text(
             self.canvas,
             name,
             self.style.font.font_size.name,
@@ -222,51 +181,17 @@ class RepostHeader:
         )
 
     async def circle_face(self, img, size):
-        surface = skia.Surface(img.dimensions().width(), img.dimensions().height())
-        mask = surface.getCanvas()
-        paint = skia.Paint(
-            Style=skia.Paint.kFill_Style,
-            Color=skia.Color(255, 255, 255, 255),
-            AntiAlias=True,
-        )
-        radius = int(img.dimensions().width() / 2)
-        mask.drawCircle(radius, radius, radius, paint)
-
-        paint = skia.Paint(
-            Style=skia.Paint.kStroke_Style,
-            StrokeWidth=5,
-            Color=skia.Color(251, 114, 153, 255),
-            AntiAlias=True,
-        )
-
-        image_array = np.bitwise_and(
-            img.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-            mask.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-        )
-        canvas = skia.Canvas(image_array, colorType=skia.ColorType.kRGBA_8888_ColorType)
-        canvas.drawCircle(radius, radius, radius - 2, paint)
-        return skia.Image.fromarray(
-            canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-            colorType=skia.ColorType.kRGBA_8888_ColorType,
-        ).resize(size, size)
+        return await run_in_executor(circle_image, img, size, executor=self.fetcher.executor)
 
     async def get_face(self, mid, url):
-        img_name = f"{mid}.webp"
-        img_url = f"{url}@240w_240h_1c_1s.webp"
-        img_path = path.join(self.static_path, "Cache", "Face", img_name)
-        if path.exists(img_path):
-            if time() - int(path.getmtime(img_path)) <= 43200:
-                return skia.Image.open(img_path)
-        img = await get_pictures(img_url)
-        if img is not None:
-            img.save(img_path)
-        return img
+        return await self.fetcher.get_pictures(f"{url}@240w_240h_1c_1s.webp", asset="face")
 
 
 class Footer:
     def __init__(self, static_path: str, style: PolyStyle) -> None:
         self.src_path = path.join(static_path, "Src")
         self.style = style
+        self.drawer = DrawText(style)
         self.canvas = None
 
     async def run(self) -> Optional[np.ndarray]:
@@ -277,7 +202,7 @@ class Footer:
             now = strftime("%Y-%m-%d %H:%M:%S", localtime(time()))
             render_time = f"图片生成于：{now}"
 
-            await DrawText(self.style).draw_text(
+            await self.drawer.draw_text(
                 self.canvas,
                 render_time,
                 self.style.font.font_size.title,
@@ -0,0 +1,380 @@
+"""
+@File    :   DynLayout.py
+@Time    :   2024/07/08 20:41:17
+@Author  :   BalconyJH
+@Version :   1.0
+@Desc    :   Line level text layout drawing one glyph run per font and line
+"""
+
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Callable, NamedTuple, Optional, Union
+
+import numpy as np
+import skia
+
+from .DynEmoji import get_emoji_text
+from .DynFont import font_fallback
+
+
+def fit_clusters(
+    widths: np.ndarray, cluster_end: np.ndarray, x: float, overflow: Callable[[np.ndarray], np.ndarray]
+) -> tuple[np.ndarray, int, bool]:
+    """
+    Place glyphs from `x` up to and including the first cluster after which `overflow` holds.
+
+    The positions are a cumulative sum over the advances that starts at `x`, accumulated in the same order as adding
+    the advances one by one, so they are identical to a per-glyph loop.
+
+    Args:
+        widths (np.ndarray): The advances of the glyphs.
+        cluster_end (np.ndarray): Whether a line may break after each glyph.
+        x (float): The position of the first glyph.
+        overflow (Callable[[np.ndarray], np.ndarray]): Tells for the positions after each glyph whether the line is
+            full.
+
+    Returns:
+        tuple[np.ndarray, int, bool]: The positions of the placed glyphs followed by the position after the last one,
+        the number of glyphs placed and whether the line overflowed.
+    """
+    advance = np.cumsum(np.concatenate(([x], widths)))
+    over = np.flatnonzero(cluster_end & overflow(advance[1:]))
+    count = int(over[0]) + 1 if over.size else len(widths)
+    return advance[: count + 1], count, bool(over.size)
+
+
+def match_font(font_family: str, font_style: skia.FontStyle, character: str, font_size: float) -> Optional[skia.Font]:
+    """
+    Find a font of the given family and style that has a glyph for `character`, memoized by `font_fallback`.
+
+    Returns:
+        Optional[skia.Font]: A shared font of `font_size` with the matched typeface, or None if no installed font
+        matches.
+    """
+    return font_fallback.match_font(font_family, font_style, character, font_size)
+
+
+class TextRun(NamedTuple):
+    """
+    A piece of text that is drawn with a single font.
+
+    `glyphs` and `widths` hold one entry per code point, `clusters` the end index (into `glyphs`) of every cluster.
+    A cluster is the unit a line may break after, a single character or a whole emoji sequence.
+    """
+
+    font: skia.Font
+    text: str
+    glyphs: list[int]
+    widths: list[float]
+    clusters: list[int]
+    emoji: bool
+
+
+class GlyphRun(NamedTuple):
+    font: skia.Font
+    glyphs: list[int]
+    positions: list[float]
+
+
+class TextLine(NamedTuple):
+    y: float
+    runs: list[GlyphRun]
+
+
+class TextLayout(NamedTuple):
+    """
+    The laid out lines of a text together with the ellipsis drawn when the text was cut off by the height bound.
+
+    `width` is the horizontal extent from the start position, ellipsis included, and `end` the number of characters
+    of the text that were laid out.
+    """
+
+    lines: list[TextLine]
+    ellipsis: Optional[tuple[float, float, skia.Font]]
+    width: float
+    end: int
+
+
+class TextMetrics(NamedTuple):
+    """
+    The size of a laid out text without drawing it.
+
+    `height` runs from the ascent of the first line to the descent of the last one. `truncated` is the number of
+    characters drawn before the ellipsis, or None if the whole text fits.
+    """
+
+    lines: int
+    width: float
+    height: float
+    truncated: Optional[int]
+
+
+class ShapedText(NamedTuple):
+    """
+    A finished layout together with the text blobs that draw it, each with the offset it is drawn at.
+    """
+
+    layout: TextLayout
+    blobs: list[tuple[skia.TextBlob, float, float]]
+
+
+class LayoutCache:
+    """
+    Bounded LRU of shaped texts.
+
+    Keys are (text, typeface, size, emoji typeface, position and bounds). `skia.TextBlob` is immutable, so a hit is
+    drawn by replaying the stored blobs without shaping or breaking lines again.
+
+    Args:
+        max_entries (int): Number of shaped texts kept before least recently used ones are dropped.
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, ShapedText] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Optional[ShapedText]:
+        if (entry := self._entries.get(key)) is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, shaped: ShapedText) -> None:
+        self._entries[key] = shaped
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+layout_cache = LayoutCache()
+
+
+class TextEngine:
+    """
+    Lay out text into lines of glyph runs and draw every line with a single `skia.TextBlob`.
+
+    The text is split into runs by font (primary, fallback, emoji), each run is converted to glyphs and measured with
+    one `textToGlyphs` and one `getWidths` call, and every line is built with a `skia.TextBlobBuilder` holding one
+    positioned run per font. Glyphs end up at exactly the positions the previous character by character drawing used,
+    including where lines wrap and where the ellipsis goes, so the output is pixel equivalent.
+
+    Args:
+        text_font (skia.Font): The primary font.
+        emoji_font (skia.Font): The font used for emoji sequences.
+        match_font (Callable[[str, int], Optional[skia.Font]]): Resolves a fallback font of the given size for a
+            character the primary (or emoji) font has no glyph for. It has to return the same font object for the
+            same typeface and size, as `match_font` does, so neighbouring fallback characters share one run.
+    """
+
+    def __init__(
+        self,
+        text_font: skia.Font,
+        emoji_font: skia.Font,
+        match_font: Callable[[str, int], Optional[skia.Font]],
+    ) -> None:
+        self.text_font = text_font
+        self.emoji_font = emoji_font
+        self.match_font = match_font
+
+    def make_runs(self, text: str, emoji_info: dict[int, list[Union[int, str]]]) -> list[TextRun]:
+        """
+        Split text into runs of one font each and measure them.
+
+        The glyphs of the whole text are looked up in the primary font with one call, and only the positions where
+        it has no glyph or an emoji starts are handled one by one, the stretches in between become runs at once.
+
+        Args:
+            text (str): The text to split.
+            emoji_info (dict[int, list[Union[int, str]]]): Emoji positions as returned by `get_emoji_text`.
+
+        Returns:
+            list[TextRun]: The runs in text order.
+        """
+        font_size = self.text_font.getSize()
+        missing = np.flatnonzero(np.asarray(self.text_font.textToGlyphs(text), dtype=np.uint32) == 0)
+
+        def resolve(character: str) -> skia.Font:
+            return self.match_font(character, font_size) or self.text_font
+
+        pieces: list[tuple[skia.Font, bool, list[str]]] = []
+
+        def append(font: skia.Font, emoji: bool, clusters: list[str]) -> None:
+            if pieces and pieces[-1][0] is font and pieces[-1][1] == emoji:
+                pieces[-1][2].extend(clusters)
+            else:
+                pieces.append((font, emoji, clusters))
+
+        offset = 0
+        for position in sorted({*emoji_info, *missing.tolist(), len(text)}):
+            if position < offset:
+                continue
+            if position > offset:
+                append(self.text_font, False, list(text[offset:position]))
+            if position == len(text):
+                break
+            if position in emoji_info:
+                end = int(emoji_info[position][0])
+                cluster = text[position:end]
+                covered = self.emoji_font.textToGlyphs(cluster[0])[0] != 0
+                append(self.emoji_font if covered else resolve(cluster[0]), True, [cluster])
+            else:
+                end = position + 1
+                append(resolve(text[position]), False, [text[position]])
+            offset = end
+
+        runs = []
+        for font, emoji, clusters in pieces:
+            run_text = "".join(clusters)
+            glyphs = font.textToGlyphs(run_text)
+            ends = list(accumulate(map(len, clusters)))
+            runs.append(TextRun(font, run_text, glyphs, font.getWidths(glyphs), ends, emoji))
+        return runs
+
+    @staticmethod
+    def layout(runs: list[TextRun], position_and_bounds: tuple[int, int, int, int, int]) -> TextLayout:
+        """
+        Break runs into lines.
+
+        A cluster is always placed on the current line. If the line is wider than `max_width` afterwards, the text
+        continues on the next line, or, when the next line would reach `max_height`, an ellipsis is placed right
+        after the cluster and layout stops. Glyph positions and break points come from cumulative sums over the
+        advances of all runs, see `fit_clusters`.
+
+        Args:
+            runs (list[TextRun]): The runs from `make_runs`.
+            position_and_bounds (tuple[int, int, int, int, int]): x and y of the first baseline, the maximum width
+                and height and the line spacing.
+
+        Returns:
+            TextLayout: The laid out lines.
+        """
+        x, y, max_width, max_height, line_spacing = position_and_bounds
+        lines: list[TextLine] = []
+        if not runs:
+            return TextLayout(lines, None, 0, 0)
+        run_starts = np.cumsum([0] + [len(run.glyphs) for run in runs])
+        widths = np.concatenate([np.asarray(run.widths, dtype=np.float64) for run in runs])
+        cluster_end = np.zeros(len(widths), dtype=bool)
+        for run, run_start in zip(runs, run_starts):
+            cluster_end[run_start + np.asarray(run.clusters, dtype=np.intp) - 1] = True
+
+        right = x
+        start = 0
+        while start < len(widths):
+            advance, count, overflowed = fit_clusters(
+                widths[start:], cluster_end[start:], x, lambda offset: offset > max_width
+            )
+            stop = start + count
+            right = max(right, advance[-1])
+            line = []
+            for index, run in enumerate(runs):
+                first, last = max(start, run_starts[index]), min(stop, run_starts[index + 1])
+                if first < last:
+                    glyphs = run.glyphs[first - run_starts[index] : last - run_starts[index]]
+                    line.append(GlyphRun(run.font, list(glyphs), advance[first - start : last - start].tolist()))
+            lines.append(TextLine(y, line))
+            if overflowed and y + line_spacing >= max_height:
+                font = runs[int(np.searchsorted(run_starts, stop, side="left")) - 1].font
+                right = max(right, advance[-1] + font.measureText("..."))
+                return TextLayout(lines, (float(advance[-1]), y, font), float(right - x), stop)
+            if overflowed:
+                y += line_spacing
+            start = stop
+        return TextLayout(lines, None, float(right - x), len(widths))
+
+    @staticmethod
+    def make_blob(line: TextLine) -> Optional[skia.TextBlob]:
+        """
+        Build one text blob holding every glyph run of a line.
+        """
+        builder = skia.TextBlobBuilder()
+        for run in line.runs:
+            if run.glyphs:
+                builder.allocRunPosH(run.font, run.glyphs, run.positions, line.y)
+        return builder.make()
+
+    @classmethod
+    def make_blobs(cls, layout: TextLayout) -> list[tuple[skia.TextBlob, float, float]]:
+        """
+        Build the text blobs of a layout, one per line plus one for the ellipsis.
+        """
+        blobs = [(blob, 0, 0) for line in layout.lines if (blob := cls.make_blob(line)) is not None]
+        if layout.ellipsis is not None:
+            x, y, font = layout.ellipsis
+            blobs.append((skia.TextBlob("...", font), x, y))
+        return blobs
+
+    def draw(self, canvas: skia.Canvas, layout: TextLayout, paint: skia.Paint) -> None:
+        """
+        Draw a layout with one `drawTextBlob` call per line, plus one for the ellipsis.
+        """
+        for blob, x, y in self.make_blobs(layout):
+            canvas.drawTextBlob(blob, x, y, paint)
+
+    def shape(self, text: str, position_and_bounds: tuple[int, int, int, int, int]) -> ShapedText:
+        """
+        Lay out text and build its blobs, reusing the result from `layout_cache` for text that was shaped before
+        with the same fonts and bounds.
+
+        Args:
+            text (str): The text, emoji are found with `get_emoji_text`.
+            position_and_bounds (tuple[int, int, int, int, int]): See `layout`.
+
+        Returns:
+            ShapedText: The layout and its blobs.
+        """
+        key = (
+            text,
+            self.text_font.getTypeface().uniqueID(),
+            self.text_font.getSize(),
+            self.emoji_font.getTypeface().uniqueID(),
+            tuple(position_and_bounds),
+        )
+        if (shaped := layout_cache.get(key)) is None:
+            layout = self.layout(self.make_runs(text, get_emoji_text(text)), position_and_bounds)
+            shaped = ShapedText(layout, self.make_blobs(layout))
+            layout_cache.put(key, shaped)
+        return shaped
+
+    def measure(self, text: str, position_and_bounds: tuple[int, int, int, int, int]) -> TextMetrics:
+        """
+        Measure text as `shape` would lay it out, without drawing. The shaped text is cached for a following draw.
+
+        Args:
+            text (str): The text to measure.
+            position_and_bounds (tuple[int, int, int, int, int]): See `layout`.
+
+        Returns:
+            TextMetrics: Line count, width, height and truncation point.
+        """
+        layout = self.shape(text, position_and_bounds).layout
+        if not layout.lines:
+            return TextMetrics(0, 0, 0, None)
+        metrics = self.text_font.getMetrics()
+        height = layout.lines[-1].y - layout.lines[0].y + metrics.fDescent - metrics.fAscent
+        truncated = layout.end if layout.ellipsis is not None else None
+        return TextMetrics(len(layout.lines), layout.width, height, truncated)
+
+    @staticmethod
+    def draw_shaped(canvas: skia.Canvas, shaped: ShapedText, paint: skia.Paint) -> None:
+        """
+        Replay the blobs of a shaped text.
+        """
+        for blob, x, y in shaped.blobs:
+            canvas.drawTextBlob(blob, x, y, paint)
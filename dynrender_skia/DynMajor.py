@@ -11,7 +11,6 @@ from math import ceil
 from os import path
 from typing import Optional
 
-import emoji
 import numpy as np
 import skia
 from dynamicadaptor.Content import RichTextDetail
@@ -19,30 +18,59 @@ from dynamicadaptor.Content import Text
 from dynamicadaptor.Majors import Major, RichTextNodes
 from loguru import logger
 
+from .DynFetcher import ImageFetcher
+from .DynFont import font_registry
+from .DynLayout import match_font
+from .DynPlanner import draw_urls
 from .DynStyle import PolyStyle
 from .DynText import BiliText
-from .DynTools import paste, get_pictures, merge_pictures
+from .DynTools import DrawText, merge_pictures, paste, round_corner_image, run_in_executor
 
 
 class AbstractMajor(ABC):
-    def __init__(self, src_path: str, style: PolyStyle, dyn_major: Major = None) -> None:
+    def __init__(
+        self, src_path: str, style: PolyStyle, dyn_major: Major = None, fetcher: Optional[ImageFetcher] = None
+    ) -> None:
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
         self.style = style
         self.major = dyn_major
-        self.text_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.text_font = font_registry.make_font(
+            self.style.font.font_family, self.style.font.font_style, self.style.font.font_size.text
         )
-        self.emoji_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.emoji_font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.emoji_font = font_registry.make_font(
+            self.style.font.emoji_font_family, self.style.font.font_style, self.style.font.font_size.text
         )
+        self.drawer = DrawText(style)
         self.src_path = src_path
         self.canvas = None
 
+    #: Bounds of the title under the cover of a video card, a single line ending in an ellipsis.
+    video_title_bounds = (60, 650, 980, 600, 10)
+
     @abstractmethod
     async def run(self, repost) -> Optional[np.ndarray]:
         pass
 
+    async def measure_last_baseline(
+        self, text: str, font_size: int, bounds: tuple[int, int, int, int, int]
+    ) -> Optional[int]:
+        """
+        Baseline of the last line `draw_text` would draw `text` on, or None if it would draw nothing.
+        """
+        metrics = await self.drawer.measure(text, font_size, bounds)
+        if not metrics.lines:
+            return None
+        _, y, _, _, line_spacing = bounds
+        return y + (metrics.lines - 1) * line_spacing
+
+    async def video_card_height(self, title: str) -> int:
+        """
+        Height of a video card starting at y 25: its 570 high cover, extended 40 below the baseline of the title if
+        there is one to draw.
+        """
+        baseline = await self.measure_last_baseline(title, self.style.font.font_size.text, self.video_title_bounds)
+        return 570 if baseline is None else baseline + 40 - 25
+
     async def draw_text(
         self,
         canvas,
@@ -52,58 +80,7 @@ class AbstractMajor(ABC):
         font_color: tuple,
         font_style=None,
     ):
-        paint = skia.Paint(AntiAlias=True, Color=skia.Color(*font_color))
-        if font_style is not None:
-            self.text_font = skia.Font(
-                skia.Typeface.MakeFromName(self.style.font.font_family, font_style),
-                self.style.font.font_size.text,
-            )
-        self.text_font.setSize(font_size)  # todo:repitition in DynMajor.py line 88
-        self.emoji_font.setSize(font_size)
-        text = text.replace("\t", "")
-        emoji_info = await self.get_emoji_text(text)
-        total = len(text) - 1
-        x, y, x_bound, y_bound, y_int = pos
-        offset = 0
-        while offset <= total:
-            j = text[offset]
-            if j == "\n":
-                break
-            if offset in emoji_info.keys():
-                j = emoji_info[offset][1]
-                offset = emoji_info[offset][0]
-                font = self.emoji_font
-            else:
-                offset += 1
-                font = self.text_font
-            if font.textToGlyphs(j)[0] == 0:
-                if typeface := skia.FontMgr().matchFamilyStyleCharacter(
-                    self.style.font.font_family,
-                    self.style.font.font_style,
-                    ["zh", "en"],
-                    ord(j[0]),
-                ):
-                    font = skia.Font(typeface, font_size)
-                else:
-                    font = self.text_font
-            measure = font.measureText(j)
-            blob = skia.TextBlob(j, font)
-            canvas.drawTextBlob(blob, x, y, paint)
-            x += measure
-            if x > x_bound:
-                y += y_int
-                if y >= y_bound:
-                    blob = skia.TextBlob("...", font)
-                    canvas.drawTextBlob(blob, x, y - y_int, paint)
-                    break
-                x = pos[0]
-
-    async def get_emoji_text(self, text):
-        result = emoji.emoji_list(text)
-        temp = {}
-        for i in result:
-            temp[i["match_start"]] = [i["match_end"], i["emoji"]]
-        return temp
+        await self.drawer.draw_text(canvas, text, font_size, pos, font_color, font_style)
 
     async def draw_shadow(self, canvas, pos: tuple, corner: int, bg_color):
         x, y, width, height = pos
@@ -119,32 +96,16 @@ class AbstractMajor(ABC):
             canvas.drawRect(rec, paint)
 
     async def make_round_cornor(self, img, corner: int):
-        surface = skia.Surface(img.width(), img.height())
-        mask = surface.getCanvas()
-        paint = skia.Paint(
-            Style=skia.Paint.kFill_Style,
-            Color=skia.Color(255, 255, 255, 255),
-            AntiAlias=True,
-        )
-        rect = skia.Rect.MakeXYWH(0, 0, img.width(), img.height())
-        mask.drawRoundRect(rect, corner, corner, paint)
-        image_array = np.bitwise_and(
-            img.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-            mask.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
-        )
-        return skia.Image.fromarray(image_array, colorType=skia.ColorType.kRGBA_8888_ColorType)
+        return await run_in_executor(round_corner_image, img, corner, executor=self.fetcher.executor)
 
     async def make_tag(self, tag: str, font_size: int):
         text_font = self.text_font
         if text_font.textToGlyphs(text=tag[0])[0] == 0:  # type: ignore
-            if typeface := skia.FontMgr().matchFamilyStyleCharacter(
-                self.style.font.font_family,
-                self.style.font.font_style,
-                ["zh", "en"],
-                ord(tag[0]),
-            ):
-                text_font = skia.Font(typeface, self.style.font.font_size.text)
-        text_font.setSize(font_size)
+            text_font = (
+                match_font(self.style.font.font_family, self.style.font.font_style, tag[0], font_size) or text_font
+            )
+        if text_font is self.text_font:
+            text_font.setSize(font_size)
         size = text_font.measureText(text=tag)  # type: ignore
         surface = skia.Surface(int(size + 20), int(text_font.getSize() + 20))
         canvas = surface.getCanvas()
@@ -162,14 +123,11 @@ class AbstractMajor(ABC):
     async def make_sub_tag(self, sub_tag: str, font_size: int):
         text_font = self.text_font
         if text_font.textToGlyphs(text=sub_tag[0])[0] == 0:  # type: ignore
-            if typeface := skia.FontMgr().matchFamilyStyleCharacter(
-                self.style.font.font_family,
-                self.style.font.font_style,
-                ["zh", "en"],
-                ord(sub_tag[0]),
-            ):
-                text_font = skia.Font(typeface, self.style.font.font_size.text)
-        text_font.setSize(font_size)
+            text_font = (
+                match_font(self.style.font.font_family, self.style.font.font_style, sub_tag[0], font_size) or text_font
+            )
+        if text_font is self.text_font:
+            text_font.setSize(font_size)
         size = text_font.measureText(text=sub_tag)  # type: ignore
         surface = skia.Surface(int(size + 20), int(text_font.getSize() + 20))
         canvas = surface.getCanvas()
@@ -185,41 +143,42 @@ class AbstractMajor(ABC):
 
 
 class BiliMajor:
-    def __init__(self, static_path: str, style: PolyStyle) -> None:
+    def __init__(self, static_path: str, style: PolyStyle, fetcher: Optional[ImageFetcher] = None) -> None:
         self.src_path = path.join(static_path, "Src")
         self.style = style
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
 
     async def run(self, dyn_major: Major, repost: bool = False) -> Optional[np.ndarray]:
         try:
             major_type = dyn_major.type
             if major_type == "MAJOR_TYPE_DRAW":
-                return await DynMajorDraw(self.style, items=dyn_major.draw.items).run(repost)
+                return await DynMajorDraw(self.style, items=dyn_major.draw.items, fetcher=self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_ARCHIVE":
-                return await DynMajorArchive(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorArchive(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_LIVE_RCMD":
-                return await DynMajorLiveRcmd(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorLiveRcmd(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_OPUS":
-                return await DynMajorOpus(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorOpus(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_ARTICLE":
-                return await DynMajorArticle(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorArticle(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_COMMON":
-                return await DynMajorCommon(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorCommon(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_MUSIC":
-                return await DynMajorMusic(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorMusic(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_PGC":
-                return await DynMajorPgc(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorPgc(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_MEDIALIST":
-                return await DynMajorMediaList(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorMediaList(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_COURSES":
-                return await DynMajorCourses(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorCourses(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_UGC_SEASON":
-                return await DynMajorUgc(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorUgc(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_LIVE":
-                return await DynMajorLive(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorLive(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_NONE":
-                return await DynMajorNone(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorNone(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             elif major_type == "MAJOR_TYPE_BLOCKED":
-                return await DynMajorBlocked(self.src_path, self.style, dyn_major).run(repost)
+                return await DynMajorBlocked(self.src_path, self.style, dyn_major, self.fetcher).run(repost)
             else:
                 logger.warning(f"{major_type} is not supported")
                 return None
@@ -231,9 +190,10 @@ class BiliMajor:
 class DynMajorDraw:
     """Dynamic picture drawing class"""
 
-    def __init__(self, style: PolyStyle, items=None) -> None:
+    def __init__(self, style: PolyStyle, items=None, fetcher: Optional[ImageFetcher] = None) -> None:
         self.style = style
         self.items = items
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
 
     async def run(self, repost: bool) -> Optional[np.ndarray]:
         """
@@ -255,16 +215,9 @@ class DynMajorDraw:
             return None
 
     async def single_img(self, background_color: tuple, items) -> np.ndarray:
-        src = items[0].src or items[0].url
-        img_height = items[0].height
-        img_width = items[0].width
-        if img_height / img_width > 4:
-            img_url = f"{src}@{600}w_{800}h_!header.webp"
-        else:
-            img_url = src
-        img: skia.Image = await get_pictures(img_url)
+        url_list, size = draw_urls(items)
+        img: skia.Image = await self.fetcher.get_pictures(url_list[0], size, asset="draw")
         if img is not None:
-            img = img.resize(width=1008, height=int(img.height() * 1008 / img.width()))
             surface = skia.Surface(1080, img.height() + 20)
             canvas = surface.getCanvas()
             canvas.clear(skia.Color(*background_color))
@@ -278,16 +231,8 @@ class DynMajorDraw:
         return canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
 
     async def dual_img(self, background_color: tuple, items):
-        url_list = []
-        for item in items:
-            src = item.src or item.url
-            img_height = item.height
-            img_width = item.width
-            if img_height / img_width > 3:
-                url_list.append(f"{src}@520w_520h_!header.webp")
-            else:
-                url_list.append(f"{src}@520w_520h_1e_1c.webp")
-        imgs = await get_pictures(url_list, (520, 520))
+        url_list, size = draw_urls(items)
+        imgs = await self.fetcher.get_pictures(url_list, size, asset="draw")
         num = len(url_list) / 2
         back_size = int(num * 520 + 20 * num)
         surface = skia.Surface(1080, back_size)
@@ -305,18 +250,10 @@ class DynMajorDraw:
         return canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
 
     async def triplex_img(self, background_color: tuple, items):
-        url_list = []
-        for item in items:
-            src = item.src or item.url
-            img_height = item.height
-            img_width = item.width
-            if img_height / img_width > 3:
-                url_list.append(f"{src}@260w_260h_!header.webp")
-            else:
-                url_list.append(f"{src}@260w_260h_1e_1c.webp")
+        url_list, size = draw_urls(items)
         num = ceil(len(items) / 3)
 
-        imgs = await get_pictures(url_list, (346, 346))
+        imgs = await self.fetcher.get_pictures(url_list, size, asset="draw")
 
         back_size = int(num * 346 + 20 * num)
         surface = skia.Surface(1080, back_size)
@@ -336,21 +273,24 @@ class DynMajorDraw:
 class DynMajorArchive(AbstractMajor):
     async def run(self, repost):
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 695)
-        self.canvas = surface.getCanvas()
-        self.canvas.clear(skia.Color(*background_color))
         tv = skia.Image.open(path.join(self.src_path, "tv.png")).resize(130, 130)
         try:
-            cover = await get_pictures(f"{self.major.archive.cover}@505w_285h_1c.webp", (1010, 570))
+            card_height = await self.video_card_height(self.major.archive.title)
+            surface = skia.Surface(1080, card_height + 30)
+            self.canvas = surface.getCanvas()
+            self.canvas.clear(skia.Color(*background_color))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.archive.cover}@505w_285h_1c.webp", (1010, 570), asset="cover"
+            )
 
-            await self.draw_shadow(self.canvas, (35, 25, 1010, 655), 20, background_color)
-            rec = skia.Rect.MakeXYWH(35, 25, 1010, 665)
+            await self.draw_shadow(self.canvas, (35, 25, 1010, card_height - 10), 20, background_color)
+            rec = skia.Rect.MakeXYWH(35, 25, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await self.draw_text(
                 self.canvas,
                 self.major.archive.title,
                 self.style.font.font_size.text,
-                (60, 650, 980, 600, 10),
+                self.video_title_bounds,
                 self.style.color.font_color.text,
             )
             await paste(self.canvas, cover, (35, 25))
@@ -367,24 +307,26 @@ class DynMajorArchive(AbstractMajor):
 class DynMajorLiveRcmd(AbstractMajor):
     async def run(self, repost) -> Optional[np.ndarray]:
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 695)
-        self.canvas = surface.getCanvas()
-        self.canvas.clear(skia.Color(*background_color))
         try:
-            cover = await get_pictures(
+            card_height = await self.video_card_height(self.major.live_rcmd.content.live_play_info.title)
+            surface = skia.Surface(1080, card_height + 30)
+            self.canvas = surface.getCanvas()
+            self.canvas.clear(skia.Color(*background_color))
+            cover = await self.fetcher.get_pictures(
                 f"{self.major.live_rcmd.content.live_play_info.cover}@505w_285h_1c.webp",
                 (1010, 570),
+                asset="cover",
             )
 
-            await self.draw_shadow(self.canvas, (35, 25, 1010, 655), 20, background_color)
-            rec = skia.Rect.MakeXYWH(35, 25, 1010, 665)
+            await self.draw_shadow(self.canvas, (35, 25, 1010, card_height - 10), 20, background_color)
+            rec = skia.Rect.MakeXYWH(35, 25, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
 
             await self.draw_text(
                 self.canvas,
                 self.major.live_rcmd.content.live_play_info.title,
                 self.style.font.font_size.text,
-                (60, 650, 980, 600, 10),
+                self.video_title_bounds,
                 self.style.color.font_color.text,
             )
             await paste(self.canvas, cover, (35, 25))
@@ -433,13 +375,13 @@ class DynMajorOpus(AbstractMajor):
                         self._convert_to_rich_text_detail(node) for node in self.major.opus.summary.rich_text_nodes
                     ],
                 )
-                text_img = await BiliText(path.dirname(self.src_path), self.style).run(dyn_text, repost)
+                text_img = await BiliText(path.dirname(self.src_path), self.style, self.fetcher).run(dyn_text, repost)
                 pics.append(text_img)
         except Exception as e:
             logger.exception(e)
         try:
             if self.major.opus.pics:
-                cover = await DynMajorDraw(self.style, items=self.major.opus.pics).run(repost)
+                cover = await DynMajorDraw(self.style, items=self.major.opus.pics, fetcher=self.fetcher).run(repost)
                 pics.append(cover)
         except Exception as e:
             logger.exception(e)
@@ -466,13 +408,14 @@ class DynMajorOpus(AbstractMajor):
 class DynMajorArticle(AbstractMajor):
     async def run(self, repost) -> Optional[np.ndarray]:
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 640)
+        card_height = await self.measure_card_height()
+        surface = skia.Surface(1080, card_height + 40)
         self.canvas = surface.getCanvas()
         self.canvas.clear(skia.Color(*background_color))
         try:
-            await self.draw_shadow(self.canvas, (35, 20, 1010, 600), 20, background_color)
+            await self.draw_shadow(self.canvas, (35, 20, 1010, card_height), 20, background_color)
 
-            rec = skia.Rect.MakeXYWH(35, 20, 1010, 600)
+            rec = skia.Rect.MakeXYWH(35, 20, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await self.draw_title_and_desc()
             await self.make_cover()
@@ -481,14 +424,28 @@ class DynMajorArticle(AbstractMajor):
             logger.exception(e)
             return None
 
+    def desc_bounds(self) -> tuple[int, int, int, int, int]:
+        return 65, 460, 980, 620, int(self.style.font.font_size.title * 1.8)
+
+    async def measure_card_height(self) -> int:
+        """
+        Height of the card, ending one line below the last line of the description, at most the former fixed 600.
+        """
+        bounds = self.desc_bounds()
+        baseline = await self.measure_last_baseline(self.major.article.desc, self.style.font.font_size.title, bounds)
+        _, y, _, max_height, line_spacing = bounds
+        return min((y if baseline is None else baseline) + line_spacing, max_height) - 20
+
     async def make_cover(self):
         if len(self.major.article.covers) > 1:
             url_list = [f"{i}@360w_360h_1c" for i in self.major.article.covers]
-            imgs = await get_pictures(url_list, (330, 330))
+            imgs = await self.fetcher.get_pictures(url_list, (330, 330), asset="cover")
             for i, j in enumerate(imgs):
                 await paste(self.canvas, j, (35 + i * 340, 20))
         else:
-            img = await get_pictures(f"{self.major.article.covers[0]}@647w_150h_1c.webp", (1010, 300))
+            img = await self.fetcher.get_pictures(
+                f"{self.major.article.covers[0]}@647w_150h_1c.webp", (1010, 300), asset="cover"
+            )
             await paste(self.canvas, img, (35, 20))
 
     async def draw_title_and_desc(self):
@@ -514,7 +471,7 @@ class DynMajorArticle(AbstractMajor):
             self.canvas,
             desc,
             self.style.font.font_size.title,
-            (65, 460, 980, 620, int(self.style.font.font_size.title * 1.8)),
+            self.desc_bounds(),
             self.style.color.font_color.sub_title,
         )
 
@@ -529,7 +486,9 @@ class DynMajorCommon(AbstractMajor):
             await self.draw_shadow(self.canvas, (35, 20, 1010, 245), 20, background_color)
             rec = skia.Rect.MakeXYWH(35, 20, 1010, 245)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
-            cover = await get_pictures(f"{self.major.common.cover}@245w_245h_1c.webp", (245, 245))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.common.cover}@245w_245h_1c.webp", (245, 245), asset="cover"
+            )
             await paste(self.canvas, cover, (35, 20))
             await self.make_title()
             await self.make_common_tag()
@@ -588,7 +547,9 @@ class DynMajorMusic(AbstractMajor):
             await self.draw_shadow(self.canvas, (35, 20, 1010, 245), 20, background_color)
             rec = skia.Rect.MakeXYWH(35, 20, 1010, 245)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
-            cover = await get_pictures(f"{self.major.music.cover}@245w_245h_1c.webp", (245, 245))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.music.cover}@245w_245h_1c.webp", (245, 245), asset="cover"
+            )
             await paste(self.canvas, cover, (35, 20))
             await self.make_title()
             return self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
@@ -618,20 +579,23 @@ class DynMajorMusic(AbstractMajor):
 class DynMajorPgc(AbstractMajor):
     async def run(self, repost):
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 695)
-        self.canvas = surface.getCanvas()
-        self.canvas.clear(skia.Color(*background_color))
         tv = skia.Image.open(path.join(self.src_path, "tv.png")).resize(130, 130)
         try:
-            cover = await get_pictures(f"{self.major.pgc.cover}@505w_285h_1c.webp", (1010, 570))
-            await self.draw_shadow(self.canvas, (35, 25, 1010, 655), 20, background_color)
-            rec = skia.Rect.MakeXYWH(35, 25, 1010, 665)
+            card_height = await self.video_card_height(self.major.pgc.title)
+            surface = skia.Surface(1080, card_height + 30)
+            self.canvas = surface.getCanvas()
+            self.canvas.clear(skia.Color(*background_color))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.pgc.cover}@505w_285h_1c.webp", (1010, 570), asset="cover"
+            )
+            await self.draw_shadow(self.canvas, (35, 25, 1010, card_height - 10), 20, background_color)
+            rec = skia.Rect.MakeXYWH(35, 25, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await self.draw_text(
                 self.canvas,
                 self.major.pgc.title,
                 self.style.font.font_size.text,
-                (60, 650, 980, 600, 10),
+                self.video_title_bounds,
                 self.style.color.font_color.text,
             )
             await paste(self.canvas, cover, (35, 25))
@@ -651,20 +615,23 @@ class DynMajorPgc(AbstractMajor):
 class DynMajorMediaList(AbstractMajor):
     async def run(self, repost):
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 695)
-        self.canvas = surface.getCanvas()
-        self.canvas.clear(skia.Color(*background_color))
         tv = skia.Image.open(path.join(self.src_path, "tv.png")).resize(130, 130)
         try:
-            cover = await get_pictures(f"{self.major.medialist.cover}@505w_285h_1c.webp", (1010, 570))
-            await self.draw_shadow(self.canvas, (35, 25, 1010, 655), 20, background_color)
-            rec = skia.Rect.MakeXYWH(35, 25, 1010, 665)
+            card_height = await self.video_card_height(self.major.medialist.title)
+            surface = skia.Surface(1080, card_height + 30)
+            self.canvas = surface.getCanvas()
+            self.canvas.clear(skia.Color(*background_color))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.medialist.cover}@505w_285h_1c.webp", (1010, 570), asset="cover"
+            )
+            await self.draw_shadow(self.canvas, (35, 25, 1010, card_height - 10), 20, background_color)
+            rec = skia.Rect.MakeXYWH(35, 25, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await self.draw_text(
                 self.canvas,
                 self.major.medialist.title,
                 self.style.font.font_size.text,
-                (60, 650, 980, 600, 10),
+                self.video_title_bounds,
                 self.style.color.font_color.text,
             )
             await paste(self.canvas, cover, (35, 25))
@@ -684,20 +651,23 @@ class DynMajorMediaList(AbstractMajor):
 class DynMajorCourses(AbstractMajor):
     async def run(self, repost):
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 695)
-        self.canvas = surface.getCanvas()
-        self.canvas.clear(skia.Color(*background_color))
         tv = skia.Image.open(path.join(self.src_path, "tv.png")).resize(130, 130)
         try:
-            cover = await get_pictures(f"{self.major.courses.cover}@505w_285h_1c.webp", (1010, 570))
-            await self.draw_shadow(self.canvas, (35, 25, 1010, 655), 20, background_color)
-            rec = skia.Rect.MakeXYWH(35, 25, 1010, 665)
+            card_height = await self.video_card_height(self.major.courses.title)
+            surface = skia.Surface(1080, card_height + 30)
+            self.canvas = surface.getCanvas()
+            self.canvas.clear(skia.Color(*background_color))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.courses.cover}@505w_285h_1c.webp", (1010, 570), asset="cover"
+            )
+            await self.draw_shadow(self.canvas, (35, 25, 1010, card_height - 10), 20, background_color)
+            rec = skia.Rect.MakeXYWH(35, 25, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await self.draw_text(
                 self.canvas,
                 self.major.courses.title,
                 self.style.font.font_size.text,
-                (60, 650, 980, 600, 10),
+                self.video_title_bounds,
                 self.style.color.font_color.text,
             )
             await paste(self.canvas, cover, (35, 25))
@@ -717,20 +687,23 @@ class DynMajorCourses(AbstractMajor):
 class DynMajorUgc(AbstractMajor):
     async def run(self, repost):
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 695)
-        self.canvas = surface.getCanvas()
-        self.canvas.clear(skia.Color(*background_color))
         tv = skia.Image.open(path.join(self.src_path, "tv.png")).resize(130, 130)
         try:
-            cover = await get_pictures(f"{self.major.ugc_season.cover}@505w_285h_1c.webp", (1010, 570))
-            await self.draw_shadow(self.canvas, (35, 25, 1010, 655), 20, background_color)
-            rec = skia.Rect.MakeXYWH(35, 25, 1010, 665)
+            card_height = await self.video_card_height(self.major.ugc_season.title)
+            surface = skia.Surface(1080, card_height + 30)
+            self.canvas = surface.getCanvas()
+            self.canvas.clear(skia.Color(*background_color))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.ugc_season.cover}@505w_285h_1c.webp", (1010, 570), asset="cover"
+            )
+            await self.draw_shadow(self.canvas, (35, 25, 1010, card_height - 10), 20, background_color)
+            rec = skia.Rect.MakeXYWH(35, 25, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await self.draw_text(
                 self.canvas,
                 self.major.ugc_season.title,
                 self.style.font.font_size.text,
-                (60, 650, 980, 600, 10),
+                self.video_title_bounds,
                 self.style.color.font_color.text,
             )
             await paste(self.canvas, cover, (35, 25))
@@ -750,19 +723,22 @@ class DynMajorUgc(AbstractMajor):
 class DynMajorLive(AbstractMajor):
     async def run(self, repost):
         background_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        surface = skia.Surface(1080, 695)
-        self.canvas = surface.getCanvas()
-        self.canvas.clear(skia.Color(*background_color))
         try:
-            cover = await get_pictures(f"{self.major.live.cover}@505w_285h_1c.webp", (1010, 570))
-            await self.draw_shadow(self.canvas, (35, 25, 1010, 655), 20, background_color)
-            rec = skia.Rect.MakeXYWH(35, 25, 1010, 665)
+            card_height = await self.video_card_height(self.major.live.title)
+            surface = skia.Surface(1080, card_height + 30)
+            self.canvas = surface.getCanvas()
+            self.canvas.clear(skia.Color(*background_color))
+            cover = await self.fetcher.get_pictures(
+                f"{self.major.live.cover}@505w_285h_1c.webp", (1010, 570), asset="cover"
+            )
+            await self.draw_shadow(self.canvas, (35, 25, 1010, card_height - 10), 20, background_color)
+            rec = skia.Rect.MakeXYWH(35, 25, 1010, card_height)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await self.draw_text(
                 self.canvas,
                 self.major.live.title,
                 self.style.font.font_size.text,
-                (60, 650, 980, 600, 10),
+                self.video_title_bounds,
                 self.style.color.font_color.text,
             )
             await paste(self.canvas, cover, (35, 25))
@@ -812,17 +788,19 @@ class DynMajorBlocked(AbstractMajor):
         self.canvas = surface.getCanvas()
         self.canvas.clear(skia.Color(*background_color))
         try:
-            result = await get_pictures(
+            result = await self.fetcher.get_pictures(
                 [
                     f"{self.major.blocked.bg_img.img_dark}@1c.webp",
                     self.major.blocked.icon.img_day,
-                ]
+                ],
+                asset="cover",
             )
             await self.draw_shadow(self.canvas, (40, 100, 1000, 1000), 20, background_color)
             rec = skia.Rect.MakeXYWH(40, 100, 1000, 1000)
             self.canvas.clipRRect(skia.RRect(rec, 20, 20), skia.ClipOp.kIntersect)
             await paste(self.canvas, result[1], (456, 380))
-            await paste(self.canvas, result[0].resize(1000, 1000), (40, 100))
+            if result[0] is not None:
+                await paste(self.canvas, result[0].resize(1000, 1000), (40, 100))
             text = self.major.blocked.hint_message.split("\n")
             await self.draw_text(
                 self.canvas,
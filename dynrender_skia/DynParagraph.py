@@ -0,0 +1,87 @@
+"""
+@File    :   DynParagraph.py
+@Time    :   2024/07/11 19:52:08
+@Author  :   BalconyJH
+@Version :   1.0
+@Desc    :   Optional text backend built on skia.textlayout paragraphs
+"""
+
+from typing import Optional
+
+import skia
+
+from .DynFont import font_fallback
+from .DynStyle import PolyStyle
+
+
+class ParagraphBackend:
+    """
+    Text layout through `skia.textlayout`, which shapes with HarfBuzz, resolves fallback fonts on its own and keeps a
+    paragraph cache in its font collection.
+
+    One font collection, and with it the paragraph cache, is shared by every render in the process. The binding
+    exposes neither placeholders nor a line limit with an ellipsis, so callers only hand it text it can lay out
+    without those.
+    """
+
+    def __init__(self) -> None:
+        self._font_collection = None
+        self._unicode = None
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(skia, "textlayout")
+
+    @property
+    def font_collection(self) -> "skia.textlayout.FontCollection":
+        if self._font_collection is None:
+            self._font_collection = skia.textlayout.FontCollection()
+            self._font_collection.setDefaultFontManager(font_fallback.font_mgr)
+        return self._font_collection
+
+    @property
+    def unicode(self) -> "skia.Unicode":
+        if self._unicode is None:
+            self._unicode = skia.Unicodes.ICU.Make()
+        return self._unicode
+
+    @staticmethod
+    def make_text_style(
+        style: PolyStyle, font_size: float, color: int, font_style: Optional[skia.FontStyle] = None
+    ) -> "skia.textlayout.TextStyle":
+        """
+        Text style of the configured font family, with the emoji font family as the first fallback.
+        """
+        text_style = skia.textlayout.TextStyle()
+        text_style.setFontFamilies([style.font.font_family, style.font.emoji_font_family])
+        text_style.setFontStyle(font_style or style.font.font_style)
+        text_style.setFontSize(font_size)
+        text_style.setColor(color)
+        return text_style
+
+    def build(
+        self, pieces: list[tuple[str, "skia.textlayout.TextStyle"]], width: float
+    ) -> "skia.textlayout.Paragraph":
+        """
+        Build and lay out a paragraph.
+
+        Args:
+            pieces (list[tuple[str, skia.textlayout.TextStyle]]): The text in order, each piece with its style.
+            width (float): The width lines are wrapped at.
+
+        Returns:
+            skia.textlayout.Paragraph: The laid out paragraph.
+        """
+        builder = skia.textlayout.ParagraphBuilder.make(
+            skia.textlayout.ParagraphStyle(), self.font_collection, self.unicode
+        )
+        for text, text_style in pieces:
+            builder.pushStyle(text_style)
+            builder.addText(text)
+            builder.pop()
+        paragraph = builder.Build()
+        paragraph.layout(width)
+        return paragraph
+
+
+paragraph_backend = ParagraphBackend()
@@ -0,0 +1,182 @@
+"""
+@File    :   DynPlanner.py
+@Time    :   2024/07/05 16:03:48
+@Author  :   BalconyJH
+@Version :   1.0
+@Desc    :   Collect every remote asset of a RenderMessage before any drawing
+"""
+
+import re
+from typing import NamedTuple, Optional
+
+from dynamicadaptor.Message import RenderMessage
+from loguru import logger
+
+from .DynCache import StickerAtlas
+from .DynStyle import PolyStyle
+
+
+class AssetRequest(NamedTuple):
+    url: str
+    size: Optional[tuple[int, int]]
+    asset: str
+
+
+def goods_cover_url(cover: str) -> str:
+    """
+    Strip the size suffix of a goods cover and request the 160x160 variant, shared by `DynAddGoods` and the planner.
+    """
+    url = re.sub(r"@(\d+)h_(\d+)w\S+", "", cover)
+    return f"{url}@160w_160h_1c.webp"
+
+
+def draw_urls(items) -> tuple[list[str], tuple[int, int]]:
+    """
+    Build the CDN urls and target size of the pictures of a draw major, shared by `DynMajorDraw` and the planner.
+
+    Args:
+        items: The picture items of the draw major or of the opus pics.
+
+    Returns:
+        tuple[list[str], tuple[int, int]]: The urls and the size they are resized to. A single picture is scaled to
+        the full content width of 1008 keeping the aspect ratio of the decoded image, so the fetch layer can decode
+        it directly at that size. The dimensions in the metadata only pick the crop of very long pictures.
+    """
+    if len(items) == 1:
+        src = items[0].src or items[0].url
+        width, height = items[0].width, items[0].height
+        if width and height and height / width > 4:
+            return [f"{src}@{600}w_{800}h_!header.webp"], (1008, 0)
+        return [src], (1008, 0)
+    if len(items) in {2, 4}:
+        side, size = 520, (520, 520)
+    else:
+        side, size = 260, (346, 346)
+    url_list = []
+    for item in items:
+        src = item.src or item.url
+        if item.height / item.width > 3:
+            url_list.append(f"{src}@{side}w_{side}h_!header.webp")
+        else:
+            url_list.append(f"{src}@{side}w_{side}h_1e_1c.webp")
+    return url_list, size
+
+
+class AssetPlanner:
+    """
+    Walk a whole `RenderMessage`, forwards included, and collect every remote asset with its target size.
+
+    The urls and sizes mirror the ones the section renderers request, so once `ImageFetcher.prefetch` has fetched
+    the plan in one concurrent batch the renderers are served from the fetcher caches instead of discovering and
+    awaiting their images one after another.
+
+    Args:
+        style (PolyStyle): The style the message is rendered with.
+        atlas (Optional[StickerAtlas]): The sticker atlas `BiliText` draws from. Stickers already in it are not
+            planned, they are drawn without being fetched.
+    """
+
+    def __init__(self, style: PolyStyle, atlas: Optional[StickerAtlas] = None) -> None:
+        self.style = style
+        self.atlas = atlas
+
+    def plan(self, message: RenderMessage) -> list[AssetRequest]:
+        requests: list[AssetRequest] = []
+        self.collect(requests, self.plan_header, message.header)
+        self.collect(requests, self.plan_text, message.text)
+        self.collect(requests, self.plan_major, message.major)
+        self.collect(requests, self.plan_additional, message.additional)
+        if message.forward is not None:
+            self.collect(requests, self.plan_header, message.forward.header)
+            self.collect(requests, self.plan_text, message.forward.text)
+            self.collect(requests, self.plan_major, message.forward.major)
+            self.collect(requests, self.plan_additional, message.forward.additional)
+        return list(dict.fromkeys(requests))
+
+    @staticmethod
+    def collect(requests: list[AssetRequest], planner, message) -> None:
+        """
+        Run one section planner. Planning is best effort, a section that can not be planned is fetched by its
+        renderer as before.
+        """
+        if message is None:
+            return
+        try:
+            requests.extend(planner(message))
+        except Exception as e:
+            logger.debug(f"Skip prefetch of {type(message).__name__}: {e!r}")
+
+    @staticmethod
+    def plan_header(header) -> list[AssetRequest]:
+        requests = []
+        if header.face:
+            requests.append(AssetRequest(f"{header.face}@240w_240h_1c_1s.webp", None, "face"))
+        if header.pendant and header.pendant.image:
+            requests.append(AssetRequest(f"{header.pendant.image}@360w_360h.webp", None, "pendant"))
+        return requests
+
+    def plan_text(self, text) -> list[AssetRequest]:
+        return self.plan_emoji(text.rich_text_nodes or []) if text.text else []
+
+    def plan_emoji(self, rich_text_nodes) -> list[AssetRequest]:
+        icon_size = int(self.style.font.font_size.text * 1.5)
+        return [
+            AssetRequest(i.emoji.icon_url, (icon_size, icon_size), "emoji")
+            for i in rich_text_nodes
+            if i.type == "RICH_TEXT_NODE_TYPE_EMOJI" and (self.atlas is None or i.emoji.icon_url not in self.atlas)
+        ]
+
+    def plan_major(self, major) -> list[AssetRequest]:
+        major_type = major.type
+        if major_type == "MAJOR_TYPE_DRAW":
+            return self.plan_draw(major.draw.items)
+        if major_type == "MAJOR_TYPE_OPUS":
+            requests = []
+            if major.opus.summary:
+                requests.extend(self.plan_emoji(major.opus.summary.rich_text_nodes or []))
+            if major.opus.pics:
+                requests.extend(self.plan_draw(major.opus.pics))
+            return requests
+        if major_type == "MAJOR_TYPE_ARTICLE":
+            covers = major.article.covers
+            if len(covers) > 1:
+                return [AssetRequest(f"{i}@360w_360h_1c", (330, 330), "cover") for i in covers]
+            return [AssetRequest(f"{covers[0]}@647w_150h_1c.webp", (1010, 300), "cover")]
+        if major_type == "MAJOR_TYPE_BLOCKED":
+            return [
+                AssetRequest(f"{major.blocked.bg_img.img_dark}@1c.webp", None, "cover"),
+                AssetRequest(major.blocked.icon.img_day, None, "cover"),
+            ]
+        if major_type in {"MAJOR_TYPE_COMMON", "MAJOR_TYPE_MUSIC"}:
+            cover = major.common.cover if major_type == "MAJOR_TYPE_COMMON" else major.music.cover
+            return [AssetRequest(f"{cover}@245w_245h_1c.webp", (245, 245), "cover")]
+        video_covers = {
+            "MAJOR_TYPE_ARCHIVE": lambda: major.archive.cover,
+            "MAJOR_TYPE_LIVE_RCMD": lambda: major.live_rcmd.content.live_play_info.cover,
+            "MAJOR_TYPE_PGC": lambda: major.pgc.cover,
+            "MAJOR_TYPE_MEDIALIST": lambda: major.medialist.cover,
+            "MAJOR_TYPE_COURSES": lambda: major.courses.cover,
+            "MAJOR_TYPE_UGC_SEASON": lambda: major.ugc_season.cover,
+            "MAJOR_TYPE_LIVE": lambda: major.live.cover,
+        }
+        if major_type in video_covers:
+            return [AssetRequest(f"{video_covers[major_type]()}@505w_285h_1c.webp", (1010, 570), "cover")]
+        return []
+
+    @staticmethod
+    def plan_draw(items) -> list[AssetRequest]:
+        url_list, size = draw_urls(items)
+        return [AssetRequest(url, size, "draw") for url in url_list]
+
+    @staticmethod
+    def plan_additional(additional) -> list[AssetRequest]:
+        additional_type = additional.type
+        if additional_type == "ADDITIONAL_TYPE_GOODS":
+            return [AssetRequest(goods_cover_url(i.cover), (190, 190), "goods") for i in additional.goods.items]
+        if additional_type == "ADDITIONAL_TYPE_UGC":
+            return [AssetRequest(f"{additional.ugc.cover}@340w_195h_1c.webp", None, "cover")]
+        if additional_type == "ADDITIONAL_TYPE_COMMON":
+            if additional.common.sub_type in {"decoration", "game"}:
+                return [AssetRequest(f"{additional.common.cover}@190w_190h_1c.webp", (190, 190), "cover")]
+            return [AssetRequest(f"{additional.common.cover}@145w_195h_1c.webp", (145, 195), "cover")]
+        return []
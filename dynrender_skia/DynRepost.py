@@ -7,10 +7,12 @@
 """
 
 import asyncio
+from typing import Optional
 
 from dynamicadaptor.Repost import Forward
 
 from .DynAdditional import BiliAdditional
+from .DynFetcher import ImageFetcher
 from .DynHeader import RepostHeader
 from .DynMajor import BiliMajor
 from .DynStyle import PolyStyle
@@ -19,17 +21,18 @@ from .DynTools import merge_pictures
 
 
 class BiliRepost:
-    def __init__(self, static_path: str, style: PolyStyle) -> None:
+    def __init__(self, static_path: str, style: PolyStyle, fetcher: Optional[ImageFetcher] = None) -> None:
         self.static_path = static_path
         self.style = style
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
 
     async def run(self, message: Forward):
-        tasks = [RepostHeader(self.static_path, self.style).run(message.header)]
+        tasks = [RepostHeader(self.static_path, self.style, self.fetcher).run(message.header)]
         if message.text is not None:
-            tasks.append(BiliText(self.static_path, self.style).run(message.text, repost=True))
+            tasks.append(BiliText(self.static_path, self.style, self.fetcher).run(message.text, repost=True))
         if message.major is not None:
-            tasks.append(BiliMajor(self.static_path, self.style).run(message.major, True))
+            tasks.append(BiliMajor(self.static_path, self.style, self.fetcher).run(message.major, True))
         if message.additional is not None:
-            tasks.append(BiliAdditional(self.static_path, self.style).run(message.additional, True))
+            tasks.append(BiliAdditional(self.static_path, self.style, self.fetcher).run(message.additional, True))
         result = await asyncio.gather(*tasks)
         return await merge_pictures(result) # type: ignore
@@ -40,6 +40,7 @@ class FontCfg(BaseModel):
     emoji_font_family: str
     font_style: Any
     font_size: FontSize
+    text_backend: str = "engine"
 
 
 class ColorCfg(BaseModel):
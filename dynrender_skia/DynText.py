@@ -3,45 +3,73 @@
 # @File    : DynText.py
 
 import asyncio
+import math
+from functools import partial
 from os import path
-from typing import Optional
+from typing import NamedTuple, Optional, Union
 
-import emoji
 import numpy as np
 import skia
 from dynamicadaptor.Content import Text
 from loguru import logger
 
+from .DynCache import StickerAtlas, get_sticker_atlas
+from .DynEmoji import emoji_glyph_cache, get_emoji_text
+from .DynFetcher import ImageFetcher
+from .DynFont import font_registry
+from .DynLayout import TextEngine, TextRun, fit_clusters, match_font
+from .DynParagraph import paragraph_backend
 from .DynStyle import PolyStyle
-from .DynTools import paste, merge_pictures, get_pictures, DrawText
+from .DynTools import paste, merge_pictures, DrawText
+
+PLAIN_NODES = {"RICH_TEXT_NODE_TYPE_AT", "RICH_TEXT_NODE_TYPE_TEXT", "RICH_TEXT_NODE_TYPE_TOPIC"}
+
+
+class BlobItem(NamedTuple):
+    blob: skia.TextBlob
+    x: float
+    y: float
+    paint: skia.Paint
+
+
+class ImageItem(NamedTuple):
+    image: skia.Image
+    x: float
+    y: float
+    src: Optional[skia.Rect] = None
 
 
 class BiliText:
     """渲染动态的文字部分"""
 
-    def __init__(self, static_path: str, style: PolyStyle) -> None:
-        self.emoji_path = path.join(static_path, "Cache", "Emoji")
+    def __init__(self, static_path: str, style: PolyStyle, fetcher: Optional[ImageFetcher] = None) -> None:
+        self.fetcher = fetcher or ImageFetcher(pooled=False)
+        self.static_path = static_path
         self.src_path = path.join(static_path, "Src")
         self.style = style
-        surface = skia.Surface(1080, 60)
-        self.canvas = surface.getCanvas()
+        self.drawer = DrawText(style)
         self.bg_color = None
+        self.line_height = 60
+        self.lines: list[list[Union[BlobItem, ImageItem]]] = [[]]
         self.offset = 40
         self.x_bound = 1030
         self.image_list = []
         self.emoji_dict = {}
+        self.atlas: Optional[StickerAtlas] = None
 
     async def run(self, dyn_text: Text, repost: bool = False) -> Optional[np.ndarray]:
-        self.text_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.text_font = font_registry.make_font(
+            self.style.font.font_family, self.style.font.font_style, self.style.font.font_size.text
         )
-        self.emoji_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.emoji_font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.emoji_font = font_registry.make_font(
+            self.style.font.emoji_font_family, self.style.font.font_style, self.style.font.font_size.text
+        )
+        self.engine = TextEngine(
+            self.text_font,
+            self.emoji_font,
+            partial(match_font, self.style.font.font_family, self.style.font.font_style),
         )
         self.bg_color = self.style.color.background.repost if repost else self.style.color.background.normal
-        self.canvas.clear(skia.Color(*self.bg_color))
         try:
             tasks = []
             if dyn_text.topic is not None:
@@ -55,6 +83,11 @@ class BiliText:
             return None
 
     async def make_text_image(self, dyn_text):
+        if self.style.font.text_backend == "paragraph" and paragraph_backend.available():
+            if all(i.type in PLAIN_NODES for i in dyn_text.rich_text_nodes):
+                if (text_img := self.draw_paragraph(dyn_text)) is not None:
+                    self.image_list.append(text_img)
+                return
         emoji_list = []
         emoji_name_list = []
         rich_list = []
@@ -66,40 +99,23 @@ class BiliText:
             elif i.type != "RICH_TEXT_NODE_TYPE_TEXT":
                 rich_list.append(i)
         result = await asyncio.gather(self.get_emoji(emoji_list, emoji_name_list), self.get_rich_pic(rich_list))
-        await self.draw_text(result[1], dyn_text) # type: ignore
-        if self.offset != 40:
-            self.image_list.append(self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType))
+        await self.layout_text(result[1], dyn_text) # type: ignore
+        if (text_img := await self.render_lines()) is not None:
+            self.image_list.append(text_img)
 
     async def get_emoji(self, emoji_url: list, emoji_name: list):
-        emoji_pic = []
-        emoji_index = []
-        emoji_url_list = []
-        temp = {}
         icon_size = int(self.style.font.font_size.text * 1.5)
-        for i, emoji_text in enumerate(emoji_name):
-            emoji_path = path.join(self.emoji_path, f"{emoji_text}.png")
-            if path.exists(emoji_path):
-                emoji_pic.append(skia.Image.open(emoji_path))
-            else:
-                emoji_url_list.append(emoji_url[i])
-                emoji_index.append(i)
-        if emoji_url_list:
-            result = await get_pictures(emoji_url_list, (icon_size, icon_size))
-            for i, j in enumerate(emoji_index):
-                emoji_path = path.join(self.emoji_path, f"{emoji_name[j]}.png")
-                emoji_pic.insert(j, result[i])
-                if result[i] is not None:
-                    result[i].save(emoji_path)
-        for i, j in enumerate(emoji_name):
-            temp[j] = emoji_pic[i]
-        self.emoji_dict = temp
+        self.atlas = await get_sticker_atlas(self.static_path, icon_size, self.fetcher.executor)
+        if missing := [url for url in emoji_url if url not in self.atlas]:
+            result = await self.fetcher.get_pictures(missing, (icon_size, icon_size), asset="emoji")
+            for url, img in zip(missing, result):
+                if img is not None:
+                    self.atlas.add(url, img)
+            self.atlas.schedule_persist(self.fetcher.executor)
+        self.emoji_dict = {name: url if url in self.atlas else None for name, url in zip(emoji_name, emoji_url)}
 
     async def get_emoji_text(self, text: str):
-        result = emoji.emoji_list(text)
-        temp = {}
-        for i in result:
-            temp[i["match_start"]] = [i["match_end"], i["emoji"]]
-        return temp
+        return get_emoji_text(text)
 
     async def get_rich_pic(self, rich_list):
         rich_dic = {}
@@ -150,7 +166,7 @@ class BiliText:
         canvas = surface.getCanvas()
         canvas.clear(skia.Color(*self.bg_color))
         await paste(canvas, topic_img, (45, 15))
-        await DrawText(self.style).draw_text(
+        await self.drawer.draw_text(
             canvas,
             topic,
             topic_size,
@@ -159,91 +175,108 @@ class BiliText:
         )
         self.image_list.append(canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType))
 
-    async def draw_text(self, rich_list: list, dyn_text: Text):
-        self.canvas.clear(skia.Color(*self.bg_color))
+    def node_color(self, node) -> int:
+        if node.type in {"RICH_TEXT_NODE_TYPE_AT", "RICH_TEXT_NODE_TYPE_TOPIC"}:
+            return skia.Color(*self.style.color.font_color.rich_text)
+        return skia.Color(*self.style.color.font_color.text)
+
+    def draw_paragraph(self, dyn_text: Text) -> Optional[np.ndarray]:
+        """
+        Draw a text made of plain, at and topic nodes only as one paragraph of the paragraph backend.
+        """
+        pieces = [
+            (
+                i.text.translate(str.maketrans({"\r": ""})),
+                paragraph_backend.make_text_style(self.style, self.style.font.font_size.text, self.node_color(i)),
+            )
+            for i in dyn_text.rich_text_nodes  # type: ignore
+        ]
+        if not any(text for text, _ in pieces):
+            return None
+        paragraph = paragraph_backend.build(pieces, self.x_bound - 40)
+        surface = skia.Surface(1080, math.ceil(paragraph.Height) + 20)
+        canvas = surface.getCanvas()
+        canvas.clear(skia.Color(*self.bg_color))
+        paragraph.paint(canvas, 40, 10)
+        return canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
+
+    async def layout_text(self, rich_list: list, dyn_text: Text):
         for i in dyn_text.rich_text_nodes: # type: ignore
-            if i.type in {
-                "RICH_TEXT_NODE_TYPE_AT",
-                "RICH_TEXT_NODE_TYPE_TEXT",
-                "RICH_TEXT_NODE_TYPE_TOPIC",
-            }:
-                if i.type in {"RICH_TEXT_NODE_TYPE_AT", "RICH_TEXT_NODE_TYPE_TOPIC"}:
-                    color = skia.Color(*self.style.color.font_color.rich_text)
-                else:
-                    color = skia.Color(*self.style.color.font_color.text)
-                await self.draw_plain_text(i.text, color)
+            if i.type in PLAIN_NODES:
+                await self.layout_plain_text(i.text, self.node_color(i))
             elif i.type == "RICH_TEXT_NODE_TYPE_EMOJI":
-                await self.draw_emoji(i.text)
+                self.layout_emoji(i.text)
             else:
-                await self.draw_rich_text(i, rich_list)
+                self.layout_rich_text(i, rich_list)
 
-    async def draw_plain_text(self, dyn_detail, color):
-        font = None
-        e=False
+    async def layout_plain_text(self, dyn_detail, color):
         dyn_detail = dyn_detail.translate(str.maketrans({"\r": ""}))
         paint = skia.Paint(AntiAlias=True, Color=color)
-        emoji_info = await self.get_emoji_text(dyn_detail)
-        total = len(dyn_detail) - 1
-        offset = 0
-        while offset <= total:
-            j = dyn_detail[offset]
-            if j == "\n":
-                self.canvas.saveLayer()
-                self.canvas.clear(skia.Color(*self.bg_color))
-                self.image_list.append(self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType))
-                self.canvas.restore()
-                offset += 1
-                self.offset = 40
+        for index, line in enumerate(dyn_detail.split("\n")):
+            if index:
+                self.next_line()
+            runs = self.engine.make_runs(line, await self.get_emoji_text(line))
+            self.layout_runs(runs, paint, lambda offset: offset > self.x_bound)
+
+    def next_line(self):
+        self.lines.append([])
+        self.offset = 40
+
+    def layout_runs(self, runs: list[TextRun], paint: skia.Paint, overflow) -> None:
+        """
+        Place text runs from the current offset, one text blob per line, moving to the next line whenever
+        `overflow(offset)` is true after a cluster. `overflow` is also applied to arrays of offsets, see `fit_clusters`.
+
+        Unicode emoji keep being shaped on their own, so ZWJ sequences still render as a single glyph, and are placed as
+        images from `emoji_glyph_cache`.
+        """
+        builder = skia.TextBlobBuilder()
+        for run in runs:
+            if run.emoji:
+                start = 0
+                for end in run.clusters:
+                    glyph = emoji_glyph_cache.get(run.text[start:end], run.font, paint.getColor())
+                    if glyph is not None:
+                        image, left, top = glyph
+                        self.lines[-1].append(ImageItem(image, self.offset + left, 5 + top))
+                    self.offset += run.widths[start]
+                    start = end
+                    if overflow(self.offset):
+                        builder = self.flush_line(builder, paint)
                 continue
-            if offset in emoji_info.keys():
-                j = emoji_info[offset][1]
-                offset = emoji_info[offset][0]
-                font = self.emoji_font
-                e=True
-            else:
-                offset += 1
-                font = self.text_font
-                e=False
-            if font.textToGlyphs(j)[0] == 0:
-                if typeface := skia.FontMgr().matchFamilyStyleCharacter(
-                    self.style.font.font_family,
-                    self.style.font.font_style,
-                    ["zh", "en"],
-                    ord(j[0]),
-                ):
-                    font = skia.Font(typeface, self.style.font.font_size.text)
-                else:
-                    font = self.text_font
-            if not e:
-                measure = font.measureText(j)
-                blob = skia.TextBlob(j, font)
-                self.canvas.drawTextBlob(blob, self.offset, 50, paint)
-            else:
-                measure = font.measureText(j[0])
-                blob = skia.TextBlob.MakeFromShapedText(j, font)
-                self.canvas.drawTextBlob(blob, self.offset, 5, paint)
-            self.offset += measure
-            if self.offset > self.x_bound:
-                self.offset = 40
-                self.canvas.saveLayer()
-                self.canvas.clear(skia.Color(*self.bg_color))
-                self.image_list.append(self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType))
-                self.canvas.restore()
+            widths = np.asarray(run.widths, dtype=np.float64)
+            cluster_end = np.zeros(len(widths), dtype=bool)
+            cluster_end[np.asarray(run.clusters, dtype=np.intp) - 1] = True
+            start = 0
+            while start < len(widths):
+                advance, count, overflowed = fit_clusters(widths[start:], cluster_end[start:], self.offset, overflow)
+                builder.allocRunPosH(run.font, run.glyphs[start : start + count], advance[:-1].tolist(), 50)
+                self.offset = float(advance[-1])
+                start += count
+                if overflowed:
+                    builder = self.flush_line(builder, paint)
+        if (blob := builder.make()) is not None:
+            self.lines[-1].append(BlobItem(blob, 0, 0, paint))
 
-    async def draw_emoji(self, emoji_detail):
-        img = self.emoji_dict[emoji_detail]
-        if img is not None:
-            img_size = img.dimensions().width()
-            await paste(self.canvas, img, (int(self.offset), 0))
-            self.offset += img_size + 5
+    def flush_line(self, builder: skia.TextBlobBuilder, paint: skia.Paint) -> skia.TextBlobBuilder:
+        """
+        Close the current line with the glyphs collected in `builder` and start the next one.
+        """
+        if (blob := builder.make()) is not None:
+            self.lines[-1].append(BlobItem(blob, 0, 0, paint))
+        self.next_line()
+        return skia.TextBlobBuilder()
+
+    def layout_emoji(self, emoji_detail):
+        url = self.emoji_dict[emoji_detail]
+        # A sticker evicted from a full atlas by a concurrent render since get_emoji is left out
+        if url is not None and (rect := self.atlas.rect(url)) is not None:
+            self.lines[-1].append(ImageItem(self.atlas.image, int(self.offset), 0, rect))
+            self.offset += self.atlas.cell + 5
             if self.offset >= self.x_bound:
-                self.canvas.saveLayer()
-                self.canvas.clear(skia.Color(*self.bg_color))
-                self.image_list.append(self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType))
-                self.canvas.restore()
-                self.offset = 40
+                self.next_line()
 
-    async def draw_rich_text(self, text_detail, rich_list):
+    def layout_rich_text(self, text_detail, rich_list):
         if text_detail.type == "RICH_TEXT_NODE_TYPE_VOTE":
             icon = rich_list["vote"]
         elif text_detail.type == "RICH_TEXT_NODE_TYPE_LOTTERY":
@@ -254,37 +287,39 @@ class BiliText:
             icon = rich_list["cv"]
         else:
             icon = rich_list["link"]
-        await paste(
-            self.canvas,
-            icon,
-            (int(self.offset), int(60 - icon.dimensions().height()) / 2),
-        )
+        self.lines[-1].append(ImageItem(icon, int(self.offset), int(60 - icon.dimensions().height()) / 2))
         self.offset += icon.dimensions().width() + 5
         if self.offset >= self.x_bound:
-            self.canvas.saveLayer()
-            self.canvas.clear(skia.Color(*self.bg_color))
-            self.image_list.append(self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType))
-            self.canvas.restore()
-            self.offset = 40
+            self.next_line()
         paint = skia.Paint(AntiAlias=True, Color=skia.Color(*self.style.color.font_color.rich_text))
-        font = self.text_font
-        for i in text_detail.text:
-            if font.textToGlyphs(i)[0] == 0:
-                if typeface := skia.FontMgr().matchFamilyStyleCharacter(
-                    self.style.font.font_family,
-                    self.style.font.font_style,
-                    ["zh", "en"],
-                    ord(i),
-                ):
-                    font = skia.Font(typeface, self.style.font.font_size.text)
+        self.layout_runs(self.engine.make_runs(text_detail.text, {}), paint, lambda offset: offset >= self.x_bound)
+
+    async def render_lines(self) -> Optional[np.ndarray]:
+        """
+        Draw the laid out lines into one surface of exactly their height, each clipped to its own band.
+
+        A last line that was started but never written to is dropped, empty lines in between are kept.
+
+        Returns:
+            Optional[np.ndarray]: The RGBA pixels, or None if there is nothing to draw.
+        """
+        lines = self.lines if self.offset != 40 else self.lines[:-1]
+        if not lines:
+            return None
+        surface = skia.Surface(1080, len(lines) * self.line_height)
+        canvas = surface.getCanvas()
+        canvas.clear(skia.Color(*self.bg_color))
+        for index, line in enumerate(lines):
+            top = index * self.line_height
+            canvas.save()
+            canvas.clipRect(skia.Rect.MakeXYWH(0, top, 1080, self.line_height))
+            for item in line:
+                if isinstance(item, BlobItem):
+                    canvas.drawTextBlob(item.blob, item.x, top + item.y, item.paint)
+                elif item.src is not None:
+                    dst = skia.Rect.MakeXYWH(item.x, top + item.y, item.src.width(), item.src.height())
+                    canvas.drawImageRect(item.image, item.src, dst)
                 else:
-                    font = self.text_font
-            blob = skia.TextBlob(i, font)
-            self.canvas.drawTextBlob(blob, self.offset, 50, paint)
-            self.offset += font.measureText(i)
-            if self.offset >= self.x_bound:
-                self.canvas.saveLayer()
-                self.canvas.clear(skia.Color(*self.bg_color))
-                self.image_list.append(self.canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType))
-                self.canvas.restore()
-                self.offset = 40
+                    await paste(canvas, item.image, (item.x, top + item.y))
+            canvas.restore()
+        return canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
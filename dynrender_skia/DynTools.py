@@ -2,21 +2,47 @@
 # @Author  : Polyisoprene
 # @File    : DynTools.py
 import asyncio
-from typing import Optional, Union, cast
+from concurrent.futures import Executor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar, Union
 
-import emoji
 import httpx
 import numpy as np
 import skia
 from loguru import logger
 from numpy import ndarray
 
+from .DynEmoji import get_emoji_text
+from .DynFont import font_registry
+from .DynLayout import TextEngine, TextMetrics, match_font
+from .DynParagraph import paragraph_backend
 from .DynStyle import PolyStyle
-from .exception import ParseError
+from .exception import ImageTooLargeError
+
+T = TypeVar("T")
+
+
+async def run_in_executor(func: Callable[..., T], *args: Any, executor: Optional[Executor] = None) -> T:
+    """
+    Run blocking pixel work such as decoding, resizing or mask compositing off the event loop.
+
+    Args:
+        func (Callable[..., T]): The synchronous function to run.
+        *args (Any): Positional arguments passed to `func`.
+        executor (Optional[Executor]): The executor to run `func` in. If None, the default executor of the running
+        loop is used.
+
+    Returns:
+        T: The return value of `func`.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args))
 
 
 async def get_pictures(
-    url: Union[str, list[str]], size: Optional[tuple[int, int]] = None, retries: int = 5
+    url: Union[str, list[str]],
+    size: Optional[tuple[int, int]] = None,
+    retries: int = 5,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> Union[skia.Image, tuple[skia.Image, ...]]:
     """
     Asynchronously fetch images from a single URL or a list of URLs, optionally resizing them.
@@ -29,6 +55,8 @@ async def get_pictures(
         size (Optional[tuple[int, int]]): A tuple specifying the width and height to which the images should be
         resized. If None, images are returned in their original size.
         retries (int): The number of times to retry the request in case of connection issues. Default is 5 retries.
+        client (Optional[httpx.AsyncClient]): An existing client to reuse, e.g. the pooled client of an
+        `ImageFetcher`. If None, a temporary client is created and closed after the request.
 
     Returns:
         Union[skia.Image, tuple[skia.Image, ...]]: A single skia.Image if a single URL is provided, or a tuple of
@@ -39,6 +67,10 @@ async def get_pictures(
         httpx.HTTPStatusError: If any HTTP request returns an unsuccessful status code.
         Exception: If an unexpected error occurs during the fetching or decoding of images.
     """
+    if client is not None:
+        if isinstance(url, list):
+            return await asyncio.gather(*[request_img(client, i, size) for i in url])
+        return await request_img(client, url, size)
     transport = httpx.AsyncHTTPTransport(retries=retries)
     async with httpx.AsyncClient(transport=transport) as client:
         if isinstance(url, list):
@@ -81,6 +113,259 @@ async def request_img(client: httpx.AsyncClient, url: str, size: Optional[tuple[
         return None
 
 
+def sniff_image_header(head: Union[bytes, bytearray]) -> Optional[tuple[str, int, int]]:
+    """
+    Read the format and dimensions of an image from the first bytes of its encoded data.
+
+    PNG, GIF, WEBP (lossy, lossless and extended) and JPEG are recognized. JPEG dimensions live in the first SOF
+    segment, which may come after large EXIF segments, so more data may be needed than for the other formats.
+
+    Args:
+        head (Union[bytes, bytearray]): The first bytes of the encoded image.
+
+    Returns:
+        Optional[tuple[str, int, int]]: The format, width and height, or None if the format is unknown or more data
+        is needed.
+    """
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and len(head) >= 24:
+        return "png", int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if bytes(head[:6]) in {b"GIF87a", b"GIF89a"} and len(head) >= 10:
+        return "gif", int.from_bytes(head[6:8], "little"), int.from_bytes(head[8:10], "little")
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8 ":
+            return (
+                "webp",
+                int.from_bytes(head[26:28], "little") & 0x3FFF,
+                int.from_bytes(head[28:30], "little") & 0x3FFF,
+            )
+        if chunk == b"VP8L":
+            bits = int.from_bytes(head[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return "webp", int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+        return None
+    if head[:2] == b"\xff\xd8":
+        offset = 2
+        while offset + 9 <= len(head):
+            if head[offset] != 0xFF:
+                return None
+            marker = head[offset + 1]
+            if marker == 0xFF:
+                offset += 1
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in {0xC4, 0xC8, 0xCC}:
+                return (
+                    "jpeg",
+                    int.from_bytes(head[offset + 7 : offset + 9], "big"),
+                    int.from_bytes(head[offset + 5 : offset + 7], "big"),
+                )
+            offset += 2 + int.from_bytes(head[offset + 2 : offset + 4], "big")
+    return None
+
+
+async def download_img(
+    client: httpx.AsyncClient,
+    url: str,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    sniff_bytes: int = 65536,
+    validators: Optional[dict[str, str]] = None,
+) -> tuple[Optional[bytes], dict[str, str]]:
+    """
+    Stream the encoded bytes of an image, aborting as soon as it is known to be too large.
+
+    The declared Content-Length is checked before the body is read, the received size is checked after every chunk,
+    and the dimensions sniffed from the image header are checked against `max_pixels` while the first `sniff_bytes`
+    arrive, so an oversized upload is never buffered or decoded in full.
+
+    Args:
+        client (httpx.AsyncClient): The HTTP client to use for the request.
+        url (str): The URL from which to fetch the image.
+        max_bytes (Optional[int]): Maximum size of the encoded image. If None, the size is not limited.
+        max_pixels (Optional[int]): Maximum width * height of the image. If None, the dimensions are not checked.
+        sniff_bytes (int): How many leading bytes are searched for the image header.
+        validators (Optional[dict[str, str]]): The `etag` and `last_modified` of a cached copy. If given, the request
+            is conditional and a 304 Not Modified response yields no body.
+
+    Returns:
+        tuple[Optional[bytes], dict[str, str]]: The body of the response, or None if the cached copy is still valid,
+        and the `etag` and `last_modified` validators of the response.
+
+    Raises:
+        httpx.HTTPStatusError: If the HTTP request returns an unsuccessful status code.
+        httpx.TransportError: If the request fails on the network level.
+        ImageTooLargeError: If the image exceeds `max_bytes` or `max_pixels`.
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code != 304:
+            response.raise_for_status()
+        response_validators = {
+            key: value
+            for key, value in (
+                ("etag", response.headers.get("ETag")),
+                ("last_modified", response.headers.get("Last-Modified")),
+            )
+            if value
+        }
+        if response.status_code == 304:
+            return None, response_validators or validators or {}
+        length = response.headers.get("Content-Length", "")
+        if max_bytes is not None and length.isdigit() and int(length) > max_bytes:
+            raise ImageTooLargeError(f"Content-Length {length} exceeds {max_bytes} bytes", response.status_code)
+        content = bytearray()
+        sniffing = max_pixels is not None
+        async for chunk in response.aiter_bytes():
+            content += chunk
+            if max_bytes is not None and len(content) > max_bytes:
+                raise ImageTooLargeError(f"Body exceeds {max_bytes} bytes", response.status_code)
+            if sniffing:
+                if (header := sniff_image_header(content)) is not None:
+                    sniffing = False
+                    if header[1] * header[2] > max_pixels:  # type: ignore
+                        raise ImageTooLargeError(
+                            f"{header[0]} of {header[1]}x{header[2]} exceeds {max_pixels} pixels", response.status_code
+                        )
+                elif len(content) >= sniff_bytes:
+                    sniffing = False
+    return bytes(content), response_validators
+
+
+def fit_size(size: tuple[int, int], width: int, height: int) -> tuple[int, int]:
+    """
+    Resolve a requested size against the decoded dimensions of an image. A requested height of 0 scales the image to
+    the requested width, keeping its aspect ratio.
+    """
+    return size if size[1] else (size[0], max(1, int(height * size[0] / width)))
+
+
+def decode_img(content: bytes, size: Optional[tuple[int, int]] = None) -> Optional[skia.Image]:
+    """
+    Decode encoded image bytes into a raster skia.Image, which does not refer to `content`, and optionally resize it.
+
+    When the requested size is at most half of the source in both directions, the image is decoded with the scaled
+    dimensions of `skia.Codec` (JPEG subsampling, WEBP scaled decoding) and only the remaining difference is resized,
+    instead of decoding the full resolution first.
+
+    Args:
+        content (bytes): The encoded image.
+        size (Optional[tuple[int, int]]): A tuple specifying the width and height to which the image should be
+        resized, a height of 0 keeping the aspect ratio. If None, the image is returned in its original size.
+
+    Returns:
+        Optional[skia.Image]: The decoded image, or None if the content could not be decoded.
+    """
+    if size is not None and (img := decode_scaled_img(content, size)) is not None:
+        return img
+    # MakeFromEncoded wraps the buffer without copying it and decodes lazily, so the pixels are decoded here while
+    # `content` is alive, which also keeps the decode in the executor this runs in
+    img: Optional[skia.Image] = skia.Image.MakeFromEncoded(content)  # type: ignore
+    if img is None:
+        return None
+    return img.resize(*fit_size(size, img.width(), img.height())) if size is not None else img.makeRasterImage()
+
+
+def decode_scaled_img(content: bytes, size: tuple[int, int], max_scale: float = 0.5) -> Optional[skia.Image]:
+    """
+    Decode an image at the smallest codec supported dimensions that still cover `size`, then resize it to `size`.
+
+    Args:
+        content (bytes): The encoded image.
+        size (tuple[int, int]): The target width and height, a height of 0 keeping the aspect ratio.
+        max_scale (float): Scaled decoding is only used when the target is at most this fraction of the source.
+
+    Returns:
+        Optional[skia.Image]: The resized image, or None if scaled decoding is not worth it or not possible, in which
+        case the caller should fall back to a full decode.
+    """
+    try:
+        codec = skia.Codec.MakeFromData(skia.Data.MakeWithoutCopy(content))
+        if codec is None:
+            return None
+        dimensions = codec.dimensions()
+        size = fit_size(size, dimensions.width(), dimensions.height())
+        scale = max(size[0] / dimensions.width(), size[1] / dimensions.height())
+        if scale > max_scale:
+            return None
+        scaled = codec.getScaledDimensions(scale)
+        if scaled.width() < size[0] or scaled.height() < size[1]:
+            scaled = dimensions
+        info = skia.ImageInfo.Make(
+            scaled.width(), scaled.height(), skia.ColorType.kRGBA_8888_ColorType, skia.AlphaType.kPremul_AlphaType
+        )
+        pixels = np.empty((scaled.height(), scaled.width(), 4), np.uint8)
+        if codec.getPixels(info, pixels) not in {skia.Codec.Result.kSuccess, skia.Codec.Result.kIncompleteInput}:
+            return None
+        img = skia.Image.fromarray(
+            pixels, colorType=skia.ColorType.kRGBA_8888_ColorType, alphaType=skia.AlphaType.kPremul_AlphaType
+        )
+        return img.resize(*size)
+    except Exception as e:
+        logger.debug(f"Scaled decode failed, fall back to full decode: {e!r}")
+        return None
+
+
+def circle_image(img: skia.Image, size: int) -> skia.Image:
+    """
+    Cut an image into a circle with a pink border and resize it to `size` x `size`.
+    """
+    surface = skia.Surface(img.dimensions().width(), img.dimensions().height())
+    mask = surface.getCanvas()
+    paint = skia.Paint(
+        Style=skia.Paint.kFill_Style,
+        Color=skia.Color(255, 255, 255, 255),
+        AntiAlias=True,
+    )
+    radius = int(img.dimensions().width() / 2)
+    mask.drawCircle(radius, radius, radius, paint)
+
+    paint = skia.Paint(
+        Style=skia.Paint.kStroke_Style,
+        StrokeWidth=5,
+        Color=skia.Color(251, 114, 153, 255),
+        AntiAlias=True,
+    )
+
+    image_array = np.bitwise_and(
+        img.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
+        mask.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
+    )
+    canvas = skia.Canvas(image_array, colorType=skia.ColorType.kRGBA_8888_ColorType)
+    canvas.drawCircle(radius, radius, radius - 2, paint)
+    return skia.Image.fromarray(
+        array=canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
+        colorType=skia.ColorType.kRGBA_8888_ColorType,
+    ).resize(
+        size, size
+    )  # type: ignore
+
+
+def round_corner_image(img: skia.Image, corner: int) -> skia.Image:
+    """
+    Mask the corners of an image with the given radius.
+    """
+    surface = skia.Surface(img.width(), img.height())
+    mask = surface.getCanvas()
+    paint = skia.Paint(
+        Style=skia.Paint.kFill_Style,
+        Color=skia.Color(255, 255, 255, 255),
+        AntiAlias=True,
+    )
+    rect = skia.Rect.MakeXYWH(0, 0, img.width(), img.height())
+    mask.drawRoundRect(rect, corner, corner, paint)
+    image_array = np.bitwise_and(
+        img.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
+        mask.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType),
+    )
+    return skia.Image.fromarray(image_array, colorType=skia.ColorType.kRGBA_8888_ColorType)
+
+
 async def merge_pictures(img_list: list[ndarray]) -> ndarray:
     """
     Merge multiple images into a single image by stacking them vertically.
@@ -115,25 +400,30 @@ async def merge_pictures(img_list: list[ndarray]) -> ndarray:
     return img_top
 
 
-async def paste(canvas: skia.Canvas, target: skia.Image, position: tuple, clear_background: bool = False) -> None:
+async def paste(
+    canvas: skia.Canvas, target: Optional[skia.Image], position: tuple, clear_background: bool = False
+) -> None:
     """
     Paste the target image onto the canvas at the specified position, with an option to clear the background.
 
     Args:
         canvas (skia.Canvas): The canvas on which the image will be drawn.
-        target (skia.Image): The image to be pasted onto the canvas.
+        target (Optional[skia.Image]): The image to be pasted onto the canvas. A missing image (failed or cut off by
+        the render deadline) is skipped, leaving its area as a placeholder.
         position (tuple): A tuple (x, y) is the position on the canvas where the top-left corner of the image will be
         placed.
         clear_background (bool): If set to True, the background aera where the image will be placed is cleared to
         transparent before pasting the image. Defaults to False.
 
     Raises:
-        ValueError: If the `target` image is None.
         AttributeError: If there is an issue accessing attributes or methods on `canvas` or `target`.
 
     Returns:
         None: The function does not return a value, but modifies the canvas in place.
     """
+    if target is None:
+        logger.warning("Image is None, render placeholder")
+        return
     x, y = position
     img_height = target.dimensions().fHeight
     img_width = target.dimensions().fWidth
@@ -157,13 +447,11 @@ async def paste(canvas: skia.Canvas, target: skia.Image, position: tuple, clear_
 class DrawText:
     def __init__(self, style: PolyStyle):
         self.style = style
-        self.text_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.text_font = font_registry.make_font(
+            self.style.font.font_family, self.style.font.font_style, self.style.font.font_size.text
         )
-        self.emoji_font = skia.Font(
-            skia.Typeface.MakeFromName(self.style.font.emoji_font_family, self.style.font.font_style),
-            self.style.font.font_size.text,
+        self.emoji_font = font_registry.make_font(
+            self.style.font.emoji_font_family, self.style.font.font_style, self.style.font.font_size.text
         )
 
     @staticmethod
@@ -197,14 +485,7 @@ class DrawText:
             Optional[skia.Font]: A Skia `Font` object if a matching typeface is
             found, otherwise `None`.
         """
-        if typeface := skia.FontMgr().matchFamilyStyleCharacter(
-            self.style.font.font_family,
-            self.style.font.font_style,
-            ["zh", "en"],
-            ord(char),
-        ):
-            return skia.Font(typeface, font_size)
-        return None
+        return match_font(self.style.font.font_family, self.style.font.font_style, char, font_size)
 
     def set_font_sizes(self, font_size: int):
         """
@@ -264,8 +545,45 @@ class DrawText:
             dict[int, list[Union[int, str]]]: A dictionary with the starting position of each emoji in the text as the key,
             and a list containing the end position of the emoji and the emoji character as the value.
         """
-        result = emoji.emoji_list(text)
-        return {i["match_start"]: [i["match_end"], i["emoji"]] for i in result}
+        return get_emoji_text(text)
+
+    def make_engine(self, font_size: int, font_style: Optional[skia.FontStyle] = None) -> TextEngine:
+        """
+        Text engine of the given size, using the shared font of `font_style` instead of the text font if given.
+        """
+        self.set_font_sizes(font_size)
+        text_font = self.text_font
+        if font_style is not None:
+            text_font = font_registry.get_font(self.style.font.font_family, font_style, font_size)
+        return TextEngine(text_font, self.emoji_font, self.match_font)
+
+    @staticmethod
+    def clean_text(text: str) -> str:
+        """
+        Remove tabs and everything from the first newline on.
+        """
+        return text.replace("\t", "").split("\n", 1)[0]
+
+    async def measure(
+        self,
+        text: str,
+        font_size: int,
+        position_and_bounds: tuple[int, int, int, int, int],
+        font_style: Optional[skia.FontStyle] = None,
+    ) -> TextMetrics:
+        """
+        Measure text the way `draw_text` would draw it, so callers can size their surface before drawing.
+
+        Args:
+            text (str): The text to measure.
+            font_size (int): The font size.
+            position_and_bounds (tuple[int, int, int, int, int]): See `draw_text`.
+            font_style (Optional[skia.FontStyle]): See `draw_text`.
+
+        Returns:
+            TextMetrics: Line count, width, height and truncation point.
+        """
+        return self.make_engine(font_size, font_style).measure(self.clean_text(text), position_and_bounds)
 
     async def draw_text(
         self,
@@ -274,75 +592,48 @@ class DrawText:
         font_size: int,
         position_and_bounds: tuple[int, int, int, int, int],
         font_color: tuple,
+        font_style: Optional[skia.FontStyle] = None,
     ):
-        self.set_font_sizes(font_size)
-        paint = self.initialize_paint(font_color)
-
-        text, emoji_info = await self.extract_emoji_info(text)
-        text_length = len(text) - 1
-        current_x, current_y, max_width, max_height, line_spacing = position_and_bounds
-        initial_x = current_x  # 保存初始 x 坐标
-        offset: int = 0
-
-        while offset <= text_length:
-            character = text[offset]
-
-            if character == "\n":
-                break
-
-            if offset in emoji_info:
-                offset, character, font = self._handle_emoji(offset, emoji_info)
-            else:
-                offset += 1
-                font = self.text_font
-
-            if not self._font_contains_character(font, character):
-                font = self.match_font(character, font_size) or self.text_font  # pragma: no cover
-
-            measure = font.measureText(character)
-            blob = skia.TextBlob(character, font)
-            canvas.drawTextBlob(blob, current_x, current_y, paint)
-            current_x += measure
-
-            if self._needs_new_line(current_x, max_width):
-                current_y, current_x = self._advance_to_next_line(
-                    current_y, line_spacing, max_height, initial_x, canvas, font, paint, current_x
-                )
-                if current_y >= max_height:
-                    break
-
-    def _handle_emoji(self, offset: int, emoji_info: dict[int, list[Union[int, str]]]) -> tuple[int, str, skia.Font]:
-        try:
-            character = cast(str, emoji_info[offset][1])
-            end_pos = cast(int, emoji_info[offset][0])
-            offset = end_pos
-            font = self.emoji_font
-            return offset, character, font
-        except KeyError as e:
-            raise ParseError(f"Error parsing emoji information {e}") from e
-
-    @staticmethod
-    def _font_contains_character(font: skia.Font, character: str) -> bool:
-        return font.textToGlyphs(character)[0] != 0
+        """
+        Draw text up to its first newline, wrapping at `max_width` and ending with an ellipsis at `max_height`.
 
-    @staticmethod
-    def _needs_new_line(current_x: int, max_width: int) -> bool:
-        return current_x > max_width
+        Args:
+            canvas (skia.Canvas): The canvas to draw on.
+            text (str): The text to draw.
+            font_size (int): The font size.
+            position_and_bounds (tuple[int, int, int, int, int]): x and y of the first baseline, the maximum width
+                and height and the line spacing.
+            font_color (tuple): The RGBA font color.
+            font_style (Optional[skia.FontStyle]): Draw with this style of the font family instead of the configured
+                one. Fallback fonts keep the configured style.
+        """
+        text = self.clean_text(text)
+        if self.style.font.text_backend == "paragraph" and paragraph_backend.available():
+            if self.draw_paragraph(canvas, text, font_size, position_and_bounds, font_color, font_style):
+                return
+        engine = self.make_engine(font_size, font_style)
+        paint = self.initialize_paint(font_color)
+        engine.draw_shaped(canvas, engine.shape(text, position_and_bounds), paint)
 
-    def _advance_to_next_line(
+    def draw_paragraph(
         self,
-        current_y: int,
-        line_spacing: int,
-        max_height: int,
-        initial_x: int,
         canvas: skia.Canvas,
-        font: skia.Font,
-        paint: skia.Paint,
-        current_x: int,
-    ) -> tuple[int, int]:
-        if current_y + line_spacing >= max_height:
-            self.draw_ellipsis(canvas, current_x, current_y, font, paint)
-            return max_height, initial_x
-
-        current_y += line_spacing
-        return current_y, initial_x
+        text: str,
+        font_size: int,
+        position_and_bounds: tuple[int, int, int, int, int],
+        font_color: tuple,
+        font_style: Optional[skia.FontStyle] = None,
+    ) -> bool:
+        """
+        Draw text that fits on its first line with the paragraph backend.
+
+        Returns:
+            bool: False if the text would have to wrap or be cut off, leaving it to the text engine.
+        """
+        x, y, max_width, _, _ = position_and_bounds
+        text_style = paragraph_backend.make_text_style(self.style, font_size, skia.Color(*font_color), font_style)
+        paragraph = paragraph_backend.build([(text, text_style)], max_width - x)
+        if paragraph.MaxIntrinsicWidth > max_width - x:
+            return False
+        paragraph.paint(canvas, x, y - paragraph.AlphabeticBaseline)
+        return True
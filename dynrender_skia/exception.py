@@ -23,6 +23,10 @@ class ImageDecodeError(SkiaBaseError):
     """Exception raised for errors in the image decoding process."""
 
 
+class ImageTooLargeError(ImageDecodeError):
+    """Exception raised when an image exceeds the byte or pixel limits of the fetch layer."""
+
+
 class DrawingError(SkiaBaseError):
     """Exception raised for errors during drawing operations."""
 
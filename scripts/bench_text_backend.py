@@ -0,0 +1,65 @@
+"""
+Compare the built-in text engine with the skia.textlayout paragraph backend on BiliText.
+
+    python scripts/bench_text_backend.py [--rounds 50]
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from dynamicadaptor.Content import RichTextDetail, Text
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dynrender_skia.DynConfig import MakeStaticFile, SetDynStyle
+from dynrender_skia.DynText import BiliText
+
+CJK = "今天去看了新番的首映，画面和音乐都非常出色，推荐大家有空去电影院看看。" * 6
+EMOJI = "好耶😀🎉 周末快乐👍👨‍👩‍👧 一起出去玩吧🌸🍜🎮 " * 8
+POSTS = {
+    "cjk": Text(
+        text=CJK,
+        rich_text_nodes=[
+            RichTextDetail(type="RICH_TEXT_NODE_TYPE_TEXT", text=CJK[:60]),
+            RichTextDetail(type="RICH_TEXT_NODE_TYPE_AT", text="@哔哩哔哩番剧"),
+            RichTextDetail(type="RICH_TEXT_NODE_TYPE_TEXT", text="\n" + CJK[60:]),
+        ],
+    ),
+    "emoji": Text(
+        text=EMOJI,
+        rich_text_nodes=[
+            RichTextDetail(type="RICH_TEXT_NODE_TYPE_TEXT", text=EMOJI),
+            RichTextDetail(type="RICH_TEXT_NODE_TYPE_TOPIC", text="#周末#"),
+        ],
+    ),
+}
+
+
+async def bench(static_path: str, backend: str, post: Text, rounds: int) -> float:
+    style = SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal", backend).set_style
+    await BiliText(static_path, style).run(post)
+    start = perf_counter()
+    for _ in range(rounds):
+        await BiliText(static_path, style).run(post)
+    return (perf_counter() - start) / rounds * 1000
+
+
+async def main(rounds: int) -> None:
+    with TemporaryDirectory() as tmp_path:
+        static_path = MakeStaticFile(tmp_path).check_cache_file
+        logger.info(f"{'post':<8}{'engine ms':>12}{'paragraph ms':>15}")
+        for name, post in POSTS.items():
+            engine = await bench(static_path, "engine", post, rounds)
+            paragraph = await bench(static_path, "paragraph", post, rounds)
+            logger.info(f"{name:<8}{engine:>12.2f}{paragraph:>15.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=50)
+    asyncio.run(main(parser.parse_args().rounds))
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import skia
+
+from dynrender_skia.DynCache import (
+    AssetCache,
+    ImageMemoryCache,
+    StickerAtlas,
+    flush_sticker_atlases,
+    get_sticker_atlas,
+    sticker_atlases,
+)
+
+
+@pytest.mark.asyncio
+class TestAssetCache:
+    async def test_put_and_get(self, tmp_path: pathlib.Path) -> None:
+        cache = AssetCache(str(tmp_path))
+        await cache.put("http://bilibili.com/a.png", (10, 10), "cover", b"data")
+        assert await cache.get("http://bilibili.com/a.png", (10, 10), "cover") == b"data"
+        assert await cache.get("http://bilibili.com/a.png", (20, 20), "cover") is None
+
+    async def test_expired_entry_is_removed(self, tmp_path: pathlib.Path) -> None:
+        cache = AssetCache(str(tmp_path), ttl={"face": 10})
+        await cache.put("http://bilibili.com/face.webp", None, "face", b"face")
+        file_path = cache.get_path("http://bilibili.com/face.webp", None, "face")
+        os.utime(file_path, (0, 0))
+        assert await cache.get("http://bilibili.com/face.webp", None, "face") is None
+        assert not os.path.exists(file_path)
+
+    async def test_lru_eviction_over_quota(self, tmp_path: pathlib.Path) -> None:
+        cache = AssetCache(str(tmp_path), max_bytes=10)
+        await cache.put("http://bilibili.com/1", None, "cover", b"1234")
+        await cache.put("http://bilibili.com/2", None, "cover", b"1234")
+        assert await cache.get("http://bilibili.com/1", None, "cover") == b"1234"
+        await cache.put("http://bilibili.com/3", None, "cover", b"1234")
+        assert await cache.get("http://bilibili.com/2", None, "cover") is None
+        assert await cache.get("http://bilibili.com/1", None, "cover") == b"1234"
+        assert cache.total_bytes == 8
+
+    async def test_index_is_rebuilt_from_disk(self, tmp_path: pathlib.Path) -> None:
+        await AssetCache(str(tmp_path)).put("http://bilibili.com/1", None, "emoji", b"1234")
+        cache = AssetCache(str(tmp_path))
+        assert cache.total_bytes == 0
+        assert await cache.get("http://bilibili.com/1", None, "emoji") == b"1234"
+        assert cache.total_bytes == 4
+
+    async def test_expired_entry_with_validators_is_kept_for_revalidation(self, tmp_path: pathlib.Path) -> None:
+        cache = AssetCache(str(tmp_path), ttl={"face": 10})
+        url = "http://bilibili.com/face.webp"
+        await cache.put(url, None, "face", b"face", {"etag": '"abc"'})
+        os.utime(cache.get_path(url, None, "face"), (0, 0))
+        assert await cache.get(url, None, "face") is None
+        assert await cache.get_stale(url, None, "face") == (b"face", {"etag": '"abc"'})
+        await cache.refresh(url, None, "face")
+        assert await cache.get(url, None, "face") == b"face"
+
+    async def test_entry_without_validators_is_not_stale(self, tmp_path: pathlib.Path) -> None:
+        cache = AssetCache(str(tmp_path))
+        await cache.put("http://bilibili.com/1", None, "face", b"1234", {"etag": '"abc"'})
+        await cache.put("http://bilibili.com/1", None, "face", b"1234")
+        assert await cache.get_stale("http://bilibili.com/1", None, "face") is None
+
+    async def test_disk_io_runs_in_executor(self, mocker, tmp_path: pathlib.Path) -> None:
+        threads = set()
+
+        def record(func):
+            def wrapper(*args, **kwargs):
+                threads.add(threading.current_thread().name)
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        for name in ("scandir", "replace", "utime", "remove"):
+            mocker.patch(f"dynrender_skia.DynCache.{name}", record(getattr(os, name)))
+        os.makedirs(tmp_path / "Cache" / "Assets" / "cover")
+        with ThreadPoolExecutor(1, thread_name_prefix="cache-io") as executor:
+            cache = AssetCache(str(tmp_path), max_bytes=4, executor=executor)
+            await cache.put("http://bilibili.com/1", None, "cover", b"1234")
+            assert await cache.get("http://bilibili.com/1", None, "cover") == b"1234"
+            await cache.put("http://bilibili.com/2", None, "cover", b"1234")
+        assert threads == {"cache-io_0"}
+
+
+class TestImageMemoryCache:
+    @staticmethod
+    def make_image(width: int, height: int) -> skia.Image:
+        return skia.Image.fromarray(np.zeros([height, width, 4], np.uint8), colorType=skia.ColorType.kRGBA_8888_ColorType)
+
+    def test_hit_and_miss_counters(self) -> None:
+        cache = ImageMemoryCache()
+        img = self.make_image(10, 10)
+        assert cache.get("http://bilibili.com", (10, 10)) is None
+        cache.put("http://bilibili.com", (10, 10), img)
+        assert cache.get("http://bilibili.com", (10, 10)) is img
+        assert cache.get("http://bilibili.com", None) is None
+        assert cache.stats == {"hits": 1, "misses": 2, "entries": 1, "bytes": 400}
+
+    def test_least_recently_used_image_is_dropped(self) -> None:
+        cache = ImageMemoryCache(max_bytes=1000)
+        cache.put("http://bilibili.com/1", None, self.make_image(10, 10))
+        cache.put("http://bilibili.com/2", None, self.make_image(10, 10))
+        cache.get("http://bilibili.com/1")
+        cache.put("http://bilibili.com/3", None, self.make_image(10, 10))
+        assert cache.get("http://bilibili.com/2") is None
+        assert cache.get("http://bilibili.com/1") is not None
+        assert cache.total_bytes == 800
+
+
+@pytest.mark.asyncio
+class TestStickerAtlas:
+    @staticmethod
+    def make_sticker(value: int) -> skia.Image:
+        pixels = np.full((90, 90, 4), value, np.uint8)
+        pixels[:, :, 3] = 255
+        return skia.Image.fromarray(pixels)
+
+    async def test_stickers_are_resized_into_cells(self) -> None:
+        atlas = StickerAtlas(30, columns=2)
+        for i in range(5):
+            atlas.add(f"http://i0.hdslb.com/{i}.png", self.make_sticker(50 * i + 10))
+        assert atlas.image.width() == 60
+        assert atlas.image.height() == 120
+        rect = atlas.rect("http://i0.hdslb.com/3.png")
+        assert (rect.x(), rect.y(), rect.width()) == (30, 30, 30)
+        assert atlas.image.toarray()[45, 45, 0] == 160
+
+    async def test_persisted_atlas_is_loaded(self, tmp_path: pathlib.Path) -> None:
+        atlas = StickerAtlas(30, str(tmp_path / "emoji_30"))
+        atlas.add("http://i0.hdslb.com/1.png", self.make_sticker(200))
+        await atlas.persist()
+        assert not atlas.dirty
+
+        loaded = StickerAtlas(30, str(tmp_path / "emoji_30"))
+        loaded.load()
+        assert "http://i0.hdslb.com/1.png" in loaded
+        assert loaded.image.toarray()[15, 15, 0] == 200
+        loaded.add("http://i0.hdslb.com/2.png", self.make_sticker(100))
+        assert len(loaded) == 2
+
+    async def test_atlas_of_other_cell_size_is_ignored(self, tmp_path: pathlib.Path) -> None:
+        atlas = StickerAtlas(30, str(tmp_path / "emoji"))
+        atlas.add("http://i0.hdslb.com/1.png", self.make_sticker(200))
+        await atlas.persist()
+        other = StickerAtlas(60, str(tmp_path / "emoji"))
+        other.load()
+        assert len(other) == 0
+
+    async def test_full_atlas_reuses_least_recently_used_cell(self) -> None:
+        atlas = StickerAtlas(30, columns=2, max_rows=1)
+        atlas.add("http://i0.hdslb.com/1.png", self.make_sticker(10))
+        atlas.add("http://i0.hdslb.com/2.png", self.make_sticker(20))
+        atlas.rect("http://i0.hdslb.com/1.png")
+        atlas.add("http://i0.hdslb.com/3.png", self.make_sticker(30))
+        assert len(atlas) == 2
+        assert "http://i0.hdslb.com/2.png" not in atlas
+        assert atlas.image.height() == 30
+        assert atlas.image.toarray()[15, 45, 0] == 30
+
+    async def test_persist_is_debounced(self, mocker, tmp_path: pathlib.Path) -> None:
+        atlas = StickerAtlas(30, str(tmp_path / "emoji_30"))
+        write = mocker.spy(atlas, "write")
+        for i in range(3):
+            atlas.add(f"http://i0.hdslb.com/{i}.png", self.make_sticker(200))
+            atlas.schedule_persist(delay=0.01)
+        await asyncio.sleep(0.1)
+        assert write.call_count == 1
+        assert len(write.call_args[0][1]) == 3
+
+    async def test_failed_write_keeps_atlas_dirty(self, tmp_path: pathlib.Path) -> None:
+        (tmp_path / "blocked").write_text("")
+        atlas = StickerAtlas(30, str(tmp_path / "blocked" / "emoji_30"))
+        atlas.add("http://i0.hdslb.com/1.png", self.make_sticker(200))
+        await atlas.flush()
+        assert atlas.dirty
+
+        atlas.file_path = str(tmp_path / "emoji_30")
+        await atlas.flush()
+        assert not atlas.dirty
+        assert (tmp_path / "emoji_30.png").exists()
+
+    async def test_atlas_is_loaded_once_per_static_path(self, tmp_path: pathlib.Path) -> None:
+        atlas = await get_sticker_atlas(str(tmp_path), 30)
+        atlas.add("http://i0.hdslb.com/1.png", self.make_sticker(200))
+        atlas.schedule_persist()
+        await flush_sticker_atlases(str(tmp_path))
+        assert await get_sticker_atlas(str(tmp_path), 30) is atlas
+        sticker_atlases.clear()
+        loaded = await get_sticker_atlas(str(tmp_path), 30)
+        assert loaded is not atlas
+        assert "http://i0.hdslb.com/1.png" in loaded
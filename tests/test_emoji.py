@@ -0,0 +1,64 @@
+import emoji
+import numpy as np
+import pytest
+import skia
+
+from dynrender_skia.DynEmoji import EmojiGlyphCache, get_emoji_text, may_contain_emoji
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "2024-07-10 10:24:36",
+        "图片生成于：2024-07-10",
+        "去看看",
+        "© 2024",
+        "1️⃣ 2️⃣",
+        "👨‍👩‍👧 family",
+        "Hello, 🌍!",
+    ],
+)
+def test_matches_emoji_list(text: str) -> None:
+    expected = {i["match_start"]: [i["match_end"], i["emoji"]] for i in emoji.emoji_list(text)}
+    assert get_emoji_text(text) == expected
+
+
+def test_precheck_skips_plain_text() -> None:
+    assert not may_contain_emoji("2024-07-10 10:24:36")
+    assert not may_contain_emoji("图片生成于：2024-07-10")
+    assert may_contain_emoji("去看看 🌍")
+    assert may_contain_emoji("#️⃣")
+
+
+def test_results_are_cached() -> None:
+    get_emoji_text.cache_clear()
+    get_emoji_text("Hello, 🌍!")
+    get_emoji_text("Hello, 🌍!")
+    assert get_emoji_text.cache_info().hits == 1
+
+
+class TestEmojiGlyphCache:
+    def setup_method(self) -> None:
+        self.cache = EmojiGlyphCache(max_entries=2)
+        self.font = skia.Font(skia.Typeface.MakeDefault(), 40)  # type: ignore
+
+    def test_rendered_once_per_key(self) -> None:
+        first = self.cache.get("A", self.font, skia.ColorBLACK)
+        assert self.cache.get("A", self.font, skia.ColorBLACK) is first
+        assert self.cache.get("A", self.font, skia.ColorRED) is not first
+        self.cache.get("B", self.font, skia.ColorBLACK)
+        assert len(self.cache) == 2
+
+    def test_blit_matches_text_blob(self) -> None:
+        def draw(paint_glyph) -> np.ndarray:
+            surface = skia.Surface(100, 100)
+            canvas = surface.getCanvas()
+            canvas.clear(skia.ColorWHITE)
+            paint_glyph(canvas)
+            return canvas.toarray()
+
+        blob = skia.TextBlob.MakeFromShapedText("A", self.font)
+        expected = draw(lambda canvas: canvas.drawTextBlob(blob, 20, 60, skia.Paint(AntiAlias=True)))
+        image, left, top = self.cache.get("A", self.font, skia.ColorBLACK)
+        actual = draw(lambda canvas: canvas.drawImage(image, 20 + left, 60 + top))
+        assert np.array_equal(expected, actual)
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import pathlib
+import time
+
+import pytest
+import respx
+import skia
+
+from dynrender_skia.DynCache import AssetCache, ImageMemoryCache, NegativeCache
+from dynrender_skia.DynFetcher import CircuitBreaker, ImageFetcher, fetch_deadline
+
+
+@pytest.mark.asyncio
+class TestImageFetcher:
+    async def test_client_is_reused_between_calls(self) -> None:
+        fetcher = ImageFetcher()
+        client = await fetcher.get_client()
+        assert await fetcher.get_client() is client
+        await fetcher.aclose()
+        assert client.is_closed
+
+    async def test_context_manager_closes_client(self) -> None:
+        async with ImageFetcher() as fetcher:
+            client = await fetcher.get_client()
+        assert client.is_closed
+
+    async def test_get_pictures_with_multiple_urls(self, mock_img_url: str, img_path: pathlib.Path) -> None:
+        async with respx.mock(base_url=mock_img_url) as mock:
+            mock.get(mock_img_url).respond(content=img_path.read_bytes(), status_code=200)
+            async with ImageFetcher() as fetcher:
+                img_list = await fetcher.get_pictures([mock_img_url, mock_img_url], (100, 100))
+        assert len(img_list) == 2
+        assert all(isinstance(img, skia.Image) and img.width() == 100 for img in img_list)
+
+    async def test_unpooled_fetcher_keeps_no_client(self, mock_img_url: str, img_path: pathlib.Path) -> None:
+        async with respx.mock(base_url=mock_img_url) as mock:
+            mock.get(mock_img_url).respond(content=img_path.read_bytes(), status_code=200)
+            fetcher = ImageFetcher(pooled=False)
+            img = await fetcher.get_pictures(mock_img_url)
+        assert img is not None
+        assert fetcher._client is None
+
+    async def test_concurrent_requests_are_coalesced(self, mock_img_url: str, img_path: pathlib.Path) -> None:
+        url = f"{mock_img_url}/coalesced.png"
+        async with respx.mock(base_url=mock_img_url) as mock:
+            route = mock.get(url).respond(content=img_path.read_bytes(), status_code=200)
+            async with ImageFetcher(memory_cache=ImageMemoryCache()) as fetcher:
+                results = await asyncio.gather(*[fetcher.get_pictures(url, (50, 50)) for _ in range(5)])
+                assert not fetcher._inflight
+        assert route.call_count == 1
+        assert all(img is results[0] for img in results)
+
+    async def test_circuit_opens_and_fails_fast(self, mock_img_url: str) -> None:
+        url = f"{mock_img_url}/throttled.png"
+        async with respx.mock(base_url=mock_img_url) as mock:
+            route = mock.get(url).respond(status_code=429)
+            fetcher = ImageFetcher(
+                memory_cache=ImageMemoryCache(),
+                failure_threshold=2,
+                negative_cache=NegativeCache(ttl={"server_error": 0}),
+            )
+            async with fetcher:
+                for _ in range(4):
+                    assert await fetcher.get_pictures(url) is None
+                assert fetcher.host_states["bilibili.com"]["state"] == "open"
+        assert route.call_count == 2
+
+    async def test_oversized_image_falls_back_to_cdn_variant(self, img_path: pathlib.Path) -> None:
+        url = "https://i0.hdslb.com/bfs/new_dyn/large.png"
+        async with respx.mock() as mock:
+            original = mock.get(url).respond(content=img_path.read_bytes())
+            variant = mock.get(f"{url}@100w.webp").respond(content=img_path.read_bytes())
+            fetcher = ImageFetcher(memory_cache=ImageMemoryCache(), max_pixels=1)
+            async with fetcher:
+                assert await fetcher.get_pictures(url, (100, 100)) is None
+        assert original.call_count == 1
+        assert variant.call_count == 1
+        assert fetcher.host_states["i0.hdslb.com"]["state"] == "closed"
+
+    def test_smaller_variant_only_for_cdn_originals(self) -> None:
+        assert ImageFetcher.smaller_variant("https://i0.hdslb.com/bfs/a.jpg", None) == (
+            "https://i0.hdslb.com/bfs/a.jpg@1008w.webp"
+        )
+        assert ImageFetcher.smaller_variant("https://i0.hdslb.com/bfs/a.jpg@240w.webp", None) is None
+        assert ImageFetcher.smaller_variant("http://bilibili.com/a.jpg", (10, 10)) is None
+
+    async def test_expired_entry_is_revalidated(self, mock_img_url: str, img_path: pathlib.Path, tmp_path) -> None:
+        url = f"{mock_img_url}/face.png"
+        cache = AssetCache(str(tmp_path), ttl={"face": 10})
+        async with respx.mock(base_url=mock_img_url) as mock:
+            route = mock.get(url).respond(content=img_path.read_bytes(), headers={"ETag": '"v1"'})
+            async with ImageFetcher(cache=cache, memory_cache=ImageMemoryCache()) as fetcher:
+                assert await fetcher.get_pictures(url, (100, 100), asset="face") is not None
+            os.utime(cache.get_path(url, (100, 100), "face"), (0, 0))
+            route.respond(status_code=304, headers={"ETag": '"v1"'})
+            async with ImageFetcher(cache=cache, memory_cache=ImageMemoryCache()) as fetcher:
+                img = await fetcher.get_pictures(url, (100, 100), asset="face")
+        assert img is not None
+        assert img.width() == 100
+        assert route.calls.last.request.headers["If-None-Match"] == '"v1"'
+        assert await cache.get(url, (100, 100), "face") is not None
+
+    async def test_original_body_is_cached_as_received(
+        self, mock_img_url: str, img_path: pathlib.Path, tmp_path
+    ) -> None:
+        url = f"{mock_img_url}/cover.png"
+        cache = AssetCache(str(tmp_path))
+        async with respx.mock(base_url=mock_img_url) as mock:
+            mock.get(url).respond(content=img_path.read_bytes())
+            async with ImageFetcher(cache=cache, memory_cache=ImageMemoryCache()) as fetcher:
+                await fetcher.get_pictures(url, asset="cover")
+                await fetcher.get_pictures(url, (100, 100), asset="cover")
+        assert await cache.get(url, None, "cover") == img_path.read_bytes()
+        resized = await cache.get(url, (100, 100), "cover")
+        assert resized is not None
+        assert resized[8:12] == b"WEBP"
+
+    async def test_failed_url_is_remembered(self, mock_img_url: str) -> None:
+        url = f"{mock_img_url}/missing.png"
+        negative_cache = NegativeCache()
+        async with respx.mock(base_url=mock_img_url) as mock:
+            route = mock.get(url).respond(status_code=404)
+            async with ImageFetcher(memory_cache=ImageMemoryCache(), negative_cache=negative_cache) as fetcher:
+                for _ in range(3):
+                    assert await fetcher.get_pictures(url) is None
+        assert route.call_count == 1
+        assert negative_cache.get(url) == "not_found"
+
+    async def test_undecodable_url_is_remembered(self, mock_img_url: str) -> None:
+        url = f"{mock_img_url}/broken.png"
+        negative_cache = NegativeCache()
+        async with respx.mock(base_url=mock_img_url) as mock:
+            mock.get(url).respond(content=b"not an image")
+            async with ImageFetcher(memory_cache=ImageMemoryCache(), negative_cache=negative_cache) as fetcher:
+                assert await fetcher.get_pictures(url) is None
+        assert negative_cache.get(url) == "decode_error"
+
+    async def test_deadline_returns_placeholder_and_cancels_load(self, mock_img_url: str) -> None:
+        url = f"{mock_img_url}/slow.png"
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def slow_load(*args) -> None:
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        fetcher = ImageFetcher(memory_cache=ImageMemoryCache())
+        fetcher._load = slow_load  # type: ignore
+        async with fetcher:
+            with fetch_deadline(0.05):
+                assert await fetcher.get_pictures([url, url]) == [None, None]
+            await asyncio.wait_for(cancelled.wait(), 1)
+            await asyncio.sleep(0.01)
+        assert started.is_set()
+        assert not fetcher._inflight
+        assert not fetcher._waiters
+
+    async def test_nested_deadline_does_not_extend_outer(self) -> None:
+        with fetch_deadline(1) as outer:
+            with fetch_deadline(10) as inner:
+                assert inner == outer
+            with fetch_deadline(None) as kept:
+                assert kept == outer
+
+    async def test_slow_request_is_hedged(self, mocker, img_path: pathlib.Path) -> None:
+        url = "https://i0.hdslb.com/bfs/slow.png"
+
+        async def fake_download(client, request_url, *args, **kwargs):
+            if request_url == url:
+                await asyncio.sleep(10)
+            return img_path.read_bytes(), {}
+
+        mocker.patch("dynrender_skia.DynFetcher.download_img", side_effect=fake_download)
+        fetcher = ImageFetcher(memory_cache=ImageMemoryCache(), hedge=True, hedge_delay=0.01, hedge_budget=1)
+        async with fetcher:
+            assert await fetcher.get_pictures(url) is not None
+        assert fetcher.hedge_stats == {"requests": 1, "hedged": 1, "hedge_wins": 1}
+
+    async def test_hedge_budget_is_capped(self, mocker, img_path: pathlib.Path) -> None:
+        async def fake_download(client, request_url, *args, **kwargs):
+            await asyncio.sleep(0.05)
+            return img_path.read_bytes(), {}
+
+        mocker.patch("dynrender_skia.DynFetcher.download_img", side_effect=fake_download)
+        fetcher = ImageFetcher(memory_cache=ImageMemoryCache(), hedge=True, hedge_delay=0.01, hedge_budget=0.25)
+        async with fetcher:
+            for i in range(4):
+                await fetcher.get_pictures(f"https://i0.hdslb.com/bfs/{i}.png")
+        assert fetcher.hedge_stats["requests"] == 4
+        assert fetcher.hedge_stats["hedged"] == 1
+
+    def test_hedge_url_rotates_cdn_edge(self) -> None:
+        assert ImageFetcher.hedge_url("https://i0.hdslb.com/bfs/a.png") == "https://i1.hdslb.com/bfs/a.png"
+        assert ImageFetcher.hedge_url("https://i2.hdslb.com/bfs/a.png") == "https://i0.hdslb.com/bfs/a.png"
+        assert ImageFetcher.hedge_url("http://bilibili.com/a.png") == "http://bilibili.com/a.png"
+
+
+class TestNegativeCache:
+    def test_entry_expires(self) -> None:
+        cache = NegativeCache(ttl={"not_found": 0.01})
+        cache.put("http://bilibili.com/a", "not_found")
+        assert cache.get("http://bilibili.com/a") == "not_found"
+        time.sleep(0.02)
+        assert cache.get("http://bilibili.com/a") is None
+        assert len(cache) == 0
+
+    def test_error_class_without_ttl_is_not_remembered(self) -> None:
+        cache = NegativeCache(ttl={"transport_error": 0})
+        cache.put("http://bilibili.com/a", "transport_error")
+        cache.put("http://bilibili.com/b", "unknown")
+        assert len(cache) == 0
+
+    def test_oldest_entry_is_dropped(self) -> None:
+        cache = NegativeCache(max_entries=1)
+        cache.put("http://bilibili.com/a", "not_found")
+        cache.put("http://bilibili.com/b", "not_found")
+        assert cache.get("http://bilibili.com/a") is None
+        assert cache.get("http://bilibili.com/b") == "not_found"
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=2, recovery_time=30)
+        assert breaker.record_failure() is False
+        assert breaker.record_failure() is True
+        assert breaker.state == "open"
+        assert breaker.allow() is False
+
+    def test_half_open_allows_single_probe(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, recovery_time=0)
+        breaker.record_failure()
+        assert breaker.state == "half_open"
+        assert breaker.allow() is True
+        assert breaker.allow() is False
+        breaker.record_success()
+        assert breaker.state == "closed"
+
+    def test_failed_probe_reopens(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, recovery_time=0)
+        breaker.record_failure()
+        assert breaker.allow() is True
+        assert breaker.record_failure() is True
+        assert breaker.probing is False
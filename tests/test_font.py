@@ -0,0 +1,144 @@
+import json
+import threading
+from unittest.mock import patch
+
+import skia
+
+from dynrender_skia.DynConfig import MakeStaticFile
+from dynrender_skia.DynFont import CoverageIndex, FontFallback, FontRegistry, font_fallback, style_key
+
+
+class TestFontFallback:
+    def test_lookup_is_memoized_per_code_point(self) -> None:
+        fallback = FontFallback()
+        typeface = skia.Typeface.MakeDefault()  # type: ignore
+        with patch.object(skia.FontMgr, "matchFamilyStyleCharacter", return_value=typeface) as match:
+            first = fallback.match_font("Noto Sans SC", skia.FontStyle.Normal(), "あ", 20)
+            second = fallback.match_font("Noto Sans SC", skia.FontStyle.Normal(), "あ", 20)
+            fallback.match_font("Noto Sans SC", skia.FontStyle.Bold(), "あ", 20)
+        assert first is second
+        assert first.getSize() == 20
+        assert match.call_count == 2
+
+    def test_missing_typeface_is_memoized(self) -> None:
+        fallback = FontFallback()
+        with patch.object(skia.FontMgr, "matchFamilyStyleCharacter", return_value=None) as match:
+            assert fallback.match_font("Noto Sans SC", skia.FontStyle.Normal(), "￿", 20) is None
+            assert fallback.match_font("Noto Sans SC", skia.FontStyle.Normal(), "￿", 30) is None
+        assert match.call_count == 1
+
+    def test_fonts_are_cached_per_size(self) -> None:
+        fallback = FontFallback()
+        typeface = skia.Typeface.MakeDefault()  # type: ignore
+        assert fallback.get_font(typeface, 20) is fallback.get_font(typeface, 20)
+        assert fallback.get_font(typeface, 20) is not fallback.get_font(typeface, 30)
+
+
+class TestFontRegistry:
+    def test_typeface_is_resolved_once_per_style(self) -> None:
+        registry = FontRegistry()
+        typeface = skia.Typeface.MakeDefault()  # type: ignore
+        with patch.object(skia.Typeface, "MakeFromName", return_value=typeface) as make:
+            first = registry.get_typeface("Noto Sans SC", skia.FontStyle.Normal())
+            second = registry.get_typeface("Noto Sans SC", skia.FontStyle.Normal())
+            registry.get_typeface("Noto Sans SC", skia.FontStyle.Bold())
+        assert first is second
+        assert make.call_count == 2
+
+    def test_shared_fonts_are_cached_per_size(self) -> None:
+        registry = FontRegistry()
+        font = registry.get_font("Noto Sans SC", skia.FontStyle.Normal(), 20)
+        assert registry.get_font("Noto Sans SC", skia.FontStyle.Normal(), 20) is font
+        assert registry.get_font("Noto Sans SC", skia.FontStyle.Normal(), 30).getSize() == 30
+
+    def test_made_fonts_are_owned_by_caller(self) -> None:
+        registry = FontRegistry()
+        shared = registry.get_font("Noto Sans SC", skia.FontStyle.Normal(), 20)
+        font = registry.make_font("Noto Sans SC", skia.FontStyle.Normal(), 20)
+        font.setSize(40)
+        assert font is not shared
+        assert shared.getSize() == 20
+        assert font.getTypeface().uniqueID() == shared.getTypeface().uniqueID()
+
+
+class TestCoverageIndex:
+    def setup_method(self) -> None:
+        self.normal = style_key(skia.FontStyle.Normal())
+        self.bold = style_key(skia.FontStyle.Bold())
+        self.index = CoverageIndex(
+            {
+                ("Sans", self.normal): [(0x20, 0x7F)],
+                ("Sans", self.bold): [(0x20, 0x7F), (0x4E00, 0x9FA6)],
+                ("Symbols", self.normal): [(0x2600, 0x2700), (0x1F300, 0x1FA00)],
+            }
+        )
+
+    def test_requested_face_is_preferred(self) -> None:
+        assert self.index.find("Sans", skia.FontStyle.Bold(), ord("a")) == ("Sans", self.bold)
+        assert self.index.find("Sans", skia.FontStyle.Normal(), ord("中")) == ("Sans", self.bold)
+        assert self.index.find("Sans", skia.FontStyle.Normal(), ord("😀")) == ("Symbols", self.normal)
+        assert self.index.find("Sans", skia.FontStyle.Normal(), 0x7F) is None
+
+    def test_build_reads_installed_coverage(self) -> None:
+        index = CoverageIndex.from_json(json.loads(json.dumps(CoverageIndex.build(font_fallback.font_mgr).to_json())))
+        assert index.find("DejaVu Sans", skia.FontStyle.Normal(), ord("a")) == ("DejaVu Sans", self.normal)
+        assert index.find("DejaVu Sans", skia.FontStyle.Normal(), ord("中")) is None
+
+    def test_fallback_uses_index_without_system_search(self) -> None:
+        fallback = FontFallback()
+        fallback.load_coverage(CoverageIndex({("DejaVu Sans", self.normal): [(0x20, 0x7F)]}))
+        with patch.object(skia.FontMgr, "matchFamilyStyleCharacter") as match:
+            font = fallback.match_font("Noto Sans SC", skia.FontStyle.Normal(), "a", 20)
+            assert fallback.match_font("Noto Sans SC", skia.FontStyle.Normal(), "中", 20) is None
+        assert font.getTypeface().getFamilyName() == "DejaVu Sans"
+        assert match.call_count == 0
+
+    def test_matcher_preference_orders_shared_coverage(self) -> None:
+        index = CoverageIndex(
+            {
+                ("Noto Sans JP", self.normal): [(0x20, 0x7F), (0x4E00, 0x9FA6)],
+                ("Noto Sans SC", self.normal): [(0x20, 0x7F), (0x4E00, 0x9FA6)],
+            },
+            [(0x4E00, 0x9FA6, "Noto Sans SC")],
+        )
+        assert index.find("Sans", skia.FontStyle.Normal(), ord("中")) == ("Noto Sans SC", self.normal)
+        assert index.find("Noto Sans JP", skia.FontStyle.Normal(), ord("中")) == ("Noto Sans JP", self.normal)
+        assert index.find("Sans", skia.FontStyle.Normal(), ord("a")) == ("Noto Sans JP", self.normal)
+
+    def test_build_records_matcher_preference(self) -> None:
+        serif = font_fallback.font_mgr.matchFamilyStyle("DejaVu Serif", skia.FontStyle.Normal())
+        with patch.object(skia.FontMgr, "matchFamilyStyleCharacter", return_value=serif):
+            index = CoverageIndex.build(font_fallback.font_mgr)
+        assert index.find("Noto Sans SC", skia.FontStyle.Normal(), ord("a")) == ("DejaVu Serif", self.normal)
+        assert index.find("DejaVu Sans", skia.FontStyle.Normal(), ord("a")) == ("DejaVu Sans", self.normal)
+
+    def test_index_is_loaded_in_background(self, tmp_path) -> None:
+        release = threading.Event()
+
+        def build(font_mgr):
+            release.wait(5)
+            return CoverageIndex({})
+
+        with patch.object(CoverageIndex, "build", side_effect=build), patch.object(font_fallback, "load_coverage"):
+            static_file = MakeStaticFile(str(tmp_path))
+            assert static_file.check_cache_file == str(tmp_path / "Static")
+            assert not static_file.font_cache_task.done()
+            assert all(i.daemon for i in threading.enumerate() if i.name == "font-coverage")
+            release.set()
+            assert static_file.font_cache_task.result(5) is not None
+
+    def test_index_is_rebuilt_when_fonts_change(self, tmp_path) -> None:
+        font_cache_path = str(tmp_path / "font_family.json")
+        with patch.object(CoverageIndex, "build", return_value=CoverageIndex({})) as build, patch.object(
+            font_fallback, "load_coverage"
+        ) as load:
+            MakeStaticFile.load_font_cache(font_cache_path)
+            MakeStaticFile.load_font_cache(font_cache_path)
+            assert build.call_count == 1
+            with open(font_cache_path) as f:
+                font_cache = json.load(f)
+            with open(font_cache_path, "w") as f:
+                json.dump({**font_cache, "families": ["Removed Sans"]}, f)
+            MakeStaticFile.load_font_cache(font_cache_path)
+            assert build.call_count == 2
+        assert load.call_count == 3
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+import skia
+
+from dynrender_skia.DynLayout import LayoutCache, TextEngine, fit_clusters, layout_cache
+
+
+def draw_per_character(canvas: skia.Canvas, text: str, font: skia.Font, position_and_bounds, paint) -> None:
+    """The character by character drawing the text engine replaced."""
+    x, y, max_width, max_height, line_spacing = position_and_bounds
+    initial_x = x
+    for character in text:
+        canvas.drawTextBlob(skia.TextBlob(character, font), x, y, paint)
+        x += font.measureText(character)
+        if x > max_width:
+            if y + line_spacing >= max_height:
+                canvas.drawTextBlob(skia.TextBlob("...", font), x, y, paint)
+                break
+            y += line_spacing
+            x = initial_x
+
+
+def render(draw) -> np.ndarray:
+    surface = skia.Surface(400, 200)
+    canvas = surface.getCanvas()
+    canvas.clear(skia.ColorWHITE)
+    draw(canvas)
+    return canvas.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
+
+
+class TestTextEngine:
+    @pytest.fixture(autouse=True)
+    def _setup_method(self):
+        self.font = skia.Font(skia.Typeface.MakeDefault(), 20)  # type: ignore
+        self.engine = TextEngine(self.font, self.font, lambda character, size: None)
+        self.paint = skia.Paint(AntiAlias=True, Color=skia.ColorBLACK)
+
+    @pytest.mark.parametrize(
+        ("text", "position_and_bounds"),
+        [
+            ("Hello, world!", (10, 30, 380, 200, 30)),
+            ("The quick brown fox jumps over the lazy dog again and again", (10, 30, 200, 200, 30)),
+            ("The quick brown fox jumps over the lazy dog again and again", (10, 30, 200, 90, 30)),
+        ],
+    )
+    def test_output_is_pixel_equivalent(self, text: str, position_and_bounds) -> None:
+        expected = render(lambda canvas: draw_per_character(canvas, text, self.font, position_and_bounds, self.paint))
+        layout = self.engine.layout(self.engine.make_runs(text, {}), position_and_bounds)
+        actual = render(lambda canvas: self.engine.draw(canvas, layout, self.paint))
+        assert np.array_equal(expected, actual)
+
+    def test_runs_are_split_by_font(self) -> None:
+        fallback = skia.Font(skia.Typeface.MakeDefault(), 20)  # type: ignore
+        engine = TextEngine(self.font, fallback, lambda character, size: None)
+        runs = engine.make_runs("ab😀c", {2: [3, "😀"]})
+        assert [run.text for run in runs] == ["ab", "😀", "c"]
+        assert [run.emoji for run in runs] == [False, True, False]
+        assert runs[0].clusters == [1, 2]
+
+    def test_missing_glyphs_get_fallback_runs(self) -> None:
+        fallback = skia.Font(skia.Typeface.MakeDefault(), 20)  # type: ignore
+        engine = TextEngine(self.font, self.font, lambda character, size: fallback)
+        runs = engine.make_runs("ab中文c😀d", {5: [6, "😀"]})
+        assert [run.text for run in runs] == ["ab", "中文", "c", "😀", "d"]
+        assert [run.font is fallback for run in runs] == [False, True, False, False, False]
+        assert runs[1].clusters == [1, 2]
+
+    def test_fit_clusters_breaks_after_cluster(self) -> None:
+        widths = np.array([4.0, 4.0, 4.0, 4.0])
+        cluster_end = np.array([True, False, True, True])
+        advance, count, overflowed = fit_clusters(widths, cluster_end, 2.0, lambda offset: offset > 7)
+        assert advance.tolist() == [2.0, 6.0, 10.0, 14.0]
+        assert (count, overflowed) == (3, True)
+        advance, count, overflowed = fit_clusters(widths, cluster_end, 2.0, lambda offset: offset > 100)
+        assert (count, overflowed, advance[-1]) == (4, False, 18.0)
+
+    def test_layout_wraps_and_truncates(self) -> None:
+        runs = self.engine.make_runs("a" * 100, {})
+        layout = self.engine.layout(runs, (0, 20, 100, 80, 20))
+        assert [line.y for line in layout.lines] == [20, 40, 60]
+        assert layout.ellipsis is not None
+        assert layout.ellipsis[1] == 60
+
+    def test_shaped_text_is_cached(self) -> None:
+        layout_cache.clear()
+        first = self.engine.shape("Hello, world!", (10, 30, 380, 200, 30))
+        second = self.engine.shape("Hello, world!", (10, 30, 380, 200, 30))
+        self.engine.shape("Hello, world!", (10, 30, 60, 200, 30))
+        assert first is second
+        assert layout_cache.stats == {"hits": 1, "misses": 2, "entries": 2}
+
+    def test_cache_hit_replays_blobs(self) -> None:
+        layout_cache.clear()
+        position_and_bounds = (10, 30, 200, 90, 30)
+        text = "The quick brown fox jumps over the lazy dog again and again"
+        layout = self.engine.layout(self.engine.make_runs(text, {}), position_and_bounds)
+        expected = render(lambda canvas: self.engine.draw(canvas, layout, self.paint))
+        self.engine.shape(text, position_and_bounds)
+        shaped = self.engine.shape(text, position_and_bounds)
+        actual = render(lambda canvas: self.engine.draw_shaped(canvas, shaped, self.paint))
+        assert np.array_equal(expected, actual)
+
+    def test_cache_is_bounded(self) -> None:
+        cache = LayoutCache(max_entries=2)
+        for text in ("a", "b", "c"):
+            cache.put((text,), self.engine.shape(text, (0, 20, 100, 80, 20)))
+        assert len(cache) == 2
+        assert cache.get(("a",)) is None
+
+    def test_measure_single_line(self) -> None:
+        metrics = self.engine.measure("Hello", (10, 30, 380, 200, 30))
+        font_metrics = self.font.getMetrics()
+        assert metrics.lines == 1
+        assert metrics.width == pytest.approx(self.font.measureText("Hello"))
+        assert metrics.height == pytest.approx(font_metrics.fDescent - font_metrics.fAscent)
+        assert metrics.truncated is None
+
+    def test_measure_truncated_text(self) -> None:
+        metrics = self.engine.measure("a" * 100, (0, 20, 100, 80, 20))
+        layout = self.engine.shape("a" * 100, (0, 20, 100, 80, 20)).layout
+        assert metrics.lines == 3
+        assert 0 < metrics.truncated < 100
+        assert sum(len(run.glyphs) for line in layout.lines for run in line.runs) == metrics.truncated
+        assert metrics.width > 100
+
+    def test_measure_empty_text(self) -> None:
+        assert self.engine.measure("", (0, 20, 100, 80, 20)) == (0, 0, 0, None)
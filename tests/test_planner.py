@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import skia
+
+from dynrender_skia.DynCache import StickerAtlas
+from dynrender_skia.DynConfig import SetDynStyle
+from dynrender_skia.DynPlanner import AssetPlanner, AssetRequest, draw_urls
+
+
+def make_item(src: str, width: int = 100, height: int = 100) -> SimpleNamespace:
+    return SimpleNamespace(src=src, url=None, width=width, height=height)
+
+
+class TestDrawUrls:
+    def test_single_picture_is_scaled_to_content_width(self) -> None:
+        assert draw_urls([make_item("a", 2016, 1008)]) == (["a"], (1008, 0))
+
+    def test_single_picture_without_dimensions_is_scaled_to_content_width(self) -> None:
+        assert draw_urls([make_item("a", 0, 0)]) == (["a"], (1008, 0))
+
+    def test_single_long_picture_uses_header_crop(self) -> None:
+        assert draw_urls([make_item("a", 100, 500)]) == (["a@600w_800h_!header.webp"], (1008, 0))
+
+    def test_grid_pictures(self) -> None:
+        url_list, size = draw_urls([make_item("a"), make_item("b", 100, 400), make_item("c")])
+        assert url_list == ["a@260w_260h_1e_1c.webp", "b@260w_260h_!header.webp", "c@260w_260h_1e_1c.webp"]
+        assert size == (346, 346)
+
+
+class TestAssetPlanner:
+    @pytest.fixture(autouse=True)
+    def _setup_method(self):
+        self.planner = AssetPlanner(SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal").set_style)
+
+    def test_plan_walks_forward_and_deduplicates(self) -> None:
+        header = SimpleNamespace(face="face", pendant=None)
+        emoji_node = SimpleNamespace(type="RICH_TEXT_NODE_TYPE_EMOJI", emoji=SimpleNamespace(icon_url="emoji"))
+        text = SimpleNamespace(text="[doge]", rich_text_nodes=[emoji_node, emoji_node])
+        major = SimpleNamespace(type="MAJOR_TYPE_ARCHIVE", archive=SimpleNamespace(cover="cover"))
+        forward = SimpleNamespace(header=header, text=None, major=major, additional=None)
+        message = SimpleNamespace(header=header, text=text, major=None, additional=None, forward=forward)
+
+        assert self.planner.plan(message) == [
+            AssetRequest("face@240w_240h_1c_1s.webp", None, "face"),
+            AssetRequest("emoji", (60, 60), "emoji"),
+            AssetRequest("cover@505w_285h_1c.webp", (1010, 570), "cover"),
+        ]
+
+    def test_broken_section_is_skipped(self) -> None:
+        header = SimpleNamespace(face=None, pendant=SimpleNamespace(image="pendant"))
+        major = SimpleNamespace(type="MAJOR_TYPE_ARCHIVE", archive=None)
+        message = SimpleNamespace(header=header, text=None, major=major, additional=None, forward=None)
+
+        assert self.planner.plan(message) == [AssetRequest("pendant@360w_360h.webp", None, "pendant")]
+
+    def test_stickers_in_atlas_are_not_planned(self) -> None:
+        atlas = StickerAtlas(60)
+        atlas.add("known", skia.Image.fromarray(np.zeros((60, 60, 4), dtype=np.uint8)))
+        self.planner.atlas = atlas
+        nodes = [
+            SimpleNamespace(type="RICH_TEXT_NODE_TYPE_EMOJI", emoji=SimpleNamespace(icon_url=url))
+            for url in ("known", "new")
+        ]
+        text = SimpleNamespace(text="[doge][tv_doge]", rich_text_nodes=nodes)
+        message = SimpleNamespace(header=None, text=text, major=None, additional=None, forward=None)
+
+        assert self.planner.plan(message) == [AssetRequest("new", (60, 60), "emoji")]
@@ -0,0 +1,107 @@
+from os import path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from dynamicadaptor.AddonCard import Additional, Common, Goods, GoodsItem, Ugc
+from dynamicadaptor.Majors import BgImage, Blocked, Major
+
+from dynrender_skia.DynAdditional import DynAddCommon, DynAddGoods, DynAddUgc
+from dynrender_skia.DynConfig import SetDynStyle
+from dynrender_skia.DynHeader import RepostHeader
+from dynrender_skia.DynMajor import DynMajorArchive, DynMajorBlocked
+
+
+@pytest.mark.asyncio
+class TestMissingAssets:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        self.static_path = str(tmp_path)
+        self.style = SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal").set_style
+        self.fetcher = MagicMock(executor=None)
+
+    async def test_repost_header_without_face(self):
+        self.fetcher.get_pictures = AsyncMock(return_value=None)
+        message = MagicMock(face="https://i0.hdslb.com/bfs/face/a.jpg", mid=1)
+        message.name = "bilibili"
+        img = await RepostHeader(self.static_path, self.style, self.fetcher).run(message)
+        assert img is not None
+        assert img.shape == (100, 1080, 4)
+
+    async def test_blocked_major_without_images(self):
+        self.fetcher.get_pictures = AsyncMock(return_value=[None, None])
+        image = BgImage(img_dark="https://i0.hdslb.com/bfs/a.png", img_day="https://i0.hdslb.com/bfs/b.png")
+        major = Major(
+            type="MAJOR_TYPE_BLOCKED",
+            blocked=Blocked(hint_message="line one\nline two", blocked_type=1, bg_img=image, icon=image),
+        )
+        img = await DynMajorBlocked(self.static_path, self.style, major, self.fetcher).run(False)
+        assert img is not None
+        assert img.shape == (1200, 1080, 4)
+
+    @pytest.mark.parametrize(
+        ("section", "additional"),
+        [
+            (
+                DynAddGoods,
+                Additional(
+                    type="ADDITIONAL_TYPE_GOODS",
+                    goods=Goods(head_text="UP主的推荐", items=[GoodsItem(cover="a.jpg", price="10", name="商品")]),
+                ),
+            ),
+            (
+                DynAddGoods,
+                Additional(
+                    type="ADDITIONAL_TYPE_GOODS",
+                    goods=Goods(
+                        head_text="UP主的推荐",
+                        items=[GoodsItem(cover=f"{i}.jpg", price="10", name="商品") for i in range(3)],
+                    ),
+                ),
+            ),
+            (
+                DynAddUgc,
+                Additional(
+                    type="ADDITIONAL_TYPE_UGC",
+                    ugc=Ugc(
+                        cover="https://i0.hdslb.com/bfs/a.jpg", title="视频", desc_second="1万播放", duration="1:00"
+                    ),
+                ),
+            ),
+            (
+                DynAddCommon,
+                Additional(
+                    type="ADDITIONAL_TYPE_COMMON",
+                    common=Common(
+                        sub_type="game",
+                        head_text="相关游戏",
+                        cover="https://i0.hdslb.com/bfs/a.jpg",
+                        desc1="游戏",
+                        title="游戏",
+                    ),
+                ),
+            ),
+        ],
+    )
+    async def test_additional_without_cover(self, section, additional, dynrender_instance):
+        self.fetcher.get_pictures = AsyncMock(
+            side_effect=lambda url, *args, **kwargs: None if isinstance(url, str) else [None] * len(url)
+        )
+        src_path = path.join(dynrender_instance.static_path, "Src")
+        img = await section(src_path, self.style, additional, self.fetcher).run(False)
+        assert img is not None
+
+
+@pytest.mark.asyncio
+class TestMajorSizing:
+    @pytest.mark.parametrize(("title", "height"), [("视频标题", 695), ("", 600)])
+    async def test_video_card_is_sized_to_its_title(self, title, height, dynrender_instance):
+        style = SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal").set_style
+        fetcher = MagicMock(executor=None, get_pictures=AsyncMock(return_value=None))
+        major = MagicMock()
+        major.archive.title = title
+        major.archive.badge = None
+        major.archive.duration_text = "10:00"
+        src_path = path.join(dynrender_instance.static_path, "Src")
+        img = await DynMajorArchive(src_path, style, major, fetcher).run(False)
+        assert img is not None
+        assert img.shape == (height, 1080, 4)
@@ -0,0 +1,74 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+import pytest_asyncio
+import skia
+from dynamicadaptor.Content import RichTextDetail, Text
+
+from dynrender_skia.DynCache import StickerAtlas
+from dynrender_skia.DynConfig import SetDynStyle
+from dynrender_skia.DynLayout import TextEngine
+from dynrender_skia.DynText import BiliText
+
+
+@pytest.mark.asyncio
+class TestBiliTextLayout:
+    @pytest_asyncio.fixture(autouse=True)
+    async def setup(self, tmp_path):
+        self.text = BiliText(str(tmp_path), SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal").set_style)
+        font = skia.Font(skia.Typeface.MakeDefault(), 30)  # type: ignore
+        self.text.engine = TextEngine(font, font, MagicMock(return_value=None))
+        self.text.bg_color = (255, 255, 255, 255)
+        self.color = skia.Color(0, 0, 0, 255)
+
+    async def test_lines_render_into_one_surface(self):
+        await self.text.layout_plain_text("a" * 200 + "\n\nb", self.color)
+        lines = len(self.text.lines)
+        img = await self.text.render_lines()
+        assert lines > 3
+        assert img.shape == (lines * 60, 1080, 4)
+
+    async def test_trailing_empty_line_is_dropped(self):
+        await self.text.layout_plain_text("a\n", self.color)
+        img = await self.text.render_lines()
+        assert img.shape == (60, 1080, 4)
+
+    async def test_nothing_to_render(self):
+        assert await self.text.render_lines() is None
+
+    async def test_sticker_wraps_at_bound(self):
+        self.text.atlas = StickerAtlas(45)
+        self.text.atlas.add("http://i0.hdslb.com/doge.png", skia.Image.fromarray(np.zeros((45, 45, 4), np.uint8)))
+        self.text.emoji_dict = {"[doge]": "http://i0.hdslb.com/doge.png"}
+        for _ in range(21):
+            self.text.layout_emoji("[doge]")
+        assert [len(line) for line in self.text.lines] == [20, 1]
+        assert (await self.text.render_lines()).shape == (120, 1080, 4)
+
+
+@pytest.mark.asyncio
+class TestBiliTextParagraph:
+    @pytest_asyncio.fixture(autouse=True)
+    async def setup(self, tmp_path):
+        style = SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal", "paragraph").set_style
+        self.text = BiliText(str(tmp_path), style)
+        self.text.bg_color = (255, 255, 255, 255)
+
+    async def test_plain_nodes_are_one_paragraph(self):
+        dyn_text = Text(
+            text="",
+            rich_text_nodes=[
+                RichTextDetail(type="RICH_TEXT_NODE_TYPE_TEXT", text="a" * 200),
+                RichTextDetail(type="RICH_TEXT_NODE_TYPE_AT", text="@bilibili"),
+            ],
+        )
+        await self.text.make_text_image(dyn_text)
+        assert len(self.text.image_list) == 1
+        assert self.text.image_list[0].shape[0] > 60
+        assert self.text.lines == [[]]
+
+    async def test_empty_text_has_no_image(self):
+        dyn_text = Text(text="", rich_text_nodes=[RichTextDetail(type="RICH_TEXT_NODE_TYPE_TEXT", text="")])
+        await self.text.make_text_image(dyn_text)
+        assert self.text.image_list == []
@@ -1,6 +1,7 @@
+import gc
 import pathlib
 from pathlib import Path
-from unittest.mock import MagicMock, AsyncMock, patch
+from unittest.mock import MagicMock, patch
 
 import httpx
 import numpy as np
@@ -10,8 +11,23 @@ import respx
 import skia
 
 from dynrender_skia.DynConfig import SetDynStyle
-from dynrender_skia.DynTools import merge_pictures, request_img, get_pictures, DrawText, paste
-from dynrender_skia.exception import ParseError
+from dynrender_skia.DynFont import font_fallback
+from dynrender_skia.DynLayout import layout_cache
+from dynrender_skia.DynTools import (
+    DrawText,
+    circle_image,
+    decode_img,
+    decode_scaled_img,
+    download_img,
+    get_pictures,
+    merge_pictures,
+    paste,
+    request_img,
+    round_corner_image,
+    run_in_executor,
+    sniff_image_header,
+)
+from dynrender_skia.exception import ImageTooLargeError
 
 
 @pytest.mark.asyncio
@@ -211,74 +227,6 @@ class TestDrawText:
         assert cleaned_text == ""
         assert emoji_info == {}
 
-    async def test_needs_new_line_returns_true_when_exceeding_max_width(self):
-        assert DrawText._needs_new_line(1100, 1080) is True
-
-    async def test_needs_new_line_returns_false_when_within_max_width(self):
-        assert DrawText._needs_new_line(900, 1080) is False
-
-    async def test_needs_new_line_returns_true_when_equal_to_max_width(self):
-        assert DrawText._needs_new_line(1080, 1080) is False
-
-    async def test_font_contains_character_returns_true_for_valid_character(self):
-        font = skia.Font(skia.Typeface.MakeDefault(), 12)  # type: ignore
-        assert DrawText._font_contains_character(font, "A") is True
-
-    async def test_font_contains_character_returns_false_for_invalid_character(self):
-        font = skia.Font(skia.Typeface.MakeDefault(), 12)  # type: ignore
-        assert DrawText._font_contains_character(font, "\uffff") is False
-
-    async def test_advance_to_next_line_adds_line_spacing_when_within_max_height(self):
-        draw_text = DrawText(style=self.style)
-        canvas = skia.Surface(1080, 1920).getCanvas()
-        current_y, current_x = draw_text._advance_to_next_line(
-            current_y=100,
-            line_spacing=20,
-            max_height=200,
-            initial_x=0,
-            canvas=canvas,
-            font=skia.Font(),
-            paint=skia.Paint(),
-            current_x=50,
-        )
-        assert current_y == 120
-        assert current_x == 0
-
-    async def test_advance_to_next_line_draws_ellipsis_when_exceeding_max_height(self):
-        draw_text = DrawText(style=self.style)
-        canvas = skia.Surface(1080, 1920).getCanvas()
-        current_y, current_x = draw_text._advance_to_next_line(
-            current_y=180,
-            line_spacing=30,
-            max_height=200,
-            initial_x=0,
-            canvas=canvas,
-            font=skia.Font(),
-            paint=skia.Paint(),
-            current_x=50,
-        )
-        assert current_y == 200
-        assert current_x == 0
-
-    async def test_emoji_info_with_single_emoji(self):
-        draw_text = DrawText(style=self.style)
-        offset, character, font = draw_text._handle_emoji(0, {0: [2, "😊"]})
-        assert offset == 2
-        assert character == "😊"
-        assert font == draw_text.emoji_font
-
-    async def test_emoji_info_with_multiple_emojis(self):
-        draw_text = DrawText(style=self.style)
-        offset, character, font = draw_text._handle_emoji(0, {0: [2, "😊"], 2: [4, "🌍"]})
-        assert offset == 2
-        assert character == "😊"
-        assert font == draw_text.emoji_font
-
-    async def test_emoji_info_with_no_emoji(self):
-        draw_text = DrawText(style=self.style)
-        with pytest.raises(ParseError):
-            _ = draw_text._handle_emoji(0, {})
-
 
 @pytest.mark.asyncio
 class TestPasteFunction:
@@ -320,114 +268,119 @@ class TestPasteFunction:
             await paste(canvas, self.target, self.position)  # type: ignore
         assert any("Failed to paste image" in record.message for record in caplog.records)
 
+    async def test_paste_skips_missing_image(self):
+        await self.async_setup()
+        await paste(self.canvas, None, self.position)
+        self.canvas.drawImageRect.assert_not_called()
+
 
 @pytest.mark.asyncio
 class TestDrawTextFunction:
-    async def async_setup(self, text="Hello, world!", emoji_info=None):
+    async def async_setup(self, text="Hello, world!"):
         self.canvas = MagicMock(spec=skia.Canvas)
         self.text = text
         self.font_size = 20
-        self.position_and_bounds = (10, 20, 200, 100, 5)
         self.font_color = (0, 0, 0, 255)
+        self.draw_text_instance = DrawText(SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal").set_style)
+        self.draw_text_instance.text_font = skia.Font(skia.Typeface.MakeDefault(), 20)  # type: ignore
+        self.draw_text_instance.match_font = MagicMock(return_value=None)
+        layout_cache.clear()
 
-        font_family = "Noto Sans SC"
-        emoji_font_family = "Noto Color Emoji"
-        font_style = "Normal"
-        self.draw_text_instance = DrawText(SetDynStyle(font_family, emoji_font_family, font_style).set_style)
-
-        # 模拟方法
-        self.draw_text_instance.set_font_sizes = MagicMock()
-        self.draw_text_instance.initialize_paint = MagicMock(
-            return_value=skia.Paint(AntiAlias=True, Color=skia.Color(*self.font_color))
+    async def draw(self, position_and_bounds):
+        await self.draw_text_instance.draw_text(
+            self.canvas, self.text, self.font_size, position_and_bounds, self.font_color
         )
-        self.draw_text_instance.extract_emoji_info = AsyncMock(return_value=(self.text, emoji_info or {}))
-        self.draw_text_instance._handle_emoji = MagicMock(return_value=(7, "🌍", skia.Font()))
-        self.draw_text_instance._font_contains_character = MagicMock(return_value=True)
-
-        # 使用实际的 skia.Font 对象
-        self.actual_font = skia.Font()
-        self.draw_text_instance.match_font = MagicMock(return_value=self.actual_font)
-        self.draw_text_instance.text_font = self.actual_font
-
-        # 包装 measureText 行为
-        self.original_measure_text = self.actual_font.measureText
 
-        def measure_text_wrapper(_text):
-            return 50 if "🌍" in _text else 500
+    async def test_draw_text_uses_one_blob_per_line(self):
+        await self.async_setup()
+        await self.draw((10, 20, 1000, 100, 5))
 
-        self.measure_text_mock = patch.object(skia.Font, "measureText", side_effect=measure_text_wrapper)
-        self.measure_text_mock.start()
+        assert self.canvas.drawTextBlob.call_count == 1
 
-        self.draw_text_instance._needs_new_line = MagicMock(side_effect=lambda x, _: x > 200)
-        self.draw_text_instance._advance_to_next_line = MagicMock(return_value=(80, 10))
+    async def test_draw_text_stops_at_newline(self):
+        await self.async_setup(text="Hello,\nworld!")
+        await self.draw((10, 20, 1000, 100, 5))
 
-    async def _teardown_method(self):
-        self.measure_text_mock.stop()
+        assert self.canvas.drawTextBlob.call_count == 1
 
-    async def test_draw_text(self):
+    async def test_draw_text_with_wrapping(self):
         await self.async_setup()
-        await self.draw_text_instance.draw_text(
-            self.canvas, self.text, self.font_size, self.position_and_bounds, self.font_color
-        )
+        await self.draw((10, 20, 60, 1000, 30))
 
-        self.draw_text_instance.set_font_sizes.assert_called_once_with(self.font_size)  # type: ignore
-        self.draw_text_instance.initialize_paint.assert_called_once_with(self.font_color)  # type: ignore
-        self.draw_text_instance.extract_emoji_info.assert_called_once_with(self.text)  # type: ignore
-        assert self.draw_text_instance._handle_emoji.call_count == 0  # type: ignore
-        assert self.draw_text_instance._font_contains_character.call_count > 0  # type: ignore
-        assert self.draw_text_instance._needs_new_line.call_count > 0  # type: ignore
+        assert self.canvas.drawTextBlob.call_count > 1
 
-        await self._teardown_method()
+    async def test_draw_text_exceeds_max_height(self):
+        await self.async_setup()
+        await self.draw((10, 20, 60, 50, 30))
 
-    async def test_draw_text_with_newline(self):
-        await self.async_setup(text="Hello,\nworld!")
-        await self.draw_text_instance.draw_text(
-            self.canvas, self.text, self.font_size, self.position_and_bounds, self.font_color
-        )
+        assert self.canvas.drawTextBlob.call_count == 2
+        _, x, y, _ = self.canvas.drawTextBlob.call_args[0]
+        assert x > 60
+        assert y == 20
 
-        assert self.canvas.drawTextBlob.call_count == 6
+    async def test_measure_matches_draw(self):
+        await self.async_setup(text="Hello, world!\tagain")
+        metrics = await self.draw_text_instance.measure(self.text, self.font_size, (10, 20, 60, 1000, 30))
+        await self.draw((10, 20, 60, 1000, 30))
 
-        await self._teardown_method()
+        assert metrics.lines == self.canvas.drawTextBlob.call_count
 
-    async def test_draw_text_with_emoji(self):
-        await self.async_setup(text="Hello 🌍", emoji_info={6: [7, "🌍"]})
+    async def test_draw_text_with_font_style(self):
+        await self.async_setup()
+        text_font = self.draw_text_instance.text_font
         await self.draw_text_instance.draw_text(
-            self.canvas, self.text, self.font_size, self.position_and_bounds, self.font_color
+            self.canvas, self.text, 30, (10, 20, 1000, 100, 5), self.font_color, skia.FontStyle.Bold()
         )
 
-        assert self.draw_text_instance._handle_emoji.call_count == 1  # type: ignore
+        assert self.canvas.drawTextBlob.call_count == 1
+        assert self.draw_text_instance.text_font is text_font
 
-        await self._teardown_method()
 
-    async def test_draw_text_with_wrapping(self):
-        await self.async_setup()
-        self.draw_text_instance._needs_new_line = MagicMock(side_effect=lambda x, _: x > 50)  # 小于50就换行
-
-        await self.draw_text_instance.draw_text(
-            self.canvas, self.text, self.font_size, self.position_and_bounds, self.font_color
+@pytest.mark.asyncio
+class TestDrawTextParagraph:
+    @pytest_asyncio.fixture(autouse=True)
+    async def setup(self):
+        self.canvas = MagicMock(spec=skia.Canvas)
+        self.draw_text_instance = DrawText(
+            SetDynStyle("Noto Sans SC", "Noto Color Emoji", "Normal", "paragraph").set_style
         )
 
-        assert self.draw_text_instance._advance_to_next_line.call_count > 0  # type: ignore
+    async def test_fitting_text_is_drawn_as_paragraph(self):
+        surface = skia.Surface(400, 100)
+        canvas = surface.getCanvas()
+        canvas.clear(skia.ColorWHITE)
+        bounds = (10, 50, 390, 100, 0)
 
-        await self._teardown_method()
+        assert self.draw_text_instance.draw_paragraph(canvas, "Hello", 20, bounds, (0, 0, 0, 255))
+        metrics = await self.draw_text_instance.measure("Hello", 20, bounds)
+        font_metrics = self.draw_text_instance.make_engine(20).text_font.getMetrics()
+        pixels = surface.makeImageSnapshot().toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
+        rows, columns = (pixels[:, :, :3] < 255).any(axis=2).nonzero()
+        assert len(rows) > 0
+        assert rows.min() >= 50 + font_metrics.fAscent - 1
+        assert rows.max() <= 50 + font_metrics.fDescent + 1
+        assert rows.max() - rows.min() + 1 <= metrics.height
+        assert columns.min() >= 10
+        assert columns.max() <= 10 + metrics.width + 2
 
-    async def test_draw_text_exceeds_max_height(self):
-        await self.async_setup()
-        self.draw_text_instance._advance_to_next_line = MagicMock(side_effect=lambda *args: (args[0] + 100, args[1]))
+    @pytest.mark.parametrize("text", ["Hello", "Hello world", "Hello world " * 3, "a" * 100])
+    async def test_paragraph_breaks_like_engine(self, text):
+        bounds = (10, 50, 300, 1000, 30)
+        canvas = skia.Surface(400, 100).getCanvas()
+        metrics = await self.draw_text_instance.measure(text, 20, bounds)
 
-        await self.draw_text_instance.draw_text(
-            self.canvas, self.text, self.font_size, self.position_and_bounds, self.font_color
-        )
+        assert self.draw_text_instance.draw_paragraph(canvas, text, 20, bounds, (0, 0, 0, 255)) == (metrics.lines == 1)
 
-        assert self.draw_text_instance._advance_to_next_line.call_count > 0
-        assert self.canvas.drawTextBlob.call_count < len(self.text)
+    async def test_wrapping_text_falls_back_to_engine(self):
+        await self.draw_text_instance.draw_text(self.canvas, "a" * 100, 20, (10, 20, 60, 1000, 30), (0, 0, 0, 255))
 
-        await self._teardown_method()
+        assert self.canvas.drawTextBlob.call_count > 1
 
 
 class TestMatchFontMethod:
     @pytest.fixture(autouse=True)
     def _setup_method(self):
+        font_fallback.clear()
         font_family = "Noto Sans SC"
         emoji_font_family = "Noto Color Emoji"
         font_style = "Normal"
@@ -472,3 +425,112 @@ class TestSetFontSizesMethod:
 
         self.text_font_mock.setSize.assert_called_once_with(font_size)
         self.emoji_font_mock.setSize.assert_called_once_with(font_size)
+
+
+@pytest.mark.asyncio
+class TestImageHelpers:
+    @staticmethod
+    def make_image(size: int) -> skia.Image:
+        return skia.Image.fromarray(
+            np.full([size, size, 4], 255, np.uint8), colorType=skia.ColorType.kRGBA_8888_ColorType
+        )
+
+    async def test_run_in_executor_returns_result(self) -> None:
+        img = self.make_image(100)
+        resized = await run_in_executor(img.resize, 50, 50)
+        assert resized.width() == 50
+        assert resized.height() == 50
+
+    async def test_round_corner_image_clears_corners(self) -> None:
+        result = round_corner_image(self.make_image(100), 20).toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)
+        assert result[0, 0, 3] == 0
+        assert result[50, 50, 3] == 255
+
+    async def test_circle_image_resizes(self) -> None:
+        result = circle_image(self.make_image(240), 120)
+        assert result.width() == 120
+        assert result.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType)[0, 0, 3] == 0
+
+    async def test_decode_img_scales_large_sources(self) -> None:
+        content = self.make_image(400).encodeToData(skia.EncodedImageFormat.kJPEG, 90).bytes()
+        img = decode_img(content, (50, 50))
+        assert img is not None
+        assert (img.width(), img.height()) == (50, 50)
+
+    async def test_decode_scaled_img_skips_small_downscale(self) -> None:
+        content = self.make_image(100).encodeToData(skia.EncodedImageFormat.kPNG, 100).bytes()
+        assert decode_scaled_img(content, (80, 80)) is None
+        assert decode_img(content, (80, 80)).width() == 80
+
+    async def test_decode_img_keeps_aspect_ratio_for_zero_height(self) -> None:
+        surface = skia.Surface(400, 100)
+        surface.getCanvas().clear(skia.ColorWHITE)
+        content = surface.makeImageSnapshot().encodeToData(skia.EncodedImageFormat.kJPEG, 90).bytes()
+        assert decode_img(content, (100, 0)).dimensions() == skia.ISize(100, 25)
+        assert decode_img(content, (300, 0)).dimensions() == skia.ISize(300, 75)
+
+    async def test_decoded_image_outlives_content(self) -> None:
+        content = self.make_image(64).encodeToData(skia.EncodedImageFormat.kPNG, 100).bytes()
+        img = decode_img(content)
+        del content
+        gc.collect()
+        garbage = [bytes(range(256)) * 64 for _ in range(256)]
+        assert not img.isLazyGenerated()
+        assert (img.toarray(colorType=skia.ColorType.kRGBA_8888_ColorType) == 255).all()
+        del garbage
+
+    async def test_decode_scaled_img_rejects_invalid_content(self) -> None:
+        assert decode_scaled_img(b"not an image", (10, 10)) is None
+
+
+class TestImageHeader:
+    @staticmethod
+    def encode(fmt: skia.EncodedImageFormat, width: int = 30, height: int = 20) -> bytes:
+        img = skia.Image.fromarray(
+            np.full([height, width, 4], 255, np.uint8), colorType=skia.ColorType.kRGBA_8888_ColorType
+        )
+        return img.encodeToData(fmt, 90).bytes()
+
+    @pytest.mark.parametrize(
+        ("fmt", "name"),
+        [
+            (skia.EncodedImageFormat.kPNG, "png"),
+            (skia.EncodedImageFormat.kJPEG, "jpeg"),
+            (skia.EncodedImageFormat.kWEBP, "webp"),
+        ],
+    )
+    def test_sniff_dimensions(self, fmt: skia.EncodedImageFormat, name: str) -> None:
+        assert sniff_image_header(self.encode(fmt)) == (name, 30, 20)
+
+    def test_sniff_gif(self) -> None:
+        assert sniff_image_header(b"GIF89a\x1e\x00\x14\x00") == ("gif", 30, 20)
+
+    def test_sniff_needs_more_data(self) -> None:
+        assert sniff_image_header(self.encode(skia.EncodedImageFormat.kPNG)[:12]) is None
+        assert sniff_image_header(b"not an image") is None
+
+    @pytest.mark.asyncio
+    async def test_download_rejects_too_many_pixels(self, mock_img_url: str) -> None:
+        async with respx.mock(base_url=mock_img_url) as mock:
+            mock.get(mock_img_url).respond(content=self.encode(skia.EncodedImageFormat.kPNG, 200, 200))
+            async with httpx.AsyncClient() as client:
+                with pytest.raises(ImageTooLargeError):
+                    await download_img(client, mock_img_url, max_pixels=100 * 100)
+
+    @pytest.mark.asyncio
+    async def test_download_rejects_too_many_bytes(self, mock_img_url: str, img_path: Path) -> None:
+        async with respx.mock(base_url=mock_img_url) as mock:
+            mock.get(mock_img_url).respond(content=img_path.read_bytes())
+            async with httpx.AsyncClient() as client:
+                with pytest.raises(ImageTooLargeError):
+                    await download_img(client, mock_img_url, max_bytes=16)
+                assert await download_img(client, mock_img_url) == (img_path.read_bytes(), {})
+
+    @pytest.mark.asyncio
+    async def test_download_conditional_not_modified(self, mock_img_url: str) -> None:
+        async with respx.mock(base_url=mock_img_url) as mock:
+            route = mock.get(mock_img_url).respond(status_code=304, headers={"ETag": '"abc"'})
+            async with httpx.AsyncClient() as client:
+                result = await download_img(client, mock_img_url, validators={"etag": '"abc"'})
+        assert result == (None, {"etag": '"abc"'})
+        assert route.calls.last.request.headers["If-None-Match"] == '"abc"'